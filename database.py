@@ -1,19 +1,31 @@
 import pandas as pd
-import requests
+import numpy as np
 import hashlib
 import streamlit as st
 import io
+import gzip
 import json
-from datetime import datetime
+import queue
+import atexit
+import re
+import sqlite3
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
 from supabase import create_client 
+from postgrest.utils import SyncClient
+import pyarrow.parquet as pq
 
-# استيراد أدوات التقارير
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+import local_ledger
+
+# محرك التقارير (كشوف الحساب PDF)
+from pdf_engine import create_pdf_report, render_statements_zip
+# طبقة الاتصال المشتركة (تجميع الاتصالات، إعادة المحاولة، قاطع الدائرة)
+from http_transport import create_http_client
 
 # --- 1. إعدادات الاتصال الآمنة (باستخدام Secrets) ---
 # سيبحث Streamlit عن هذه القيم في إعدادات المنصة وليس في الكود
@@ -24,19 +36,35 @@ except KeyError:
     st.error("⚠️ لم يتم العثور على مفاتيح الاتصال. تأكد من ضبط Secrets في Streamlit Cloud.")
     st.stop()
 
-# الهيدرز الخاصة بـ Requests
-HEADERS = {
-    "apikey": KEY,
-    "Authorization": f"Bearer {KEY}",
-    "Content-Type": "application/json",
-    "Prefer": "return=representation"
-}
-
 # إنشاء اتصال supabase الرسمي
 # نضمن أن الرابط ينتهي بالشكل الصحيح لمكتبة السحاب
 supabase_url = URL.replace("/rest/v1", "") if "/rest/v1" in URL else URL
 supabase = create_client(supabase_url, KEY)
 
+# كل استدعاءات الجداول والدوال (table / rpc) تمر عبر عميل اتصال مشترك واحد (انظر http_transport.py)
+_default_session = supabase.postgrest.session
+supabase.postgrest.session = create_http_client(_default_session.base_url, _default_session.headers, SyncClient)
+_default_session.close()
+
+# الدوال المخزنة (RPC) غير المثبتة في القاعدة، حتى لا نكرر محاولة فاشلة في كل طلب
+_MISSING_RPC = set()
+
+def _rpc(fn_name, params):
+    """
+    استدعاء دالة مخزنة في القاعدة (انظر supabase/migrations).
+    تعيد (True, البيانات) عند النجاح أو (False, None) إذا لم تكن الدالة مثبتة بعد
+    ليستخدم المستدعي الطريقة البديلة، وترفع الخطأ في غير ذلك.
+    """
+    if fn_name in _MISSING_RPC:
+        return False, None
+    try:
+        return True, supabase.rpc(fn_name, params).execute().data
+    except Exception as e:
+        if "PGRST202" in str(e) or "Could not find the function" in str(e):
+            _MISSING_RPC.add(fn_name)
+            return False, None
+        raise
+
 def check_system_health():
     try:
         # فحص وجود الجداول الأساسية
@@ -113,109 +141,839 @@ def add_new_user(username, full_name, password, role, can_delete, can_reports, c
 def delete_user(username):
     """حذف مستخدم نهائياً من قاعدة البيانات"""
     try:
-        response = requests.delete(f"{URL}/users?username=eq.{username}", headers=HEADERS)
-        if response.status_code in [200, 204]:
+        res = supabase.table("users").delete().eq("username", username).execute()
+        if res.data:
             return True, f"تم حذف المستخدم {username} بنجاح."
-        return False, f"فشل الحذف، استجابة السيرفر: {response.status_code}"
+        return False, f"فشل الحذف، لم يتم العثور على المستخدم {username}."
     except Exception as e:
         return False, str(e)
 
 # --- 4. العمليات المحاسبية والبيانات العامة ---
 
-def db_fetch(query, params=None):
-    # تعريف الأعمدة القياسية لضمان ثبات الواجهة
-    STD_COLUMNS = {
-        "accounts": ["id", "acc_name", "name", "current_balance", "category", "opening_balance"],
-        "journal": ["id", "date", "jv_date", "acc_name", "total_amount", "debit", "credit", "op_type", "description", "ref_no"]
-    }
-    
-    table_name = "accounts"
-    
-    try:
-        # 1. استخراج اسم الجدول
-        clean_query = query.strip().upper()
-        if "FROM " in clean_query:
-            table_name = clean_query.split("FROM ")[1].split(" ")[0].lower().strip()
-        else:
-            table_name = query.strip().lower()
+# أسماء أعمدة تستخدمها الواجهة بينما اسمها الفعلي في القاعدة مختلف
+COLUMN_ALIASES = {
+    "accounts": {"name": "acc_name"},
+    "journal": {"name": "acc_name", "jv_date": "date"},
+}
 
-        # 2. جلب البيانات
-        response = supabase.table(table_name).select("*").execute()
-        df = pd.DataFrame(response.data) if response.data else pd.DataFrame()
+# تعريف الأعمدة القياسية لضمان ثبات الواجهة
+STD_COLUMNS = {
+    "accounts": ["id", "acc_name", "name", "current_balance", "category", "opening_balance"],
+    "journal": ["id", "date", "jv_date", "acc_name", "total_amount", "debit", "credit", "op_type", "description", "ref_no"]
+}
 
-        # 3. معالجة البيانات (حتى وهي موجودة في القاعدة)
-        if not df.empty:
-            # --- حل مشكلة التاريخ (ArrowTypeError) ---
-            for col in df.columns:
-                # تحويل أي عمود يحتوي على كلمة تاريخ إلى نص ليعرضه Streamlit بلا مشاكل
-                if 'date' in col.lower() or 'التاريخ' in col or 'jv_date' in col:
-                    df[col] = df[col].astype(str)
-                
-                # تحويل القيم الفارغة في مبالغ المدين والدائن إلى أصفار بدلاً من None
-                if col in ['debit', 'credit', 'current_balance', 'total_amount', 'opening_balance']:
-                    df[col] = df[col].fillna(0)
-
-            # توحيد مسميات الأعمدة
-            if "acc_name" in df.columns and "name" not in df.columns:
-                df["name"] = df["acc_name"]
-            
-            if table_name == "journal":
-                if "date" in df.columns and "jv_date" not in df.columns:
-                    df["jv_date"] = df["date"]
-                elif "jv_date" in df.columns and "date" not in df.columns:
-                    df["date"] = df["jv_date"]
+_QUERY_RE = re.compile(
+    r"^\s*SELECT\s+(?P<columns>.+?)\s+FROM\s+(?P<table>\w+)"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+_CONDITION_RE = re.compile(
+    r"^(?P<col>\w+)\s*(?:"
+    r"(?P<op>=|!=|<>|>=|<=|>|<)\s*(?P<value>.+)"
+    r"|(?P<not>NOT\s+)?(?P<kw>IN|LIKE|ILIKE)\s+(?P<arg>.+)"
+    r"|IS\s+(?P<is_not>NOT\s+)?NULL)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# حجم الصفحة في القراءة التدفقية (يطابق سقف max-rows الافتراضي في Supabase)
+PAGE_SIZE = 1000
+
+_OPERATOR_METHODS = {"=": "eq", "!=": "neq", "<>": "neq", ">": "gt", ">=": "gte", "<": "lt", "<=": "lte"}
+
+
+def _split_outside_quotes(text, separator):
+    """تقسيم النص عند الفاصل (كلمة أو رمز) مع تجاهل ما بين علامات التنصيص والأقواس"""
+    parts, current, depth, in_quote, i = [], [], 0, False, 0
+    sep_re = re.compile(separator, re.IGNORECASE)
+    while i < len(text):
+        ch = text[i]
+        if ch == "'":
+            in_quote = not in_quote
+        elif not in_quote and ch == "(":
+            depth += 1
+        elif not in_quote and ch == ")":
+            depth -= 1
+        elif not in_quote and depth == 0:
+            m = sep_re.match(text, i)
+            if m:
+                parts.append("".join(current).strip())
+                current = []
+                i = m.end()
+                continue
+        current.append(ch)
+        i += 1
+    parts.append("".join(current).strip())
+    return [p for p in parts if p]
+
+
+def _parse_sql_value(token):
+    """تحويل قيمة حرفية في الاستعلام إلى قيمة بايثون"""
+    token = token.strip()
+    if len(token) >= 2 and token[0] == token[-1] == "'":
+        return token[1:-1].replace("''", "'")
+    upper = token.upper()
+    if upper in ("TRUE", "FALSE"):
+        return upper == "TRUE"
+    if upper == "NULL":
+        return None
+    if re.fullmatch(r"-?\d+", token):
+        return int(token)
+    if re.fullmatch(r"-?\d*\.\d+", token):
+        return float(token)
+    raise ValueError(f"قيمة غير مدعومة: {token}")
+
+
+def _parse_condition(condition, aliases):
+    """تحويل شرط واحد من WHERE إلى (الدالة، العمود، القيمة، نفي)"""
+    m = _CONDITION_RE.match(condition.strip())
+    if not m:
+        raise ValueError(condition)
+    col = aliases.get(m.group("col").lower(), m.group("col").lower())
+
+    if m.group("op"):
+        return (_OPERATOR_METHODS[m.group("op")], col, _parse_sql_value(m.group("value")), False)
+
+    if m.group("kw"):
+        kw = m.group("kw").lower()
+        negate = bool(m.group("not"))
+        arg = m.group("arg").strip()
+        if kw == "in":
+            if not (arg.startswith("(") and arg.endswith(")")):
+                raise ValueError(condition)
+            values = [_parse_sql_value(v) for v in _split_outside_quotes(arg[1:-1], r",")]
+            return ("in_", col, values, negate)
+        return (kw, col, _parse_sql_value(arg), negate)
+
+    return ("is_", col, "null", bool(m.group("is_not")))
+
+
+def parse_query(query):
+    """
+    ترجمة نصوص الاستعلام التي يستخدمها التطبيق إلى مواصفات تفهمها PostgREST:
+    الأعمدة المطلوبة، شروط WHERE (= و IN و LIKE ...)، الترتيب والحد الأقصى.
+    - شروط WHERE التي لا يمكن تمريرها للخادم (OR مثلاً) تُجمع في 'client_where' لتُطبق محلياً بعد الجلب
+    - ما عدا ذلك مما لا يمكن تمريره يُسجل في 'unsupported' ليُحذّر منه
+    """
+    spec = {"table": None, "columns": ["*"], "filters": [], "order": [], "limit": None, "client_where": None, "unsupported": []}
+
+    m = _QUERY_RE.match(query)
+    if not m:
+        # صيغة مختصرة: اسم الجدول فقط
+        spec["table"] = query.strip().split()[0].lower() if query.strip() else "accounts"
+        return spec
+
+    table = m.group("table").lower()
+    aliases = COLUMN_ALIASES.get(table, {})
+    spec["table"] = table
+
+    # 1. الأعمدة (مع تحويل الأسماء المستعارة إلى الأسماء الفعلية)
+    columns = [c.strip() for c in m.group("columns").split(",")]
+    if columns != ["*"]:
+        if all(re.fullmatch(r"\w+", c) for c in columns):
+            real = []
+            for c in columns:
+                c = aliases.get(c.lower(), c.lower())
+                if c not in real:
+                    real.append(c)
+            spec["columns"] = real
+        else:
+            spec["unsupported"].append(f"SELECT {m.group('columns')}")
+
+    # 2. الشروط: نمرر شروط AND فقط، أما OR فلا يمكن تقسيمها بأمان فتُطبق محلياً
+    where = m.group("where")
+    if where:
+        if _split_outside_quotes(where, r"\s+OR\s+") != [where.strip()]:
+            spec["client_where"] = where.strip()
         else:
-            # 4. إذا كان الجدول فارغاً
-            df = pd.DataFrame(columns=STD_COLUMNS.get(table_name, ["id"]))
+            local = []
+            for cond in _split_outside_quotes(where, r"\s+AND\s+"):
+                try:
+                    spec["filters"].append(_parse_condition(cond, aliases))
+                except ValueError:
+                    local.append(cond)
+            if local:
+                spec["client_where"] = " AND ".join(local)
+
+    # 3. الترتيب
+    order = m.group("order")
+    if order:
+        for part in _split_outside_quotes(order, r","):
+            om = re.fullmatch(r"(\w+)(?:\s+(ASC|DESC))?", part.strip(), re.IGNORECASE)
+            if om:
+                col = aliases.get(om.group(1).lower(), om.group(1).lower())
+                spec["order"].append((col, (om.group(2) or "").upper() == "DESC"))
+            else:
+                spec["unsupported"].append(f"ORDER BY {part}")
+
+    # 4. الحد الأقصى
+    if m.group("limit"):
+        spec["limit"] = int(m.group("limit"))
+
+    return spec
+
+
+def _strip_parens(expr):
+    """إزالة الأقواس الخارجية إذا كانت تحيط بالشرط كاملاً"""
+    expr = expr.strip()
+    while expr.startswith("(") and expr.endswith(")"):
+        depth, in_quote = 0, False
+        for i, ch in enumerate(expr):
+            if ch == "'":
+                in_quote = not in_quote
+            elif not in_quote and ch == "(":
+                depth += 1
+            elif not in_quote and ch == ")":
+                depth -= 1
+                if depth == 0 and i < len(expr) - 1:
+                    return expr
+        expr = expr[1:-1].strip()
+    return expr
+
+
+_COMPARE_METHODS = {"eq": "eq", "neq": "ne", "gt": "gt", "gte": "ge", "lt": "lt", "lte": "le"}
+
+def _condition_mask(df, condition, aliases):
+    """تقييم شرط واحد على الجدول بنفس دلالة SQL (المقارنة مع NULL لا تطابق)"""
+    method, col, value, negate = _parse_condition(condition, aliases)
+    if col not in df.columns:
+        raise ValueError(f"العمود {col} غير موجود")
+    values = df[col]
+    if method == "is_":
+        return values.notna() if negate else values.isna()
+
+    present = values.notna()
+    mask = pd.Series(False, index=df.index)
+    if method in _COMPARE_METHODS:
+        if value is None:
+            return mask
+        mask[present] = getattr(values[present], _COMPARE_METHODS[method])(value)
+        return mask.astype(bool)
+    if method == "in_":
+        hit = values[present].isin(values=[v for v in value if v is not None])
+    else:
+        pattern = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in str(value))
+        hit = values[present].astype(str).str.fullmatch(pattern, case=method != "ilike", flags=re.DOTALL)
+    mask[present] = ~hit if negate else hit
+    return mask.astype(bool)
+
+def _where_mask(df, expr, aliases):
+    """تقييم شرط WHERE (مع AND و OR والأقواس) محلياً على الصفوف المجلوبة"""
+    expr = _strip_parens(expr)
+    any_of = _split_outside_quotes(expr, r"\s+OR\s+")
+    if len(any_of) > 1:
+        mask = pd.Series(False, index=df.index)
+        for part in any_of:
+            mask |= _where_mask(df, part, aliases)
+        return mask
+    all_of = _split_outside_quotes(expr, r"\s+AND\s+")
+    if len(all_of) > 1:
+        mask = pd.Series(True, index=df.index)
+        for part in all_of:
+            mask &= _where_mask(df, part, aliases)
+        return mask
+    return _condition_mask(df, expr, aliases)
+
+
+def _order_by(builder, terms):
+    """
+    ترتيب بعدة أعمدة [(العمود، تنازلي؟)] في معامل order واحد:
+    استدعاء order أكثر من مرة في postgrest-py 0.10 يرسل المعامل مكرراً، والخادم يأخذ واحداً منها فقط.
+    """
+    if not terms:
+        return builder
+    return builder.order(",".join(f"{col}.desc" if desc else col for col, desc in terms))
 
+
+def _apply_query_spec(builder, spec):
+    """تطبيق الشروط والترتيب والحد على طلب Supabase"""
+    for method, col, value, negate in spec["filters"]:
+        target = builder.not_ if negate else builder
+        builder = getattr(target, method)(col, value)
+    builder = _order_by(builder, spec["order"])
+    if spec["limit"] is not None:
+        builder = builder.limit(spec["limit"])
+    return builder
+
+
+def _page_range(builder, start, size):
+    """
+    صفحة من size صف تبدأ من الصف start (limit و offset).
+    لا نستخدم range لأنها في postgrest-py 0.10 تستثني النهاية بخلاف الإصدارات الأحدث.
+    """
+    builder = builder.limit(size)
+    builder.params = builder.params.add("offset", int(start))
+    return builder
+
+
+def iter_table(table_name, columns="*", filters=None, chunk_size=PAGE_SIZE, as_frame=False, max_rows=None, start_after=None):
+    """
+    قارئ تدفقي للجداول الكبيرة: يجلب الصفوف على دفعات مرتبة حسب id (Keyset)
+    بدلاً من طلب واحد يصطدم بسقف الصفوف في PostgREST ويُسقط الباقي بصمت.
+    - filters: شروط بنفس صيغة parse_query مثل [("eq", "acc_name", "...", False)]
+    - chunk_size / max_rows: للتحكم في الذاكرة المستخدمة
+    - as_frame: إعادة كل دفعة كـ DataFrame بدلاً من قائمة قواميس
+    """
+    cols = columns if isinstance(columns, str) else ",".join(columns)
+    if cols != "*" and "id" not in [c.strip() for c in cols.split(",")]:
+        cols += ",id"
+
+    spec = {"filters": filters or [], "order": [], "limit": None}
+    last_id = start_after
+    fetched = 0
+
+    while True:
+        size = chunk_size if max_rows is None else min(chunk_size, max_rows - fetched)
+        if size <= 0:
+            return
+
+        builder = _apply_query_spec(supabase.table(table_name).select(cols), spec)
+        if last_id is not None:
+            builder = builder.gt("id", last_id)
+        rows = builder.order("id").limit(size).execute().data or []
+
+        # نتوقف عند أول صفحة فارغة فقط، لأن الخادم قد يعيد أقل من المطلوب بسبب سقف max-rows
+        if not rows:
+            return
+
+        fetched += len(rows)
+        last_id = rows[-1]["id"]
+        yield pd.DataFrame(rows) if as_frame else rows
+
+
+def _normalize_frame(df, table_name):
+    """معالجة البيانات بعد جلبها (التواريخ، القيم الفارغة، توحيد المسميات)"""
+    if df.empty:
+        return pd.DataFrame(columns=STD_COLUMNS.get(table_name, ["id"]))
+
+    for col in df.columns:
+        # --- حل مشكلة التاريخ (ArrowTypeError) ---
+        # تحويل أي عمود يحتوي على كلمة تاريخ إلى نص ليعرضه Streamlit بلا مشاكل
+        if 'date' in col.lower() or 'التاريخ' in col or 'jv_date' in col:
+            df[col] = df[col].astype(str)
+
+        # تحويل القيم الفارغة في مبالغ المدين والدائن إلى أصفار بدلاً من None
+        if col in ['debit', 'credit', 'current_balance', 'total_amount', 'opening_balance']:
+            df[col] = df[col].fillna(0)
+
+    # توحيد مسميات الأعمدة
+    if "acc_name" in df.columns and "name" not in df.columns:
+        df["name"] = df["acc_name"]
+
+    if table_name == "journal":
+        if "date" in df.columns and "jv_date" not in df.columns:
+            df["jv_date"] = df["date"]
+        elif "jv_date" in df.columns and "date" not in df.columns:
+            df["date"] = df["jv_date"]
+    return df
+
+
+# --- ذاكرة مؤقتة مشتركة لنتائج القراءة ---
+# مشتركة بين كل الجلسات في نفس العملية، وتُبطَل حسب الجدول عند كل كتابة
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_MAX_ENTRIES = 128
+CACHE_TTL_SECONDS = 300  # حد أقصى لعمر النتيجة لالتقاط تعديلات العمليات الأخرى
+
+class _QueryCache:
+    """ذاكرة LRU بحد أقصى للحجم بالبايت، مفتاحها (الجدول، نص الاستعلام)"""
+
+    def __init__(self, max_bytes, max_entries, ttl):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()   # (table, query) -> (df, size, stored_at)
+        self._versions = {}           # table -> رقم يزداد مع كل إبطال
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+    def version(self, table):
+        with self._lock:
+            return self._versions.get(table, 0)
+
+    def get(self, table, query):
+        with self._lock:
+            item = self._items.get((table, query))
+            if item is None:
+                return None
+            if time.monotonic() - item[2] > self.ttl:
+                self._drop((table, query))
+                return None
+            self._items.move_to_end((table, query))
+            # نعيد نسخة لأن الصفحات تعدل الجداول المستلمة مباشرة
+            return item[0].copy()
+
+    def put(self, table, query, df, version):
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # تجاهل النتيجة إذا حدثت كتابة على الجدول أثناء جلبها
+            if self._versions.get(table, 0) != version:
+                return
+            if (table, query) in self._items:
+                self._drop((table, query))
+            self._items[(table, query)] = (df.copy(), size, time.monotonic())
+            self._bytes += size
+            while self._items and (self._bytes > self.max_bytes or len(self._items) > self.max_entries):
+                self._drop(next(iter(self._items)))
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            for key in [k for k in self._items if k[0] in tables]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            for table in {k[0] for k in self._items}:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            self._items.clear()
+            self._bytes = 0
+
+_query_cache = _QueryCache(CACHE_MAX_BYTES, CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+
+def invalidate_cache(*tables):
+    """إبطال النتائج المخزنة للجداول المحددة (أو كل الجداول إذا لم يُحدد شيء)"""
+    if tables:
+        _query_cache.invalidate(*tables)
+    else:
+        _query_cache.clear()
+    # الكتابة تعني أن النسخة المحلية تحتاج مزامنة قبل القراءة التالية
+    _replica_dirty.update(tables or REPLICA_TABLES)
+
+# --- النسخة المحلية للقراءة (اختيارية) ---
+# تُفعّل بإضافة القسم التالي في Secrets:
+#   [replica]
+#   path = "replica.sqlite"
+# القراءة تتم محلياً بـ SQL حقيقي، والكتابة تبقى على Supabase.
+try:
+    REPLICA_PATH = st.secrets.get("replica", {}).get("path")
+except Exception:
+    REPLICA_PATH = None
+
+REPLICA_TABLES = ("accounts", "journal", "audit_log")
+REPLICA_SYNC_INTERVAL = 30            # ثوانٍ بين المزامنات التلقائية
+REPLICA_FULL_REFRESH = ("accounts",)  # جداول صغيرة تُعاد كاملة إذا لم يتوفر updated_at
+
+_replica_conn = None
+_replica_lock = threading.RLock()       # يحمي اتصال SQLite المشترك
+_replica_sync_lock = threading.Lock()   # مزامنة واحدة في نفس الوقت
+_replica_dirty = set(REPLICA_TABLES)
+_replica_ready = set()                  # جداول اكتملت أول مزامنة لها
+_replica_synced_at = {}
+_replica_no_tombstones = False
+
+def _replica():
+    global _replica_conn
+    with _replica_lock:
+        if _replica_conn is None:
+            conn = sqlite3.connect(REPLICA_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.create_function("normalize_ar", 1, normalize_ar, deterministic=True)
+            conn.execute("CREATE TABLE IF NOT EXISTS _replica_state (table_name TEXT PRIMARY KEY, max_id INTEGER, max_updated_at TEXT, max_tombstone INTEGER)")
+            conn.commit()
+            _replica_conn = conn
+    return _replica_conn
+
+def _replica_upsert(conn, table, rows):
+    """إدراج أو استبدال صفوف في الجدول المحلي، مع إضافة الأعمدة الجديدة تلقائياً"""
+    if not rows:
+        return
+    aliases = COLUMN_ALIASES.get(table, {})
+    prepared = []
+    for r in rows:
+        r = {k: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v for k, v in r.items()}
+        # نخزن الأسماء المستعارة فعلياً (name، jv_date) لتعمل استعلامات الواجهة كما هي
+        for alias, real in aliases.items():
+            if real in r:
+                r[alias] = r[real]
+        prepared.append(r)
+
+    cols = sorted({k for r in prepared for k in r})
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (id INTEGER PRIMARY KEY)')
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    for c in cols:
+        if c not in existing:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{c}"')
+
+    col_sql = ",".join(f'"{c}"' for c in cols)
+    conn.executemany(
+        f'INSERT OR REPLACE INTO "{table}" ({col_sql}) VALUES ({",".join("?" * len(cols))})',
+        [tuple(r.get(c) for c in cols) for r in prepared],
+    )
+
+def _sync_replica_table(conn, table):
+    """مزامنة جدول واحد: الصفوف الجديدة بعد آخر id، المعدلة بعد آخر updated_at، ثم شواهد الحذف"""
+    global _replica_no_tombstones
+    with _replica_lock:
+        state = conn.execute("SELECT max_id, max_updated_at, max_tombstone FROM _replica_state WHERE table_name = ?", (table,)).fetchone()
+    max_id, max_upd, max_tomb = state or (None, None, None)
+    moved = 0
+
+    def absorb(rows):
+        nonlocal moved, max_upd
+        with _replica_lock:
+            _replica_upsert(conn, table, rows)
+            conn.commit()
+        moved += len(rows)
+        stamps = [str(r['updated_at']) for r in rows if r.get('updated_at')]
+        if stamps:
+            max_upd = max([max_upd or ""] + stamps)
+
+    # نسجل آخر رقم في شواهد الحذف قبل النسخ الأول، حتى لا نعيد تطبيق حذف قديم
+    if state is None and not _replica_no_tombstones:
+        try:
+            last = supabase.table("deleted_rows").select("id").order("id", desc=True).limit(1).execute().data
+            max_tomb = last[0]['id'] if last else None
+        except Exception:
+            pass
+
+    # 1. الصفوف الجديدة (Keyset على id)
+    for rows in iter_table(table, start_after=max_id):
+        absorb(rows)
+        max_id = max(max_id or 0, rows[-1]['id'])
+
+    # 2. الصفوف المعدلة
+    if state and max_upd:
+        for rows in iter_table(table, filters=[("gte", "updated_at", max_upd, False)]):
+            absorb(rows)
+    elif state and table in REPLICA_FULL_REFRESH:
+        # لا يوجد تتبع للتعديلات: الجداول الصغيرة تُعاد كاملة
+        fresh = [r for rows in iter_table(table) for r in rows]
+        with _replica_lock:
+            conn.execute(f'DELETE FROM "{table}"')
+        absorb(fresh)
+
+    # 3. شواهد الحذف
+    if state and not _replica_no_tombstones:
+        try:
+            filters = [("eq", "table_name", table, False)]
+            for rows in iter_table("deleted_rows", "id,row_id", filters, start_after=max_tomb):
+                with _replica_lock:
+                    conn.executemany(f'DELETE FROM "{table}" WHERE id = ?', [(r['row_id'],) for r in rows])
+                    conn.commit()
+                max_tomb = rows[-1]['id']
+        except sqlite3.OperationalError:
+            pass  # الجدول المحلي غير موجود بعد (لا صفوف)
+        except Exception as e:
+            print(f"⚠️ جدول deleted_rows غير متاح، لن تُلتقط عمليات الحذف في النسخة المحلية: {e}")
+            _replica_no_tombstones = True
+
+    with _replica_lock:
+        conn.execute("INSERT OR REPLACE INTO _replica_state VALUES (?, ?, ?, ?)", (table, max_id, max_upd, max_tomb))
+        conn.commit()
+    return moved
+
+def sync_replica(tables=None):
+    """
+    مزامنة تزايدية للنسخة المحلية من Supabase.
+    تعيد قاموساً بعدد الصفوف المنقولة لكل جدول (فارغ إذا كانت النسخة معطلة أو مزامنة أخرى جارية).
+    """
+    if not REPLICA_PATH or not _replica_sync_lock.acquire(blocking=False):
+        return {}
+    stats = {}
+    try:
+        conn = _replica()
+        for table in tables or REPLICA_TABLES:
+            _replica_dirty.discard(table)
+            try:
+                stats[table] = _sync_replica_table(conn, table)
+                _replica_ready.add(table)
+                _replica_synced_at[table] = time.monotonic()
+            except Exception as e:
+                _replica_dirty.add(table)
+                print(f"⚠️ فشلت مزامنة {table} مع النسخة المحلية: {e}")
+    finally:
+        _replica_sync_lock.release()
+    return stats
+
+def replica_query(sql, params=()):
+    """تنفيذ استعلام SQL حقيقي على النسخة المحلية"""
+    with _replica_lock:
+        return pd.read_sql_query(sql, _replica(), params=params)
+
+def _read_from_replica(query, table_name):
+    """القراءة من النسخة المحلية إذا كانت مفعلة ومحدثة، وإلا None للرجوع إلى Supabase"""
+    if not REPLICA_PATH or table_name not in REPLICA_TABLES:
+        return None
+    try:
+        stale = time.monotonic() - _replica_synced_at.get(table_name, 0) > REPLICA_SYNC_INTERVAL
+        if table_name in _replica_dirty or stale:
+            sync_replica([table_name])
+        if table_name not in _replica_ready:
+            return None
+        sql = query if _QUERY_RE.match(query) else f'SELECT * FROM "{table_name}"'
+        return replica_query(sql)
+    except Exception as e:
+        print(f"⚠️ تعذرت القراءة من النسخة المحلية ({table_name})، سيتم الجلب من السحاب: {e}")
+        return None
+
+def _fetch_from_server(spec):
+    """جلب البيانات من Supabase مع تنفيذ الفلترة في الخادم بدلاً من تحميل الجدول كاملاً"""
+    table_name = spec["table"]
+    client_where = spec.get("client_where")
+    for clause in spec["unsupported"]:
+        if spec["limit"] is not None and clause.startswith("ORDER BY"):
+            # بدون الترتيب الصحيح لا يمكن تحديد أول N صف، والنتيجة الخاطئة أسوأ من الخطأ الصريح
+            raise ValueError(f"الترتيب ({clause}) غير مدعوم مع LIMIT")
+        print(f"⚠️ تعذر تمرير الجزء ({clause}) إلى الخادم، سيتم تجاهله في جلب {table_name}")
+
+    if spec["limit"] is not None and not client_where:
+        if spec["limit"] <= PAGE_SIZE:
+            builder = supabase.table(table_name).select(",".join(spec["columns"]))
+            response = _apply_query_spec(builder, spec).execute()
+            return pd.DataFrame(response.data) if response.data else pd.DataFrame()
+        if not spec["order"]:
+            # حد أكبر من سقف الخادم: صفحات حتى يكتمل العدد المطلوب
+            chunks = list(iter_table(table_name, spec["columns"], spec["filters"], as_frame=True, max_rows=spec["limit"]))
+            return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        # مع ORDER BY: صفحات بنفس الترتيب (و id لثبات الترتيب بين الصفحات)
+        chunks, fetched = [], 0
+        tiebreak = [] if any(col == "id" for col, _ in spec["order"]) else [("id", False)]
+        page_spec = dict(spec, limit=None, order=spec["order"] + tiebreak)
+        while fetched < spec["limit"]:
+            size = min(PAGE_SIZE, spec["limit"] - fetched)
+            builder = _apply_query_spec(supabase.table(table_name).select(",".join(spec["columns"])), page_spec)
+            rows = _page_range(builder, fetched, size).execute().data or []
+            if not rows:
+                break
+            chunks.append(pd.DataFrame(rows))
+            fetched += len(rows)
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    # بدون LIMIT (أو مع شروط تُطبق محلياً): قراءة على صفحات حتى لا تضيع الصفوف بعد سقف الخادم،
+    # والحد الأقصى لا يُطبق إلا بعد الفلترة المحلية
+    columns = ["*"] if client_where else spec["columns"]
+    chunks = list(iter_table(table_name, columns, spec["filters"], as_frame=True))
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    if client_where and not df.empty:
+        print(f"⚠️ تعذر تمرير الشرط ({client_where}) إلى الخادم، سيتم تطبيقه محلياً في جلب {table_name}")
+        df = df[_where_mask(df, client_where, COLUMN_ALIASES.get(table_name, {}))].reset_index(drop=True)
+    sort_cols = [(c, d) for c, d in spec["order"] if c in df.columns]
+    if sort_cols:
+        df = df.sort_values(by=[c for c, _ in sort_cols], ascending=[not d for _, d in sort_cols], ignore_index=True)
+    if spec["limit"] is not None:
+        df = df.head(spec["limit"])
+    if client_where and spec["columns"] != ["*"] and not df.empty:
+        df = df[[c for c in df.columns if c in spec["columns"] or c == "id"]]
+    return df
+
+def db_fetch(query, params=None):
+    table_name = "accounts"
+
+    try:
+        # 1. ترجمة الاستعلام (الجدول، الأعمدة، الشروط، الترتيب، الحد)
+        spec = parse_query(query)
+        table_name = spec["table"]
+
+        cache_key = " ".join(query.split())
+        cached = _query_cache.get(table_name, cache_key)
+        if cached is not None:
+            return cached
+        version = _query_cache.version(table_name)
+
+        # 2. جلب البيانات: من النسخة المحلية إن وُجدت، وإلا من الخادم مع تنفيذ الفلترة هناك
+        df = _read_from_replica(query, table_name)
+        if df is None:
+            df = _fetch_from_server(spec)
+
+        # 3. معالجة البيانات (أو إرجاع الأعمدة القياسية إذا كان الجدول فارغاً)
+        df = _normalize_frame(df, table_name)
+        _query_cache.put(table_name, cache_key, df, version)
         return df
 
     except Exception as e:
         print(f"❌ خطأ حرج في جلب بيانات {table_name}: {e}")
         return pd.DataFrame(columns=STD_COLUMNS.get(table_name, ["id"]))
 
-def advanced_search_journal(query):
+# --- البحث في القيود ---
+SEARCH_PAGE_SIZE = 50
+_AR_DIACRITICS_RE = re.compile('[\u064B-\u0652\u0670\u0640]')
+_AR_FOLD = str.maketrans('أإآٱىةؤئ', 'اااايهوي')
+
+def normalize_ar(text):
+    """تطبيع النص العربي للبحث (نفس normalize_ar في القاعدة): حذف التشكيل والتطويل وتوحيد الألف والياء والتاء المربوطة والهمزات"""
+    return _AR_DIACRITICS_RE.sub('', str(text or '')).translate(_AR_FOLD).lower()
+
+def _like_escape(text):
+    """حماية % و _ والشرطة المائلة في نص البحث لتُطابق حرفياً في LIKE"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _search_replica(query, limit, offset):
+    """البحث في النسخة المحلية بنفس التطبيع (عند عدم تثبيت search_journal في القاعدة)"""
+    # المطابقة التامة لرقم المرجع نتيجة مستقلة بكل صفحاتها (لا تنتقل الصفحات التالية للبحث النصي)
+    if not replica_query('SELECT id FROM journal WHERE ref_no = ? LIMIT 1', (query,)).empty:
+        return replica_query('SELECT * FROM journal WHERE ref_no = ? ORDER BY id DESC LIMIT ? OFFSET ?', (query, limit, offset))
+    return replica_query(
+        "SELECT * FROM journal WHERE normalize_ar(COALESCE(acc_name, '') || ' ' || COALESCE(ref_no, '') || ' ' || COALESCE(description, '')) LIKE ? ESCAPE '\\' "
+        "ORDER BY id DESC LIMIT ? OFFSET ?", (f"%{_like_escape(normalize_ar(query))}%", limit, offset))
+
+def advanced_search_journal(query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    البحث في القيود (اسم الحساب، رقم المرجع، البيان) صفحة بصفحة:
+    - مطابقة تامة لرقم المرجع أولاً (وإن وُجدت فهي النتيجة كاملة بكل صفحاتها)
+    - ثم بحث مفهرس (trigram) بعد التطبيع العربي مرتباً بالأقرب (دالة search_journal)
+    - بدائل عند عدم تثبيتها: النسخة المحلية، ثم ilike محدود بصفحة واحدة
+    """
+    query = str(query or "").strip()
+    if not query:
+        return pd.DataFrame()
     try:
-        # البحث في اسم الحساب أو رقم المرجع أو البيان
-        res = supabase.table("journal").select("*").or_(f"acc_name.ilike.%{query}%,ref_no.ilike.%{query}%,description.ilike.%{query}%").order("id", desc=True).execute()
-        return pd.DataFrame(res.data) if res.data else pd.DataFrame()
-    except:
+        ok, rows = _rpc("search_journal", {"p_query": query, "p_limit": limit, "p_offset": offset})
+        if ok:
+            return _normalize_frame(pd.DataFrame(rows or []).drop(columns=['search_text'], errors='ignore'), "journal")
+
+        if REPLICA_PATH and "journal" in _replica_ready:
+            return _normalize_frame(_search_replica(query, limit, offset), "journal")
+
+        exact = _page_range(supabase.table("journal").select("*").eq("ref_no", query).order("id", desc=True), offset, limit).execute()
+        if exact.data:
+            return _normalize_frame(pd.DataFrame(exact.data), "journal")
+        if offset and supabase.table("journal").select("id").eq("ref_no", query).limit(1).execute().data:
+            # انتهت صفحات المطابقة التامة
+            return pd.DataFrame()
+
+        # علامات التنصيص تسمح بالفواصل والأقواس داخل نص البحث، والشرطة المائلة داخلها تحتاج هروباً بدورها
+        q = _like_escape(query.replace('"', '')).replace("\\", "\\\\")
+        res = _page_range(supabase.table("journal").select("*")
+                          .or_(f'acc_name.ilike."%{q}%",ref_no.ilike."%{q}%",description.ilike."%{q}%"')
+                          .order("id", desc=True), offset, limit).execute()
+        return _normalize_frame(pd.DataFrame(res.data or []), "journal")
+    except Exception as e:
+        print(f"⚠️ Search Error: {e}")
         return pd.DataFrame()
 
+# --- الترقيم المتسلسل (أكواد الحسابات ومراجع القيود) ---
+# كل عملية تحجز كتلة أرقام من جدول counters في طلب واحد (reserve_sequence_block) وتوزعها محلياً.
+# الأرقام غير المستخدمة عند إغلاق العملية تُترك فجوات في الترقيم، ولا تتكرر أبداً.
+SEQUENCE_BLOCK_SIZE = 50
+ACC_CODE_PREFIXES = {
+    "مورد": "SUP", "عميل": "CUS", "صندوق/كاش": "CSH",
+    "بنك": "BNK", "فرع": "BRN", "مصروفات": "EXP", "إيرادات أخرى": "REV"
+}
+# نوع الترقيم -> (الجدول، العمود، عدد الخانات) للصيغة PREFIX2026-0001
+SEQUENCE_KINDS = {
+    "acc": ("accounts", "acc_code", 4),
+    "jv": ("journal", "ref_no", 6),
+}
+
+class _SequenceBlocks:
+    """الكتلة المحجوزة الحالية لكل عداد في ذاكرة العملية"""
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._blocks = {}   # اسم العداد -> (الرقم التالي، آخر رقم محجوز)
+        self._lock = threading.Lock()
+
+    def take(self, name, count, reserve):
+        """
+        count رقماً من العداد name، مع حجز كتلة جديدة عند نفاد الحالية.
+        reserve(name, needed, block) تحجز في القاعدة وتعيد (أول رقم، آخر رقم)
+        """
+        numbers = []
+        with self._lock:
+            nxt, end = self._blocks.get(name, (1, 0))
+            while len(numbers) < count:
+                if nxt > end:
+                    needed = count - len(numbers)
+                    first, end = reserve(name, needed, self.block_size)
+                    # لا نعود لأرقام سبق توزيعها (البديل يقرأ آخر رقم مسجل وقد لا يكون المحجوز حُفظ بعد)
+                    nxt = max(first, nxt)
+                    end = max(end, nxt + needed - 1)
+                step = min(end - nxt + 1, count - len(numbers))
+                numbers.extend(range(nxt, nxt + step))
+                nxt += step
+            self._blocks[name] = (nxt, end)
+        return numbers
+
+_sequence_blocks = _SequenceBlocks(SEQUENCE_BLOCK_SIZE)
+
+def _reserve_sequence(kind, name, needed, block):
+    """حجز أرقام في القاعدة: كتلة كاملة عبر reserve_sequence_block، أو آخر رقم مستخدم كبديل"""
+    size = max(needed, block)
+    ok, first = _rpc("reserve_sequence_block", {"p_name": name, "p_count": size})
+    if ok:
+        return int(first), int(first) + size - 1
+
+    # البديل (غير ذري بين العمليات): نحجز المطلوب فقط بعد آخر رقم مسجل
+    # (بنفس عدد الخانات فقط، حتى لا يقفز الترقيم بسبب كود قديم بصيغة أخرى)
+    table, column, digits = SEQUENCE_KINDS[kind]
+    res = supabase.table(table).select(column).like(column, f"{name}-{'_' * digits}").order(column, desc=True).limit(1).execute()
+    last = int(str(res.data[0][column]).split('-')[-1]) if res.data else 0
+    return last + 1, last + needed
+
+def next_sequence_codes(kind, prefix, count=1):
+    """count كوداً فريداً بصيغة PREFIX{السنة}-0001 (مثل SUP2026-0001) من عداد البادئة والسنة"""
+    _, _, digits = SEQUENCE_KINDS[kind]
+    name = f"{prefix}{datetime.now().year}"
+    numbers = _sequence_blocks.take(name, count, lambda n, needed, block: _reserve_sequence(kind, n, needed, block))
+    return [f"{name}-{str(num).zfill(digits)}" for num in numbers]
+
 def generate_acc_code(category):
-    prefix_map = {
-        "مورد": "SUP", "عميل": "CUS", "صندوق/كاش": "CSH",
-        "بنك": "BNK", "فرع": "BRN", "مصروفات": "EXP", "إيرادات أخرى": "REV"
-    }
-    prefix = prefix_map.get(category, "ACC")
-    year = 2026 # السنة الحالية
-    
+    """
+    كود الحساب التالي حسب التصنيف (SUP2026-0001 ...).
+    ترفع الخطأ إذا تعذر الحجز بدلاً من اختراع كود خارج التسلسل (يفسد العداد وترتيب الأكواد)
+    """
+    prefix = ACC_CODE_PREFIXES.get(category, "ACC")
     try:
-        # نبحث عن آخر حساب تم تسجيله يبدأ بنفس الكود
-        res = supabase.table("accounts").select("acc_code").like("acc_code", f"{prefix}{year}-%").order("acc_code", desc=True).limit(1).execute()
-        
-        if res.data:
-            last_code = res.data[0]['acc_code']
-            # نأخذ الرقم الأخير ونزيده 1
-            last_num = int(last_code.split('-')[-1])
-            return f"{prefix}{year}-{str(last_num + 1).zfill(4)}"
-        else:
-            return f"{prefix}{year}-0001"
-    except:
-        return f"{prefix}{year}-0001"
+        return next_sequence_codes("acc", prefix)[0]
+    except Exception as e:
+        raise RuntimeError(f"تعذر حجز كود الحساب، يرجى المحاولة مرة أخرى: {e}") from e
 
-def process_full_transaction(acc_name, offset_acc, op_type, amount, use_tax, description, ref_no, date_str, posted_by, due_date=None):
+# بديل محلي للترحيل الذري في الاختبارات دون اتصال فقط (انظر local_ledger.py و tests/).
+# لا يُفعّل من الإعدادات لأن كل القراءات تبقى على Supabase، فلا تظهر القيود المرحلة محلياً في الكشوف.
+_local_ledger_conn = None
+_local_ledger_lock = threading.Lock()
+
+def use_local_ledger(conn):
+    """توجيه الترحيل الذري إلى اتصال local_ledger (للاختبارات)، أو None للرجوع إلى Supabase"""
+    global _local_ledger_conn
+    with _local_ledger_lock:
+        _local_ledger_conn = conn
+
+def _post_entry_atomic(payload, audit_user=None, audit_action=None, audit_details=None):
+    """
+    ترحيل القيد وآثاره في معاملة واحدة عبر post_journal_entry (أو بديلها المحلي في الاختبارات).
+    تعيد (True, رقم القيد) أو (False, None) إذا لم تكن الدالة مثبتة في القاعدة.
+    """
+    with _local_ledger_lock:
+        if _local_ledger_conn is not None:
+            return True, local_ledger.post_journal_entry(_local_ledger_conn, payload, audit_user, audit_action, audit_details)
+
+    return _rpc("post_journal_entry", {
+        "p_entry": payload,
+        "p_audit_user": str(audit_user) if audit_action else None,
+        "p_audit_action": audit_action,
+        "p_audit_details": str(audit_details) if audit_action else None,
+    })
+
+# ثوابت المنطق المحاسبي المشتركة بين الترحيل الفردي والاستيراد الجماعي
+VAT_RATE = 0.15
+REVENUE_KEYWORDS = ("بيع", "قبض", "إيراد")  # العمليات التي تُسجل دائنة على الحساب الرئيسي
+DEFAULT_DUE_DAYS = 30
+
+def process_full_transaction(acc_name, offset_acc, op_type, amount, use_tax, description, ref_no, date_str, posted_by, due_date=None,
+                             audit_action=None, audit_details=None):
     """
     النسخة الاحترافية: تدعم الحساب التلقائي لتاريخ الاستحقاق للعمليات الآجلة
     لضمان ظهورها في تقارير الديون والالتزامات.
+    يتم الترحيل في طلب واحد ذري (القيد + الأرصدة + سجل الرقابة) عند توفر post_journal_entry،
+    وإلا بالطريقة التقليدية على عدة طلبات.
     """
     try:
         amount = float(amount)
-        tax = (amount * 0.15) if use_tax else 0
+        tax = (amount * VAT_RATE) if use_tax else 0
         total = amount + tax
         
         # 1. تحديد المدين والدائن
-        is_revenue = any(x in op_type for x in ["بيع", "قبض", "إيراد"])
+        is_revenue = any(x in op_type for x in REVENUE_KEYWORDS)
         deb, crd = (0, total) if is_revenue else (total, 0)
 
         # 2. منطق ذكي لتاريخ الاستحقاق: 
@@ -224,7 +982,7 @@ def process_full_transaction(acc_name, offset_acc, op_type, amount, use_tax, des
         if "آجل" in op_type and not due_date:
             from datetime import datetime, timedelta
             current_date = datetime.strptime(date_str, '%Y-%m-%d')
-            final_due_date = (current_date + timedelta(days=30)).strftime('%Y-%m-%d')
+            final_due_date = (current_date + timedelta(days=DEFAULT_DUE_DAYS)).strftime('%Y-%m-%d')
 
         payload = {
             "date": date_str,
@@ -232,7 +990,7 @@ def process_full_transaction(acc_name, offset_acc, op_type, amount, use_tax, des
             "offset_acc": offset_acc,
             "op_type": op_type,
             "description": description,
-            "ref_no": ref_no,
+            "ref_no": ref_no or generate_jv_ref(op_type),
             "base_amount": amount,
             "tax_amount": tax,
             "total_amount": total,
@@ -242,84 +1000,812 @@ def process_full_transaction(acc_name, offset_acc, op_type, amount, use_tax, des
             "due_date": final_due_date  # القيمة المحسنة
         }
         
+        # 3. الطريق المفضل: ترحيل ذري في طلب واحد
+        posted, _ = _post_entry_atomic(payload, posted_by, audit_action, audit_details)
+        if posted:
+            invalidate_cache("journal", "accounts", "audit_log")
+            return True, "✅ تم ترحيل القيد بنجاح"
+
+        # 4. البديل: الإدراج ثم تحديث الآثار على طلبات منفصلة
         res = supabase.table("journal").insert(payload).execute()
+        invalidate_cache("journal")
         
         if res.data:
-            update_account_balance(acc_name, deb, crd)
-            update_account_balance(offset_acc, crd, deb)
+            _apply_entry_effects(payload)
+            if audit_action:
+                log_event(posted_by, audit_action, audit_details)
             return True, "✅ تم ترحيل القيد بنجاح"
         
         return False, "❌ فشل في حفظ البيانات"
     except Exception as e:
         return False, f"❌ خطأ تقني: {str(e)}"
 
-def get_supplier_due_amounts():
-    """جلب فواتير المشتريات الآجلة مع تنظيف البيانات"""
-    df = db_fetch("journal") 
-    if df.empty or 'op_type' not in df.columns:
-        return pd.DataFrame()
+# --- الاستيراد الجماعي للقيود (CSV / Excel) ---
+IMPORT_BATCH_SIZE = 500
 
-    # تصفية المشتريات الآجلة فقط
-    due_df = df[df['op_type'].str.contains('شراء آجل', na=False)].copy()
-    
+# أسماء الأعمدة المقبولة في ملف الاستيراد (عربي أو إنجليزي)
+IMPORT_COLUMN_ALIASES = {
+    "التاريخ": "date", "الحساب": "acc_name", "الحساب المقابل": "offset_acc", "نوع العملية": "op_type",
+    "المبلغ": "amount", "ضريبة": "use_tax", "البيان": "description", "المرجع": "ref_no", "الاستحقاق": "due_date",
+}
+IMPORT_REQUIRED = ["date", "acc_name", "offset_acc", "op_type", "amount"]
+
+def _read_import_file(uploaded_file):
+    name = str(getattr(uploaded_file, "name", uploaded_file)).lower()
+    if name.endswith((".xlsx", ".xls")):
+        return pd.read_excel(uploaded_file, dtype=str)
+    return pd.read_csv(uploaded_file, dtype=str, encoding="utf-8-sig")
+
+def _prepare_import_rows(df, known_accounts):
+    """
+    التحقق من الصفوف واشتقاق الضريبة والمدين والدائن بشكل متجهي (بنفس منطق process_full_transaction).
+    تعيد (الصفوف السليمة، الصفوف المرفوضة مع سبب الرفض).
+    """
+    df = df.rename(columns=lambda c: IMPORT_COLUMN_ALIASES.get(str(c).strip(), str(c).strip()))
+    for col in IMPORT_REQUIRED + ["use_tax", "description", "ref_no", "due_date"]:
+        if col not in df.columns:
+            df[col] = None
+    df['row_no'] = np.arange(2, len(df) + 2)  # رقم السطر في الملف (بعد سطر العناوين)
+
+    for col in ["acc_name", "offset_acc", "op_type"]:
+        df[col] = df[col].fillna("").astype(str).str.strip()
+    amount = pd.to_numeric(df['amount'], errors='coerce')
+    dates = pd.to_datetime(df['date'], errors='coerce')
+    dues = pd.to_datetime(df['due_date'], errors='coerce')
+
+    # 1. التحقق (مرور واحد لكل شرط على كامل الملف)
+    checks = [
+        (df['acc_name'] == "", "الحساب فارغ"),
+        ((df['acc_name'] != "") & ~df['acc_name'].isin(known_accounts), "الحساب غير موجود في الدليل"),
+        (~df['offset_acc'].isin(known_accounts), "الحساب المقابل غير موجود في الدليل"),
+        (df['op_type'] == "", "نوع العملية فارغ"),
+        (amount.isna() | (amount <= 0), "المبلغ غير صحيح"),
+        (dates.isna(), "التاريخ غير صحيح"),
+    ]
+    reason = pd.Series("", index=df.index)
+    for mask, msg in checks:
+        reason = reason.where(~mask, reason + np.where(reason == "", "", "، ") + msg)
+    bad = reason != ""
+    rejected = df[bad].assign(reason=reason[bad])
+    ok = df[~bad].copy()
+    amount, dates, dues = amount[~bad], dates[~bad], dues[~bad]
+
+    # 2. الاشتقاق المتجهي
+    use_tax = ok['use_tax'].fillna("").astype(str).str.strip().str.lower().isin(["1", "true", "yes", "y", "نعم"])
+    tax = np.where(use_tax, amount * VAT_RATE, 0.0)
+    total = amount + tax
+    is_revenue = ok['op_type'].str.contains("|".join(REVENUE_KEYWORDS), regex=True)
+    ok['date'] = dates.dt.strftime('%Y-%m-%d')
+    ok['base_amount'] = amount
+    ok['tax_amount'] = tax
+    ok['total_amount'] = total
+    ok['debit'] = np.where(is_revenue, 0.0, total)
+    ok['credit'] = np.where(is_revenue, total, 0.0)
+
+    # العمليات الآجلة بدون تاريخ استحقاق: 30 يوماً من تاريخ العملية
+    is_deferred = ok['op_type'].str.contains("آجل")
+    dues = dues.where(dues.notna() | ~is_deferred, dates + pd.Timedelta(days=DEFAULT_DUE_DAYS))
+    ok['due_date'] = dues.dt.strftime('%Y-%m-%d').where(dues.notna(), None)
+
+    # المرجع الآلي للصفوف التي لا تحمل رقماً
+    missing_ref = ok['ref_no'].isna() | (ok['ref_no'].astype(str).str.strip() == "")
+    if missing_ref.any():
+        ok.loc[missing_ref, 'ref_no'] = generate_jv_refs(ok.loc[missing_ref, 'op_type'].tolist())
+    ok['description'] = ok['description'].fillna("")
+    return ok, rejected
+
+def _apply_batch_effects(batch):
+    """
+    البديل عند غياب post_journal_batch: تحديث رصيد كل حساب متأثر مرة واحدة للدفعة كاملة
+    (بدلاً من مرة لكل قيد). تعيد False إذا لم تكتمل كل الآثار (القيود مُدرجة بالفعل).
+    """
+    ok = True
+    net = _journal_net_by_account([batch])
+    for acc_name, delta in net.items():
+        ok = update_account_balance(acc_name, float(delta), 0) and ok
+
+    daily = batch.groupby(['acc_name', 'date'])[['debit', 'credit']].sum()
+    for (acc_name, day), row in daily.iterrows():
+        try:
+            _bump_daily_balance(acc_name, day, float(row['debit']), float(row['credit']))
+        except Exception as e:
+            ok = False
+            _daily_balances_state["stale"] = True
+            print(f"⚠️ تنبيه: فشل تحديث الرصيد اليومي للحساب {acc_name}: {e}")
+    return ok
+
+def bulk_import_transactions(uploaded_file, posted_by):
+    """
+    استيراد جماعي للقيود من ملف CSV أو Excel:
+    تحقق واشتقاق متجهي، ثم ترحيل كل دفعة بآثارها (الأرصدة والأرصدة اليومية) في معاملة واحدة
+    عبر post_journal_batch، فالدفعة المرفوضة لم يُحفظ منها شيء ويمكن إعادة استيرادها كما هي.
+    تعيد (نجاح، رسالة، جدول الصفوف المرفوضة مع سبب الرفض).
+    """
+    try:
+        df = _read_import_file(uploaded_file)
+        if df.empty:
+            return False, "⚠️ الملف لا يحتوي على أي صفوف", pd.DataFrame()
+
+        accounts = db_fetch("SELECT acc_name FROM accounts")
+        known = set(accounts['acc_name']) if 'acc_name' in accounts.columns else set()
+        ok, rejected = _prepare_import_rows(df, known)
+        rejected = [rejected]
+
+        columns = ["date", "acc_name", "offset_acc", "op_type", "description", "ref_no", "base_amount",
+                   "tax_amount", "total_amount", "debit", "credit", "due_date"]
+        inserted, effects_ok = 0, True
+        for start in range(0, len(ok), IMPORT_BATCH_SIZE):
+            batch = ok.iloc[start:start + IMPORT_BATCH_SIZE]
+            records = batch[columns].assign(posted_by=posted_by).to_dict(orient='records')
+            try:
+                # 1. الطريق المفضل: الدفعة وآثارها في طلب واحد ومعاملة واحدة
+                posted, _ = _rpc("post_journal_batch", {"p_entries": records})
+                # 2. البديل: الإدراج ثم تحديث الآثار على طلبات منفصلة
+                if not posted:
+                    supabase.table("journal").insert(records).execute()
+            except Exception as e:
+                rejected.append(batch.assign(reason=f"فشل إدراج الدفعة: {e}"))
+                continue
+            inserted += len(batch)
+            if not posted:
+                effects_ok = _apply_batch_effects(batch) and effects_ok
+
+        invalidate_cache("journal", "accounts")
+        rejected = pd.concat(rejected, ignore_index=True)
+        if inserted:
+            log_event(posted_by, "استيراد جماعي", f"تم استيراد {inserted} قيد ورفض {len(rejected)} صف")
+        msg = f"✅ تم ترحيل {inserted} قيد، ورُفض {len(rejected)} صف"
+        if not effects_ok:
+            msg += " ⚠️ تعذر تحديث بعض الأرصدة، أعد احتساب الأرصدة وبناء الأرصدة اليومية من الإعدادات"
+        return inserted > 0, msg, rejected
+    except Exception as e:
+        return False, f"❌ خطأ أثناء الاستيراد: {str(e)}", pd.DataFrame()
+
+# --- محرك الاستحقاقات وأعمار الديون ---
+CREDIT_OP_TYPES = {"payable": "شراء آجل", "receivable": "بيع آجل"}
+AGING_BINS = [-1, 30, 60, 90, float('inf')]
+AGING_LABELS = ["0-30", "31-60", "61-90", "90+"]
+_no_settled_column = False
+_no_open_items = False
+
+def _fetch_open_items(kind, due_before=None):
+    """المتبقي الفعلي للفواتير المفتوحة من دفتر open_items (بعد تخصيص السندات والمرتجعات FIFO)"""
+    filters = [("eq", "kind", kind, False), ("eq", "side", "invoice", False), ("gt", "remaining", 0, False)]
+    if due_before:
+        filters.append(("lte", "due_date", str(due_before), False))
+    columns = "id,entry_id,acc_name,doc_date,due_date,amount,remaining"
+    return [
+        c.rename(columns={'doc_date': 'date', 'remaining': 'total_amount', 'amount': 'invoice_amount'}).assign(id=c['entry_id'])
+        for c in iter_table("open_items", columns, filters, as_frame=True)
+    ]
+
+def get_open_credit_items(kind="payable", due_before=None):
+    """
+    فواتير الآجل غير المسددة (kind: payable للموردين / receivable للعملاء) مفلترة في الخادم،
+    مع days_left (موجبة قبل الاستحقاق وسالبة بعده) محسوبة دفعة واحدة.
+    total_amount هو المتبقي من الفاتورة بعد السداد الجزئي (عند تثبيت دفتر open_items).
+    - due_before: الفواتير التي حل موعدها حتى هذا التاريخ فقط
+    """
+    global _no_settled_column, _no_open_items
+    columns = ['id', 'acc_name', 'date', 'due_date', 'total_amount']
+    filters = [("eq", "op_type", CREDIT_OP_TYPES[kind], False)]
+    if due_before:
+        filters.append(("lte", "due_date", str(due_before), False))
+
+    chunks = None
+    if not _no_open_items:
+        try:
+            chunks = _fetch_open_items(kind, due_before)
+        except Exception as e:
+            # دفتر الفواتير المفتوحة لم يُثبت بعد (انظر supabase/migrations)
+            if "open_items" not in str(e):
+                raise
+            print(f"⚠️ جدول open_items غير متاح: {e}")
+            _no_open_items = True
+    if chunks is None and not _no_settled_column:
+        try:
+            chunks = list(iter_table("journal", columns, filters + [("eq", "settled", False, False)], as_frame=True))
+        except Exception as e:
+            # عمود settled لم يُضف بعد (انظر supabase/migrations): كل فواتير الآجل تُعتبر مفتوحة
+            if "settled" not in str(e):
+                raise
+            print(f"⚠️ عمود settled غير متاح: {e}")
+            _no_settled_column = True
+    if chunks is None:
+        chunks = list(iter_table("journal", columns, filters, as_frame=True))
+
+    items = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+    items['total_amount'] = pd.to_numeric(items['total_amount'], errors='coerce').fillna(0)
+    items['jv_date'] = pd.to_datetime(items['date'], errors='coerce')
+    items['due_date'] = pd.to_datetime(items['due_date'], errors='coerce').fillna(items['jv_date'] + pd.Timedelta(days=DEFAULT_DUE_DAYS))
+    items['days_left'] = (items['due_date'] - pd.Timestamp(datetime.now().date())).dt.days
+    items['jv_date'] = items['jv_date'].dt.date
+    items['due_date'] = items['due_date'].dt.date
+    return items
+
+def get_aging_report(kind="payable"):
+    """أعمار الديون المستحقة لكل حساب في فئات (0-30، 31-60، 61-90، 90+) يوماً من تاريخ الاستحقاق"""
+    items = get_open_credit_items(kind, due_before=datetime.now().strftime('%Y-%m-%d'))
+    if items.empty:
+        return pd.DataFrame(columns=['acc_name'] + AGING_LABELS + ['total'])
+    items['bucket'] = pd.cut(-items['days_left'], bins=AGING_BINS, labels=AGING_LABELS)
+    report = items.pivot_table(index='acc_name', columns='bucket', values='total_amount', aggfunc='sum', fill_value=0, observed=False)
+    report = report.reindex(columns=AGING_LABELS, fill_value=0).rename_axis(columns=None)
+    report['total'] = report.sum(axis=1)
+    return report.sort_values('total', ascending=False).reset_index()
+
+def rebuild_open_items(acc_name=None):
+    """إعادة بناء دفتر الفواتير المفتوحة وتخصيص السندات FIFO من القيود (لحساب واحد أو للكل)"""
+    try:
+        ok, count = _rpc("rebuild_open_items", {"p_acc_name": acc_name})
+        if not ok:
+            return False, "⚠️ دفتر الفواتير المفتوحة غير مثبت في القاعدة بعد (انظر supabase/migrations)"
+        invalidate_cache("journal")
+        return True, f"✅ تم بناء {count} عنصر مفتوح وتخصيص السداد عليها"
+    except Exception as e:
+        return False, f"❌ فشل بناء الفواتير المفتوحة: {str(e)}"
+
+def get_supplier_due_amounts():
+    """فواتير المشتريات الآجلة غير المسددة مع الأيام المتبقية للاستحقاق"""
+    due_df = get_open_credit_items("payable")
     if due_df.empty:
         return pd.DataFrame()
-
-    # معالجة التواريخ بحذر
-    due_df['jv_date'] = pd.to_datetime(due_df['jv_date']).dt.date
-    # إذا لم يوجد تاريخ استحقاق، نفترض 30 يوماً
-    due_df['due_date'] = pd.to_datetime(due_df.get('due_date', None)).fillna(
-        pd.to_datetime(due_df['jv_date']) + pd.Timedelta(days=30)
-    ).dt.date
-    
-    # حساب الأيام المتبقية
-    today = datetime.now().date()
-    due_df['days_left'] = due_df['due_date'].apply(lambda x: (x - today).days)
-    
-    return due_df[['acc_name', 'jv_date', 'due_date', 'total_amount', 'days_left']]
+    return due_df.sort_values('due_date')[['acc_name', 'jv_date', 'due_date', 'total_amount', 'days_left']]
     
+# --- سجل الرقابة (كتابة في الخلفية) ---
+AUDIT_QUEUE_MAX = 10000          # حد الطابور في الذاكرة (الزائد يُكتب مباشرة في الملف المحلي)
+AUDIT_BATCH_SIZE = 200           # أقصى عدد أحداث في طلب إدراج واحد
+AUDIT_FLUSH_SECONDS = 2.0        # أقصى مدة انتظار قبل إرسال دفعة غير مكتملة
+AUDIT_SPOOL_PATH = "audit_spool.jsonl"
+
+class _AuditWriter:
+    """
+    كاتب سجل الرقابة في الخلفية: log_event تضيف الحدث للطابور وتعود فوراً،
+    وخيط واحد يرسل الأحداث على دفعات (عند امتلاء الدفعة أو كل AUDIT_FLUSH_SECONDS).
+    الدفعات التي يفشل إرسالها (انقطاع الشبكة) تُحفظ في ملف محلي وتُعاد محاولتها لاحقاً،
+    والمتبقي في الطابور يُرسل (أو يُحفظ) عند إغلاق العملية.
+    """
+
+    def __init__(self, spool_path, max_queue, batch_size, flush_seconds):
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._partitions_day = None
+
+    def submit(self, event):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._spool([event])
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _next_batch(self):
+        """أول حدث (بانتظار حتى flush_seconds) ثم ما يلحقه حتى تمتلئ الدفعة أو تنتهي المهلة"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        supabase.table("audit_log").insert(batch).execute()
+        invalidate_cache("audit_log")
+
+    def _spool(self, batch):
+        with self._spool_lock:
+            with open(self.spool_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in batch)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _drain_spool(self):
+        """إعادة إرسال الأحداث المحفوظة محلياً، مع إبقاء ما لم يُرسل في الملف"""
+        with self._spool_lock:
+            if not os.path.exists(self.spool_path):
+                return
+            with open(self.spool_path, encoding='utf-8') as f:
+                events = [json.loads(line) for line in f if line.strip()]
+            sent = 0
+            try:
+                for i in range(0, len(events), self.batch_size):
+                    self._send(events[i:i + self.batch_size])
+                    sent = i + self.batch_size
+            except Exception as e:
+                print(f"⚠️ تعذر إرسال سجل الرقابة المحفوظ محلياً، ستُعاد المحاولة: {e}")
+            if sent >= len(events):
+                os.remove(self.spool_path)
+            elif sent:
+                tmp_path = self.spool_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in events[sent:])
+                os.replace(tmp_path, self.spool_path)
+
+    def _flush(self, batch):
+        try:
+            self._send(batch)
+            return True
+        except Exception as e:
+            print(f"⚠️ تنبيه: فشل التسجيل في audit_log، حُفظت {len(batch)} حدث محلياً. السبب: {e}")
+            self._spool(batch)
+            return False
+
+    def _ensure_partitions(self):
+        """تجهيز أقسام الأشهر القادمة مرة يومياً، حتى لا تتراكم الأحداث في القسم الافتراضي"""
+        today = datetime.now().date()
+        if self._partitions_day == today:
+            return
+        self._partitions_day = today
+        try:
+            _rpc("ensure_audit_partitions", {})
+        except Exception as e:
+            print(f"⚠️ تعذر تجهيز أقسام سجل الرقابة للأشهر القادمة: {e}")
+
+    def _run(self):
+        self._ensure_partitions()
+        self._drain_spool()
+        while not self._stop.is_set():
+            self._ensure_partitions()
+            batch = self._next_batch()
+            # الشبكة عادت: نرسل المحفوظ محلياً أولاً
+            if batch and self._flush(batch) and os.path.exists(self.spool_path):
+                self._drain_spool()
+
+    def close(self, timeout=5.0):
+        """إيقاف الخيط وإرسال ما تبقى في الطابور (أو حفظه محلياً إذا تعذر الإرسال)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(pending), self.batch_size):
+            self._flush(pending[i:i + self.batch_size])
+
+_audit_writer = _AuditWriter(AUDIT_SPOOL_PATH, AUDIT_QUEUE_MAX, AUDIT_BATCH_SIZE, AUDIT_FLUSH_SECONDS)
+
 def log_event(user, action, details):
+    """تسجيل حدث في سجل الرقابة دون انتظار الشبكة (انظر _AuditWriter)"""
+    # وقت الحدث يُسجل هنا وليس عند الإدراج: الدفعات والأحداث المحفوظة محلياً قد تُرسل بعد ساعات،
+    # والوقت يحدد أيضاً القسم الشهري الذي يُحفظ فيه الحدث
+    _audit_writer.submit({
+        "user_name": str(user),
+        "action": str(action),
+        "details": str(details),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    })
+
+# --- عرض سجل الرقابة وأرشفته ---
+# الجدول مقسم شهرياً (انظر supabase/migrations)، والأقسام الأقدم من AUDIT_RETENTION_MONTHS
+# تُحفظ في AUDIT_ARCHIVE_DIR كملفات JSONL مضغوطة ثم تُحذف من القاعدة
+AUDIT_PAGE_SIZE = 50
+AUDIT_RETENTION_MONTHS = 12
+AUDIT_ARCHIVE_DIR = "audit_archive"
+
+def get_audit_page(before_id=None, limit=AUDIT_PAGE_SIZE, user=None, action=None, date_from=None, date_to=None):
+    """
+    صفحة من سجل الرقابة (الأحدث أولاً) بمؤشر على id، مع فلترة المستخدم والإجراء والفترة على الخادم.
+    فلتر الفترة يحصر القراءة في أقسام الأشهر المطلوبة فقط.
+    """
     try:
-        payload = {
-            "user_name": str(user),
-            "action": str(action),
-            "details": str(details) 
-            # حذفنا السطر الخاص بالـ timestamp لنترك القاعدة تسجله تلقائياً
-        }
-        # محاولة الإرسال
-        supabase.table("audit_log").insert(payload).execute()
+        query = supabase.table("audit_log").select("*")
+        if before_id is not None:
+            query = query.lt("id", int(before_id))
+        if user:
+            query = query.eq("user_name", str(user))
+        if action:
+            query = query.ilike("action", f"%{action}%")
+        if date_from:
+            query = query.gte("created_at", str(date_from))
+        if date_to:
+            # حتى نهاية اليوم المختار
+            query = query.lt("created_at", str(pd.Timestamp(date_to) + pd.Timedelta(days=1))[:10])
+        res = query.order("id", desc=True).limit(limit).execute()
+        return pd.DataFrame(res.data or [])
+    except Exception as e:
+        print(f"⚠️ Audit Page Error: {e}")
+        return pd.DataFrame()
+
+def audit_default_partition_rows():
+    """عدد الأحداث في القسم الافتراضي (يجب أن يكون صفراً)، أو None إذا لم يكن التقسيم مثبتاً"""
+    try:
+        ok, rows = _rpc("audit_log_default_rows", {})
+        return int(rows or 0) if ok else None
+    except Exception as e:
+        print(f"⚠️ تعذر فحص القسم الافتراضي لسجل الرقابة: {e}")
+        return None
+
+def archive_audit_log(retention_months=AUDIT_RETENTION_MONTHS):
+    """
+    أرشفة أقسام سجل الرقابة الأقدم من retention_months شهراً:
+    كل قسم يُكتب في ملف audit_log_YYYY_MM.jsonl.gz، ولا يُحذف من القاعدة إلا بعد مطابقة عدد صفوفه.
+    تجهز أيضاً أقسام الأشهر القادمة.
+    """
+    try:
+        ok, _ = _rpc("ensure_audit_partitions", {})
+        if not ok:
+            return False, "⚠️ تقسيم سجل الرقابة غير مثبت في القاعدة بعد (انظر supabase/migrations)"
+        cutoff = (pd.Timestamp.now().normalize().replace(day=1) - pd.DateOffset(months=int(retention_months))).date()
+        _, partitions = _rpc("audit_log_partitions", {})
+        old = [p for p in partitions or [] if str(p['range_end']) <= str(cutoff)]
+        if not old:
+            return True, "ℹ️ لا توجد أشهر أقدم من مدة الاحتفاظ"
+
+        os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+        archived, rows_total = [], 0
+        for part in old:
+            filters = [("gte", "created_at", str(part['range_start']), False), ("lt", "created_at", str(part['range_end']), False)]
+            path = os.path.join(AUDIT_ARCHIVE_DIR, f"{part['name']}.jsonl.gz")
+            written = 0
+            with gzip.open(path + ".tmp", 'wt', encoding='utf-8') as f:
+                for rows in iter_table("audit_log", filters=filters):
+                    f.writelines(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in rows)
+                    written += len(rows)
+
+            # مطابقة العدد قبل الحذف (حدث قد يُضاف لقسم قديم أثناء الأرشفة)
+            count = supabase.table("audit_log").select("id", count="exact")\
+                .gte("created_at", str(part['range_start'])).lt("created_at", str(part['range_end'])).limit(1).execute().count
+            if count != written:
+                os.remove(path + ".tmp")
+                return False, f"❌ توقفت الأرشفة عند {part['name']}: عدد الصفوف تغير أثناء النسخ ({written} / {count})"
+            os.replace(path + ".tmp", path)
+            ok, dropped = _rpc("drop_audit_partition", {"p_name": part['name']})
+            if not (ok and dropped):
+                invalidate_cache("audit_log")
+                done = f"، بعد أرشفة {len(archived)} شهر" if archived else ""
+                return False, f"❌ توقفت الأرشفة عند {part['name']}: حُفظ الملف لكن تعذر حذف القسم من القاعدة{done}"
+            archived.append(part['name'])
+            rows_total += written
+
+        invalidate_cache("audit_log")
+        return True, f"✅ تمت أرشفة {rows_total} حدث من {len(archived)} شهر في {AUDIT_ARCHIVE_DIR}"
     except Exception as e:
-        # قمنا بتغيير البرينت ليعطيك سبب الخطأ الحقيقي بدلاً من رسالة عامة
-        print(f"⚠️ تنبيه: فشل التسجيل في audit_log. السبب: {e}")
+        return False, f"❌ فشلت أرشفة سجل الرقابة: {str(e)}"
+
+# --- المفاتيح الرقمية للحسابات (acc_id) ---
+# القيود مرتبطة بالحسابات عبر acc_id / offset_acc_id (انظر supabase/migrations)، والاستعلامات
+# تستخدمها بعد اكتمال ترحيل القيود القديمة (migrate_journal_account_ids)، وإلا تبقى على الاسم.
+ACCOUNT_KEYS_BACKFILL_BATCH = 5000
+ACCOUNT_KEYS_MISS_RELOAD = 5  # ثوانٍ: أقل مدة بين إعادتي تحميل عند طلب اسم غير معروف (حساب جديد)
+_JOURNAL_KEY_COLUMNS = {"acc_name": "acc_id", "offset_acc": "offset_acc_id"}
+_account_keys = {"loaded_at": None, "by_name": {}, "by_id": {}}
+_account_keys_lock = threading.Lock()
+_account_ids_ready = {"ready": None, "checked_at": None}
+
+def _load_account_keys(force=False):
+    """خريطة الاسم <-> id في ذاكرة العملية (تُحمل مرة كل CACHE_TTL_SECONDS أو عند الطلب)"""
+    with _account_keys_lock:
+        loaded_at = _account_keys["loaded_at"]
+        if force or loaded_at is None or time.monotonic() - loaded_at > CACHE_TTL_SECONDS:
+            by_name = {}
+            for rows in iter_table("accounts", "id,acc_name"):
+                by_name.update((r['acc_name'], int(r['id'])) for r in rows if r.get('acc_name'))
+            _account_keys.update(loaded_at=time.monotonic(), by_name=by_name, by_id={i: n for n, i in by_name.items()})
+        return _account_keys
+
+def _forget_account_keys():
+    """إعادة تحميل الخريطة في الطلب التالي (بعد إضافة حساب أو حذفه أو تغيير اسمه)"""
+    with _account_keys_lock:
+        _account_keys["loaded_at"] = None
+
+def get_account_id(acc_name):
+    """المفتاح الرقمي لحساب من اسمه (None إذا لم يوجد)"""
+    if not acc_name:
+        return None
+    keys = _load_account_keys()
+    acc_id = keys["by_name"].get(acc_name)
+    if acc_id is None and time.monotonic() - keys["loaded_at"] > ACCOUNT_KEYS_MISS_RELOAD:
+        acc_id = _load_account_keys(force=True)["by_name"].get(acc_name)
+    return acc_id
+
+def get_account_name(acc_id):
+    """اسم الحساب الحالي من مفتاحه الرقمي"""
+    if acc_id is None or pd.isna(acc_id):
+        return None
+    return _load_account_keys()["by_id"].get(int(acc_id))
+
+def _use_account_ids():
+    """هل اكتمل ترحيل المفاتيح الرقمية في القيود؟ (يُعاد الفحص كل CACHE_TTL_SECONDS حتى يكتمل)"""
+    state = _account_ids_ready
+    if state["ready"] or (state["checked_at"] is not None and time.monotonic() - state["checked_at"] < CACHE_TTL_SECONDS):
+        return bool(state["ready"])
+    try:
+        ok, pending = _rpc("journal_account_ids_pending", {})
+        state["ready"] = bool(ok) and not pending
+    except Exception as e:
+        print(f"⚠️ تعذر فحص المفاتيح الرقمية للقيود، سيتم البحث بالاسم: {e}")
+        state["ready"] = False
+    state["checked_at"] = time.monotonic()
+    return state["ready"]
+
+def _journal_key(acc_name, column="acc_name"):
+    """عمود وقيمة فلترة القيود لحساب (acc_name أو offset_acc): المفتاح الرقمي إن أمكن، وإلا الاسم"""
+    if _use_account_ids():
+        acc_id = get_account_id(acc_name)
+        if acc_id is not None:
+            return _JOURNAL_KEY_COLUMNS[column], acc_id
+    return column, acc_name
+
+def migrate_journal_account_ids(batch_size=ACCOUNT_KEYS_BACKFILL_BATCH, progress=None):
+    """
+    ترحيل القيود القديمة إلى المفاتيح الرقمية على دفعات (Keyset على id)، ويمكن إعادة تشغيله بأمان.
+    progress: دالة اختيارية تُستدعى (آخر id تمت معالجته، عدد القيود المحدثة حتى الآن)
+    """
+    try:
+        after, updated = None, 0
+        while True:
+            ok, res = _rpc("backfill_journal_account_ids", {"p_after": after, "p_batch": int(batch_size)})
+            if not ok:
+                return False, "⚠️ المفاتيح الرقمية للقيود غير مثبتة في القاعدة بعد (انظر supabase/migrations)"
+            if res.get("last_id") is None:
+                break
+            after, updated = res["last_id"], updated + int(res.get("updated") or 0)
+            if progress:
+                progress(after, updated)
+
+        invalidate_cache("journal")
+        _account_ids_ready.update(ready=None, checked_at=None)
+        if not _use_account_ids():
+            return False, f"⚠️ تم تحديث {updated} قيد، وما زالت هناك قيود بانتظار الترحيل (أعد التشغيل)"
+        return True, f"✅ تم ترحيل {updated} قيد إلى المفاتيح الرقمية"
+    except Exception as e:
+        return False, f"❌ فشل ترحيل المفاتيح الرقمية: {str(e)}"
+
+# كل كم ترحيل على الحساب نعيد مطابقة رصيده من واقع القيود (0 لتعطيل المطابقة الدورية)
+BALANCE_RECONCILE_EVERY = 500
+_postings_since_reconcile = {}
 
 def update_account_balance(acc_name, debit_change=0, credit_change=0):
     """
-    النسخة الاحترافية: تعيد احتساب الرصيد من واقع حركات القيد لضمان الدقة المطلقة
-    وتجنب أخطاء التراكم اليدوي.
+    تحديث الرصيد بفرق الحركة فقط (مدين - دائن) بدلاً من إعادة جمع كل قيود الحساب،
+    فتبقى تكلفة الترحيل ثابتة مهما كبر سجل الحساب.
+    كل BALANCE_RECONCILE_EVERY ترحيل تتم مطابقة الرصيد من واقع القيود.
     """
     try:
-        # 1. جلب الرصيد الافتتاحي من جدول الحسابات
-        acc_res = supabase.table("accounts").select("opening_balance").eq("acc_name", acc_name).execute()
-        opening_bal = float(acc_res.data[0].get('opening_balance', 0)) if acc_res.data else 0.0
-        
-        # 2. جلب مجموع الحركات المدينة والدائنة من جدول القيود لهذا الحساب
-        journal_res = supabase.table("journal").select("debit, credit").eq("acc_name", acc_name).execute()
-        
-        total_debit = sum(float(row.get('debit', 0)) for row in journal_res.data)
-        total_credit = sum(float(row.get('credit', 0)) for row in journal_res.data)
-        
-        # 3. المعادلة المحاسبية الذهبية
-        # الرصيد الحالي = الرصيد الافتتاحي + (إجمالي المدين - إجمالي الدائن)
-        new_balance = opening_bal + (total_debit - total_credit)
-        
-        # 4. تحديث الرصيد النهائي في جدول الحسابات
-        supabase.table("accounts").update({"current_balance": new_balance}).eq("acc_name", acc_name).execute()
-        
+        delta = float(debit_change or 0) - float(credit_change or 0)
+        if not acc_name or delta == 0:
+            return True
+
+        # 1. الطريق المفضل: دالة ذرية في القاعدة (طلب واحد) بالمفتاح الرقمي، ثم بالاسم
+        acc_id = get_account_id(acc_name)
+        ok = False
+        if acc_id is not None:
+            ok, _ = _rpc("increment_account_balance_by_id", {"p_acc_id": acc_id, "p_delta": delta})
+        if not ok:
+            ok, _ = _rpc("increment_account_balance", {"p_acc_name": acc_name, "p_delta": delta})
+
+        # 2. البديل: قراءة الرصيد الحالي وكتابته بعد إضافة الفرق (طلبان ثابتان)
+        if not ok:
+            key, value = ("id", acc_id) if acc_id is not None else ("acc_name", acc_name)
+            acc_res = supabase.table("accounts").select("current_balance").eq(key, value).execute()
+            if not acc_res.data:
+                return False
+            new_balance = float(acc_res.data[0].get('current_balance') or 0) + delta
+            supabase.table("accounts").update({"current_balance": new_balance}).eq(key, value).execute()
+        invalidate_cache("accounts")
+
+        # 3. المطابقة الدورية
+        if BALANCE_RECONCILE_EVERY:
+            count = _postings_since_reconcile.get(acc_name, 0) + 1
+            if count >= BALANCE_RECONCILE_EVERY:
+                reconcile_account_balance(acc_name)
+                count = 0
+            _postings_since_reconcile[acc_name] = count
+
         return True
     except Exception as e:
         print(f"❌ خطأ في تحديث رصيد الحساب {acc_name}: {e}")
         return False
 
+def _apply_entry_to_balances(entry, sign=1):
+    """
+    تطبيق أثر القيد على رصيد الطرف الرئيسي (أو عكسه عند sign=-1).
+    الرصيد بنفس تعريف كشف الحساب والأرصدة اليومية: الافتتاحي + (مدين - دائن) لقيود الحساب
+    كطرف رئيسي فقط، والحساب المقابل للعرض ولا يتحرك رصيده.
+    """
+    deb = float(entry.get('debit') or 0) * sign
+    crd = float(entry.get('credit') or 0) * sign
+    return update_account_balance(entry.get('acc_name'), deb, crd)
+
+def _apply_entry_effects(entry, sign=1):
+    """كل الآثار المشتقة من القيد عند ترحيله أو حذفه (sign=-1): الأرصدة والأرصدة اليومية"""
+    _apply_entry_to_balances(entry, sign)
+    _apply_entry_to_daily_balances(entry, sign)
+
+def reconcile_account_balance(acc_name):
+    """
+    مطابقة رصيد حساب واحد من واقع القيود:
+    الرصيد = الافتتاحي + (مدين - دائن) لقيوده كطرف رئيسي (نفس مجموع كشف الحساب)
+    """
+    try:
+        acc_id = get_account_id(acc_name)
+        key, value = ("id", acc_id) if acc_id is not None else ("acc_name", acc_name)
+        acc_res = supabase.table("accounts").select("opening_balance").eq(key, value).execute()
+        balance = float(acc_res.data[0].get('opening_balance') or 0) if acc_res.data else 0.0
+
+        for rows in iter_table("journal", "debit,credit", [("eq", *_journal_key(acc_name), False)]):
+            balance += sum(float(r.get('debit') or 0) - float(r.get('credit') or 0) for r in rows)
+
+        supabase.table("accounts").update({"current_balance": balance}).eq(key, value).execute()
+        invalidate_cache("accounts")
+        _postings_since_reconcile[acc_name] = 0
+        return balance
+    except Exception as e:
+        print(f"❌ خطأ في مطابقة رصيد الحساب {acc_name}: {e}")
+        return None
+
+# --- الأرصدة اليومية التراكمية (لحساب الرصيد المنقول باستعلام واحد) ---
+# stale: الجدول لا يطابق القيود (إعادة بناء لم تكتمل، أو ترحيل فشل تحديث رصيده اليومي)،
+# فيُحسب الرصيد المنقول من القيود مباشرة حتى تنجح rebuild_daily_balances
+_daily_balances_state = {"stale": False}
+
+def _bump_daily_balance(acc_name, day, debit, credit):
+    """إضافة حركة يوم معين لحساب، مع ترحيل أثرها على الأيام اللاحقة"""
+    params = {"p_acc_name": acc_name, "p_day": day, "p_debit": debit, "p_credit": credit}
+    ok, _ = _rpc("bump_daily_balance", params)
+    if ok:
+        return
+
+    # البديل: قراءة أيام الحساب من هذا اليوم فما بعد (غالباً يوم واحد) مرتبة وعلى صفحات، وكتابتها معدلة
+    net = debit - credit
+    rows, last_day = [], None
+    while True:
+        query = supabase.table("account_daily_balances").select("*").eq("acc_name", acc_name).gte("day", day)
+        if last_day is not None:
+            query = query.gt("day", last_day)
+        page = query.order("day").limit(PAGE_SIZE).execute().data or []
+        if not page:
+            break
+        rows.extend(page)
+        last_day = page[-1]['day']
+    if not rows or str(rows[0]['day'])[:10] != day:
+        prev = supabase.table("account_daily_balances").select("cum_net").eq("acc_name", acc_name).lt("day", day).order("day", desc=True).limit(1).execute().data
+        prev_cum = float(prev[0]['cum_net']) if prev else 0.0
+        rows.insert(0, {"acc_name": acc_name, "day": day, "day_debit": 0.0, "day_credit": 0.0, "cum_net": prev_cum})
+
+    rows[0]['day_debit'] = float(rows[0]['day_debit']) + debit
+    rows[0]['day_credit'] = float(rows[0]['day_credit']) + credit
+    for r in rows:
+        r['cum_net'] = float(r['cum_net']) + net
+    for i in range(0, len(rows), PAGE_SIZE):
+        supabase.table("account_daily_balances").upsert(rows[i:i + PAGE_SIZE]).execute()
+
+def _apply_entry_to_daily_balances(entry, sign=1):
+    """تطبيق أثر القيد على جدول الأرصدة اليومية للطرف الرئيسي (نفس منطق كشف الحساب)"""
+    try:
+        if not entry.get('acc_name') or not entry.get('date'):
+            return
+        debit = float(entry.get('debit') or 0) * sign
+        credit = float(entry.get('credit') or 0) * sign
+        if debit or credit:
+            _bump_daily_balance(entry['acc_name'], str(entry['date'])[:10], debit, credit)
+    except Exception as e:
+        # لا نوقف الترحيل؛ يمكن إصلاح الجدول لاحقاً عبر rebuild_daily_balances
+        _daily_balances_state["stale"] = True
+        print(f"⚠️ تنبيه: فشل تحديث الرصيد اليومي للحساب {entry.get('acc_name')}: {e}")
+
+def rebuild_daily_balances():
+    """إعادة بناء جدول الأرصدة اليومية بالكامل بمرور واحد على القيود"""
+    try:
+        # 1. الطريق المفضل: حذف وإعادة بناء في معاملة واحدة داخل القاعدة
+        ok, count = _rpc("rebuild_daily_balances", {})
+        if ok:
+            _daily_balances_state["stale"] = False
+            return True, f"✅ تم بناء {int(count or 0)} رصيد يومي"
+
+        # 2. البديل: البناء من العميل على عدة طلبات؛ الجدول ناقص حتى آخر دفعة فلا يُعتمد عليه قبلها
+        _daily_balances_state["stale"] = True
+        partial = []
+        for chunk in iter_table("journal", "acc_name,date,debit,credit", as_frame=True):
+            chunk['day'] = chunk['date'].astype(str).str[:10]
+            chunk['debit'] = pd.to_numeric(chunk['debit'], errors='coerce').fillna(0)
+            chunk['credit'] = pd.to_numeric(chunk['credit'], errors='coerce').fillna(0)
+            partial.append(chunk.groupby(['acc_name', 'day'])[['debit', 'credit']].sum())
+
+        supabase.table("account_daily_balances").delete().gte("day", "1900-01-01").execute()
+        if not partial:
+            _daily_balances_state["stale"] = False
+            return True, "✅ لا توجد قيود، تم تفريغ جدول الأرصدة اليومية"
+
+        daily = pd.concat(partial).groupby(level=[0, 1]).sum().sort_index().reset_index()
+        daily['cum_net'] = (daily['debit'] - daily['credit']).groupby(daily['acc_name']).cumsum()
+        daily = daily.rename(columns={'debit': 'day_debit', 'credit': 'day_credit'})
+
+        records = daily.to_dict(orient='records')
+        for i in range(0, len(records), PAGE_SIZE):
+            supabase.table("account_daily_balances").insert(records[i:i + PAGE_SIZE]).execute()
+        _daily_balances_state["stale"] = False
+        return True, f"✅ تم بناء {len(records)} رصيد يومي"
+    except Exception as e:
+        print(f"Error in rebuild_daily_balances: {e}")
+        return False, str(e)
+
+def get_account_entries(acc_name, from_date, to_date):
+    """حركات حساب واحد خلال فترة (تُفلتر في الخادم بالمفتاح الرقمي إن أمكن) مرتبة بالتاريخ ثم المعرف"""
+    column, value = _journal_key(acc_name)
+    key = int(value) if column == "acc_id" else "'{}'".format(str(value).replace("'", "''"))
+    return db_fetch(f"SELECT * FROM journal WHERE {column} = {key} AND date >= '{from_date}' AND date <= '{to_date}' ORDER BY date, id")
+
+# --- كشوف نهاية الشهر (لكل الحسابات دفعة واحدة) ---
+STATEMENT_BATCH_CATEGORIES = ('عميل', 'عملاء', 'مورد', 'موردين')
+
+def build_period_statements(start_date, end_date, categories=STATEMENT_BATCH_CATEGORIES, skip_empty=True):
+    """
+    كشوف كل الحسابات من قراءة واحدة للسجل: الرصيد المنقول والرصيد التراكمي يُحسبان
+    لكل الحسابات معاً (groupby / cumsum) بدلاً من تكرار الاستعلامات لكل حساب.
+    تعيد قاموساً {اسم الحساب: DataFrame} بأعمدة date, ref_no, op_type, description, debit, credit, balance
+    """
+    start_date, end_date = str(start_date), str(end_date)
+    accounts = pd.concat(list(iter_table("accounts", "acc_name,category,opening_balance", as_frame=True)) or [pd.DataFrame(columns=['acc_name', 'category', 'opening_balance'])], ignore_index=True)
+    if categories:
+        accounts = accounts[accounts['category'].isin(categories)]
+    names = set(accounts['acc_name'])
+
+    # قراءة واحدة للسجل حتى نهاية الفترة، مع الاحتفاظ بقيود الحسابات المطلوبة فقط من كل دفعة
+    columns = "id,date,ref_no,op_type,description,debit,credit,acc_name"
+    chunks = [c[c['acc_name'].isin(names)] for c in iter_table("journal", columns, [("lte", "date", end_date, False)], as_frame=True)]
+    journal = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns.split(","))
+    for col in ('debit', 'credit'):
+        journal[col] = pd.to_numeric(journal[col], errors='coerce').fillna(0.0)
+    journal['date'] = journal['date'].astype(str).str[:10]
+    net = journal['debit'] - journal['credit']
+
+    before = journal['date'] < start_date
+    opening = pd.to_numeric(accounts.set_index('acc_name')['opening_balance'], errors='coerce').fillna(0.0)
+    opening = opening.add(net[before].groupby(journal.loc[before, 'acc_name']).sum(), fill_value=0.0)
+
+    period = journal[~before].assign(net=net[~before]).sort_values(['acc_name', 'date', 'id'])
+    period['balance'] = opening.reindex(period['acc_name']).to_numpy() + period.groupby('acc_name')['net'].cumsum().to_numpy()
+    groups = {acc: grp.drop(columns=['id', 'net', 'acc_name']) for acc, grp in period.groupby('acc_name', sort=False)}
+
+    statements = {}
+    for acc in sorted(names):
+        rows = groups.get(acc)
+        if skip_empty and rows is None and abs(opening.get(acc, 0.0)) < 0.005:
+            continue
+        opening_row = pd.DataFrame([{
+            'date': start_date, 'ref_no': '---', 'op_type': 'رصيد منقول',
+            'description': 'رصيد ما قبل تاريخ البداية', 'debit': 0.0, 'credit': 0.0,
+            'balance': float(opening.get(acc, 0.0)),
+        }])
+        statements[acc] = pd.concat([opening_row, rows], ignore_index=True) if rows is not None else opening_row
+    return statements
+
+def generate_month_end_statements(start_date, end_date, progress=None, categories=STATEMENT_BATCH_CATEGORIES):
+    """كشوف PDF لكل العملاء والموردين في ملف ZIP واحد: (True, bytes, عدد الكشوف) أو (False, رسالة, 0)"""
+    try:
+        statements = build_period_statements(start_date, end_date, categories)
+        if not statements:
+            return False, "⚠️ لا توجد حسابات بها حركة أو رصيد في هذه الفترة", 0
+        return True, render_statements_zip(statements, start_date, end_date, progress), len(statements)
+    except Exception as e:
+        return False, f"❌ فشل إصدار الكشوف: {str(e)}", 0
+
 def get_statement(acc_name, from_date, to_date):
     """
     النسخة الاحترافية الكاملة:
@@ -331,17 +1817,10 @@ def get_statement(acc_name, from_date, to_date):
         # نستخدم الدالة الموجودة مسبقاً في ملفك get_opening_balance_logic
         opening_bal = get_opening_balance_logic(acc_name, from_date)
         
-        # 2. جلب الحركات من Supabase مع ترتيب مزدوج (التاريخ ثم ID)
-        res = supabase.table("journal")\
-            .select("*")\
-            .eq("acc_name", acc_name)\
-            .gte("date", from_date)\
-            .lte("date", to_date)\
-            .order("date", desc=False)\
-            .order("id", desc=False)\
-            .execute()
-            
-        df = pd.DataFrame(res.data) if res.data else pd.DataFrame()
+        # 2. جلب حركات الفترة من Supabase على صفحات (الترتيب بالتاريخ ثم ID يتم أدناه)
+        filters = [("eq", *_journal_key(acc_name), False), ("gte", "date", str(from_date), False), ("lte", "date", str(to_date), False)]
+        chunks = list(iter_table("journal", "*", filters, as_frame=True))
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
         
         # 3. إنشاء سطر الرصيد المنقول يدوياً ليظهر في أعلى الجدول
         opening_row = pd.DataFrame([{
@@ -380,15 +1859,41 @@ def init_db():
     """دالة لتهيئة قاعدة البيانات (غير مطلوبة في Supabase)"""
     pass
 
+def _jv_ref_prefix(op_type):
+    return "INV" if "بيع" in str(op_type) else "VCH"
+
+def generate_jv_refs(op_types):
+    """مراجع فريدة لعدة قيود (INV2026-000001 / VCH2026-000001) بطلب حجز واحد لكل بادئة"""
+    prefixes = [_jv_ref_prefix(op) for op in op_types]
+    pools = {p: iter(next_sequence_codes("jv", p, prefixes.count(p))) for p in set(prefixes)}
+    return [next(pools[p]) for p in prefixes]
+
 def generate_jv_ref(op_type):
-    prefix = "INV" if "بيع" in op_type else "VCH"
-    return f"{prefix}-{datetime.now().strftime('%y%m%d%H%M')}"
+    """مرجع القيد التالي (يُستدعى عند الترحيل فقط حتى لا تُستهلك الأرقام مع كل تحديث للصفحة)"""
+    try:
+        return generate_jv_refs([op_type])[0]
+    except Exception as e:
+        print(f"⚠️ تعذر حجز مرجع القيد: {e}")
+        return f"{_jv_ref_prefix(op_type)}-{datetime.now().strftime('%y%m%d%H%M%S%f')}"
 
 def get_recent_transactions(limit=20):
+    return get_journal_page(limit=limit)
+
+JOURNAL_LOG_PAGE_SIZES = (20, 50, 100)
+
+def get_journal_page(before_id=None, limit=JOURNAL_LOG_PAGE_SIZES[0]):
+    """
+    صفحة من سجل القيود (الأحدث أولاً) بمؤشر على id بدلاً من offset:
+    before_id هو أصغر id في الصفحة السابقة، فتبقى كلفة كل صفحة ثابتة مهما كبر السجل
+    """
     try:
-        res = requests.get(f"{URL}/journal?order=id.desc&limit={limit}", headers=HEADERS)
-        return pd.DataFrame(res.json()) if res.status_code == 200 else pd.DataFrame()
-    except:
+        query = supabase.table("journal").select("*")
+        if before_id is not None:
+            query = query.lt("id", int(before_id))
+        res = query.order("id", desc=True).limit(limit).execute()
+        return _normalize_frame(pd.DataFrame(res.data or []), "journal")
+    except Exception as e:
+        print(f"⚠️ Journal Page Error: {e}")
         return pd.DataFrame()
 
 def delete_journal_entry(entry_id, user_role, user_name):
@@ -397,9 +1902,11 @@ def delete_journal_entry(entry_id, user_role, user_name):
         return False, "🚫 عذراً، لا تملك صلاحية الحذف"
         
     try:
-        # قبل الحذف، يجب عكس أثر القيد على الأرصدة (اختياري لكنه ممارسة محاسبية سليمة)
+        # الحذف ثم عكس أثر القيد على رصيد الحساب وأرصدته اليومية
         res = supabase.table("journal").delete().eq("id", entry_id).execute()
+        invalidate_cache("journal")
         if res.data:
+            _apply_entry_effects(res.data[0], sign=-1)
             log_event(user_name, "حذف قيد", f"تم حذف القيد رقم {entry_id}")
             return True, "✅ تم حذف القيد بنجاح"
         return False, "❌ لم يتم العثور على القيد"
@@ -414,6 +1921,9 @@ def db_write(table_name, data=None, action="INSERT", row_id=None):
             res = supabase.table(table_name).update(data).eq("id", row_id).execute()
         elif action == "DELETE":
             res = supabase.table(table_name).delete().eq("id", row_id).execute()
+        invalidate_cache(table_name)
+        if table_name == "accounts":
+            _forget_account_keys()
         return (True, "تمت العملية بنجاح") if res.data else (False, "فشلت العملية")
     except Exception as e:
         return False, str(e)
@@ -421,6 +1931,7 @@ def db_write(table_name, data=None, action="INSERT", row_id=None):
 def update_account(acc_id, account_data):
     try:
         res = supabase.table("accounts").update(account_data).eq("id", acc_id).execute()
+        invalidate_cache("accounts")
         return (True, "✅ تم التحديث") if res.data else (False, "❌ فشل")
     except Exception as e:
         return False, str(e)
@@ -428,32 +1939,18 @@ def update_record(table, column_name, value, update_data):
     """تحديث سجل موجود بالسحاب"""
     try:
         supabase.table(table).update(update_data).eq(column_name, value).execute()
+        invalidate_cache(table)
         return True, "تم التحديث بنجاح ✅"
     except Exception as e:
         return False, f"خطأ في التحديث: {str(e)}"
 
     
 def backup_system():
+    """نسخة احتياطية يدوية كاملة (تصبح أساساً لسلسلة النسخ التزايدية)، تعيد مسار ملف CSV المحلي"""
     try:
-        # 1. جلب البيانات من جدول القيود
-        df = db_fetch("journal") 
-        if df.empty: return None
-        
-        # 2. تحويل البيانات لـ JSON لرفعها للسحاب
-        json_data = df.to_json(orient='records')
-        
-        # 3. الرفع للسحاب
-        entry = {
-            "backup_date": datetime.now().strftime("%Y-%m-%d"),
-            "data_json": json_data
-        }
-        supabase.table("system_backups").insert(entry).execute()
-        
-        # 4. إنشاء ملف CSV محلي (هذا ما ينتظره كود Streamlit الخاص بك)
         file_path = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        df.to_csv(file_path, index=False, encoding='utf-8-sig')
-        
-        return file_path # سيعود المسار لـ Streamlit لكي يفتحه
+        backup_id = _save_base_backup(file_path)
+        return file_path if backup_id else None
     except Exception as e:
         print(f"Backup Error: {e}")
         return None
@@ -467,11 +1964,11 @@ def update_journal_entry(entry_id, new_acc, new_amt, new_desc, op_type):
     try:
         # 1. تجهيز الأرقام
         amount = float(new_amt)
-        tax = amount * 0.15 
+        tax = amount * VAT_RATE
         total = amount + tax
 
         # 2. تحديد المنطق المحاسبي
-        is_revenue = any(x in op_type for x in ["بيع", "قبض", "إيراد"])
+        is_revenue = any(x in op_type for x in REVENUE_KEYWORDS)
         deb, crd = (0, total) if is_revenue else (total, 0)
 
         # 3. القاموس المحدث (Payload)
@@ -485,10 +1982,15 @@ def update_journal_entry(entry_id, new_acc, new_amt, new_desc, op_type):
             "credit": crd
         }
         
-        # 4. التنفيذ في Supabase
+        # 4. التنفيذ في Supabase (مع الاحتفاظ بالقيد القديم لعكس أثره على الأرصدة)
+        old = supabase.table("journal").select("acc_name, offset_acc, date, debit, credit").eq("id", entry_id).execute()
         res = supabase.table("journal").update(payload).eq("id", entry_id).execute()
+        invalidate_cache("journal")
         
         if res.data:
+            if old.data:
+                _apply_entry_effects(old.data[0], sign=-1)
+            _apply_entry_effects(res.data[0])
             return True, "✅ تم تحديث بيانات القيد بنجاح"
         return False, "❌ لم يتم العثور على القيد المطلوب"
     except Exception as e:
@@ -496,210 +1998,497 @@ def update_journal_entry(entry_id, new_acc, new_amt, new_desc, op_type):
     
 
 def update_account(acc_id, account_data):
-    """تعديل حساب - بناءً على خطأ الصورة image_6eda80"""
+    """تعديل حساب - بناءً على خطأ الصورة image_6eda80 (تغيير الاسم يمر عبر rename_account لنقل قيود الحساب معه)"""
     try:
+        account_data = dict(account_data)
+        new_name = account_data.pop("acc_name", None)
+        if new_name:
+            ok, _ = _rpc("rename_account", {"p_acc_id": int(acc_id), "p_new_name": new_name})
+            if ok:
+                invalidate_cache("journal")
+            else:
+                account_data["acc_name"] = new_name
         res = supabase.table("accounts").update(account_data).eq("id", acc_id).execute()
+        invalidate_cache("accounts")
+        _forget_account_keys()
         return (True, "✅ تم تحديث الحساب") if res.data else (False, "❌ فشل التحديث")
     except Exception as e:
         return False, str(e)
-    
-def get_detailed_debts():
-    """تحليل احترافي للديون المستحقة للموردين"""
-    df = db_fetch("journal")
-    if df.empty or 'op_type' not in df.columns:
-        return pd.DataFrame(), pd.DataFrame()
 
-    # 1. تصفية المشتريات الآجلة فقط
-    due_df = df[df['op_type'].str.contains('شراء آجل', na=False)].copy()
-    if due_df.empty:
-        return pd.DataFrame(), pd.DataFrame()
+# --- جدول دليل الحسابات (صفحات من الخادم + تعديلات مجمعة) ---
+ACCOUNTS_PAGE_SIZE = 100
+ACCOUNT_GRID_COLUMNS = ["id", "acc_code", "acc_name", "category", "opening_balance", "credit_limit",
+                        "current_balance", "tax_number", "phone", "address", "is_active"]
+# الاسم والكود والأرصدة لا تُعدل من الجدول (الاسم مرتبط بالقيود، والأرصدة تحسبها القيود)
+ACCOUNT_EDITABLE_COLUMNS = ["category", "credit_limit", "tax_number", "phone", "address", "is_active"]
 
-    # 2. معالجة التواريخ
-    today = datetime.now().date()
-    due_df['due_date'] = pd.to_datetime(due_df.get('due_date', None)).fillna(
-        pd.to_datetime(due_df['jv_date']) + pd.Timedelta(days=30)
-    ).dt.date
+def get_accounts_page(page=0, page_size=ACCOUNTS_PAGE_SIZE, sort_by="acc_code", descending=False,
+                      search=None, category=None, active_only=False):
+    """
+    صفحة واحدة من الحسابات مرتبة ومصفاة على الخادم، وتعيد (DataFrame, إجمالي عدد المطابق)
+    - search: جزء من الاسم أو الكود أو الجوال
+    """
+    if sort_by not in ACCOUNT_GRID_COLUMNS:
+        sort_by = "acc_code"
+    try:
+        query = supabase.table("accounts").select(",".join(ACCOUNT_GRID_COLUMNS), count="exact")
+        if category:
+            query = query.eq("category", category)
+        if active_only:
+            query = query.eq("is_active", True)
+        search = str(search or "").strip().replace('"', '')
+        if search:
+            query = query.or_(f'acc_name.ilike."%{search}%",acc_code.ilike."%{search}%",phone.ilike."%{search}%"')
+        start = page * page_size
+        res = _page_range(_order_by(query, [(sort_by, descending), ("id", False)]), start, page_size).execute()
+        df = pd.DataFrame(res.data or [], columns=ACCOUNT_GRID_COLUMNS)
+        return df, int(res.count if res.count is not None else len(df))
+    except Exception as e:
+        print(f"⚠️ Accounts Page Error: {e}")
+        return pd.DataFrame(columns=ACCOUNT_GRID_COLUMNS), 0
 
-    # 3. حساب التأخير بالأيام
-    due_df['days_diff'] = due_df['due_date'].apply(lambda x: (today - x).days)
+def save_account_changes(changes, user_name="System"):
+    """
+    حفظ تعديلات جدول الحسابات دفعة واحدة.
+    changes: قاموس {id الحساب: {العمود: القيمة}} (إلغاء التفعيل = {"is_active": False})
+    """
+    rows = []
+    for acc_id, patch in (changes or {}).items():
+        patch = {k: v for k, v in patch.items() if k in ACCOUNT_EDITABLE_COLUMNS}
+        if patch:
+            rows.append({"id": int(acc_id), **patch})
+    if not rows:
+        return True, "ℹ️ لا توجد تعديلات"
+
+    try:
+        ok, updated = _rpc("update_accounts_batch", {"p_rows": rows})
+        if not ok:
+            # بديل: طلب واحد لكل مجموعة حسابات تشترك في نفس التعديل (مثل إلغاء تفعيل عدة حسابات)
+            groups = {}
+            for row in rows:
+                patch = {k: v for k, v in row.items() if k != "id"}
+                groups.setdefault(json.dumps(patch, sort_keys=True, default=str), (patch, []))[1].append(row["id"])
+            updated = 0
+            for patch, ids in groups.values():
+                res = supabase.table("accounts").update(patch).in_("id", ids).execute()
+                updated += len(res.data or [])
+        invalidate_cache("accounts")
+        log_event(user_name, "تعديل الحسابات", f"تعديل مجمع لعدد {len(rows)} حساب: {[r['id'] for r in rows]}")
+        return True, f"✅ تم حفظ تعديلات {updated} حساب"
+    except Exception as e:
+        return False, f"❌ فشل حفظ التعديلات: {e}"
+    
+def get_detailed_debts():
+    """تحليل احترافي للديون المستحقة للموردين (الفواتير التي حل موعدها فقط، من الخادم)"""
+    urgent = get_open_credit_items("payable", due_before=datetime.now().strftime('%Y-%m-%d'))
+    if urgent.empty:
+        return pd.DataFrame(), pd.DataFrame()
 
     # الفئة أ: مستحقون حالياً (تاريخ اليوم تجاوز تاريخ الاستحقاق)
-    urgent = due_df[due_df['days_diff'] >= 0].copy()
+    urgent['days_diff'] = -urgent['days_left']
     
     # الفئة ب: خطر جداً (تجاوزوا شهر كامل من تاريخ الاستحقاق)
     critical = urgent[urgent['days_diff'] > 30].copy()
 
     return urgent, critical
 
-def create_pdf_report(df, account_name, start_date, end_date):
-    """النسخة المحدثة: تمنع خروج النص من الجداول وترتب البيانات بدقة"""
+# --- ملخص لوحة التحكم (الصفحة الرئيسية) ---
+DASHBOARD_TURNOVER_DAYS = 10
+
+def get_dashboard_summary():
+    """
+    ملخص الصفحة الرئيسية من جداول الملخص التزايدية في طلب واحد:
+    - categories: رصيد كل تصنيف (Series)
+    - turnover: التداول اليومي لآخر DASHBOARD_TURNOVER_DAYS أيام بها حركة (date, total_amount)
+    - overdue: المستحق لكل مورد (total_amount) ومنه المتأخر أكثر من 30 يوماً (critical_amount)
+    """
     try:
-        buffer = io.BytesIO()
-        # إنشاء الوثيقة مع هوامش (Margins)
-        doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
-        elements = []
-        
-        # تسجيل الخط العربي
-        pdfmetrics.registerFont(TTFont('ArabicFont', 'arial.ttf'))
-        
-        # إعداد نمط النص العربي مع خاصية التفاف النص (Word Wrap)
-        styles = getSampleStyleSheet()
-        style_ar = styles['Normal']
-        style_ar.fontName = 'ArabicFont'
-        style_ar.fontSize = 10
-        style_ar.alignment = 1  # سنتر
-        style_ar.wordWrap = 'CJK' # تفعيل الالتفاف لمنع خروج النص
-
-        # 1. العنوان
-        elements.append(Paragraph(f"<b>تقرير كشف حساب تفصيلي</b>", style_ar))
-        elements.append(Paragraph(f"اسم الحساب: {account_name}", style_ar))
-        elements.append(Paragraph(f"الفترة من {start_date} إلى {end_date}", style_ar))
-        elements.append(Spacer(1, 20)) # مسافة فارغة
-
-        # 2. تجهيز بيانات الجدول
-        # نضع العناوين أولاً
-        table_data = [["التاريخ", "المرجع", "البيان", "مدين", "دائن", "الرصيد"]]
-        
-        for _, row in df.iterrows():
-            table_data.append([
-                str(row['date'].date()) if hasattr(row['date'], 'date') else str(row['date']),
-                str(row.get('ref_no', '')),
-                Paragraph(str(row.get('description', '') or row.get('op_type', '')), style_ar), # هنا سر الحل
-                f"{row.get('debit', 0):,.2f}",
-                f"{row.get('credit', 0):,.2f}",
-                f"{row.get('balance', 0):,.2f}"
-            ])
-
-        # 3. تحديد عرض الأعمدة (مجموع عرض A4 المتاح هو 530 تقريباً)
-        # وسعنا عمود البيان (180) ليأخذ راحته في الكتابة
-        column_widths = [75, 85, 180, 60, 60, 70]
-        
-        pdf_table = Table(table_data, colWidths=column_widths)
-
-        # 4. تنسيق شكل الجدول
-        style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#0D47A1")), # لون الترويسة أزرق غامق
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, -1), 'ArabicFont'),
-            ('FONTSIZE', (0, 0), (-1, 0), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black), # رسم خطوط الشبكة
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'), # توسيط النص عمودياً
-        ])
-        pdf_table.setStyle(style)
-
-        elements.append(pdf_table)
-
-        # 5. التذييل (الرصيد النهائي)
-        final_bal = df['balance'].iloc[-1] if not df.empty else 0
-        elements.append(Spacer(1, 20))
-        elements.append(Paragraph(f"الرصيد النهائي المستحق: {abs(final_bal):,.2f} ريال", style_ar))
-        
-        # بناء الـ PDF
-        doc.build(elements)
-        buffer.seek(0)
-        return buffer.getvalue()
-        
+        ok, data = _rpc("get_dashboard_summary", {"p_days": DASHBOARD_TURNOVER_DAYS})
     except Exception as e:
-        print(f"PDF Error: {str(e)}")
-        return None
+        print(f"⚠️ تعذر قراءة ملخص لوحة التحكم، سيتم الحساب مباشرة: {e}")
+        ok, data = False, None
+
+    if ok and data:
+        categories = pd.DataFrame(data['categories'], columns=['category', 'balance'])
+        turnover = pd.DataFrame(data['turnover'], columns=['day', 'total_amount']).rename(columns={'day': 'date'})
+        overdue = pd.DataFrame(data['overdue'], columns=['acc_name', 'total_amount', 'critical_amount'])
+    else:
+        # البديل قبل تثبيت جداول الملخص: نفس الأرقام من الحسابات وآخر فترة من السجل فقط
+        accounts = db_fetch("accounts")
+        categories = accounts[['category', 'current_balance']].rename(columns={'current_balance': 'balance'}) if not accounts.empty else pd.DataFrame(columns=['category', 'balance'])
+
+        since = (datetime.now() - timedelta(days=DASHBOARD_TURNOVER_DAYS * 3)).strftime('%Y-%m-%d')
+        recent = db_fetch(f"SELECT date, total_amount FROM journal WHERE date >= '{since}'")
+        if recent.empty:
+            turnover = pd.DataFrame(columns=['date', 'total_amount'])
+        else:
+            recent['total_amount'] = pd.to_numeric(recent['total_amount'], errors='coerce').fillna(0)
+            turnover = recent.groupby('date')['total_amount'].sum().reset_index().tail(DASHBOARD_TURNOVER_DAYS)
+
+        urgent, critical = get_detailed_debts()
+        if urgent.empty:
+            overdue = pd.DataFrame(columns=['acc_name', 'total_amount', 'critical_amount'])
+        else:
+            overdue = urgent.groupby('acc_name')['total_amount'].sum().to_frame()
+            overdue['critical_amount'] = critical.groupby('acc_name')['total_amount'].sum() if not critical.empty else 0
+            overdue = overdue.reset_index()
+
+    categories['balance'] = pd.to_numeric(categories['balance'], errors='coerce').fillna(0)
+    turnover['total_amount'] = pd.to_numeric(turnover['total_amount'], errors='coerce').fillna(0)
+    for col in ('total_amount', 'critical_amount'):
+        overdue[col] = pd.to_numeric(overdue[col], errors='coerce').fillna(0)
+    return {
+        "categories": categories.groupby('category')['balance'].sum(),
+        "turnover": turnover,
+        "overdue": overdue,
+    }
 
 def get_opening_balance_logic(acc_name, start_date):
-    """حساب الرصيد الذي يسبق تاريخ البحث المختار"""
+    """
+    حساب الرصيد الذي يسبق تاريخ البحث المختار:
+    الافتتاحي + آخر رصيد يومي تراكمي قبل التاريخ (استعلام واحد على الفهرس).
+    """
     try:
         # جلب الرصيد الأساسي عند التأسيس
-        acc_data = supabase.table("accounts").select("opening_balance").eq("acc_name", acc_name).execute()
-        initial_bal = float(acc_data.data[0]['opening_balance']) if acc_data.data else 0.0
-        
-        # جلب كافة الحركات قبل تاريخ البداية
-        pre_entries = supabase.table("journal").select("debit, credit").eq("acc_name", acc_name).lt("date", start_date).execute()
-        
-        if pre_entries.data:
-            sum_debit = sum(float(item['debit']) for item in pre_entries.data)
-            sum_credit = sum(float(item['credit']) for item in pre_entries.data)
-            return initial_bal + (sum_debit - sum_credit)
-        
-        return initial_bal
+        acc_id = get_account_id(acc_name)
+        key, value = ("id", acc_id) if acc_id is not None else ("acc_name", acc_name)
+        acc_data = supabase.table("accounts").select("opening_balance").eq(key, value).execute()
+        initial_bal = float(acc_data.data[0]['opening_balance'] or 0) if acc_data.data else 0.0
+
+        # 1. الطريق السريع: جدول الأرصدة اليومية (ما لم يكن بانتظار إعادة البناء)
+        if not _daily_balances_state["stale"]:
+            try:
+                snap = supabase.table("account_daily_balances").select("cum_net").eq("acc_name", acc_name)\
+                    .lt("day", str(start_date)).order("day", desc=True).limit(1).execute()
+                if snap.data:
+                    return initial_bal + float(snap.data[0]['cum_net'])
+                # لا يوجد رصيد يومي: نتأكد أنه لا توجد حركات سابقة فعلاً (الجدول ربما لم يُبنَ بعد)
+                probe = supabase.table("journal").select("id").eq(*_journal_key(acc_name)).lt("date", str(start_date)).limit(1).execute()
+                if not probe.data:
+                    return initial_bal
+            except Exception as e:
+                print(f"⚠️ جدول الأرصدة اليومية غير متاح، سيتم الجمع من القيود: {e}")
+
+        # 2. البديل: جمع كافة الحركات قبل تاريخ البداية (على صفحات)
+        sum_debit = sum_credit = 0.0
+        filters = [("eq", *_journal_key(acc_name), False), ("lt", "date", str(start_date), False)]
+        for rows in iter_table("journal", "debit,credit", filters):
+            sum_debit += sum(float(item['debit'] or 0) for item in rows)
+            sum_credit += sum(float(item['credit'] or 0) for item in rows)
+
+        return initial_bal + (sum_debit - sum_credit)
     except:
         return 0.0
     
+# --- محرك الاستعادة ---
+# يقرأ المصدر تدفقياً، ويقسمه إلى دفعات بحسب حجمها بالبايت، ويرسل عدة دفعات بالتوازي
+# إلى جدول وسيط ثم يبدّله مع journal دفعة واحدة. ملف نقطة الحفظ يسمح باستئناف استعادة منقطعة.
+RESTORE_BATCH_BYTES = 512 * 1024
+RESTORE_MAX_BATCH_ROWS = 5000
+RESTORE_WORKERS = 4
+RESTORE_STAGING_TABLE = "journal_restore_staging"
+# المفاتيح الرقمية تُعاد من الأسماء عند الإدراج (قد تختلف أرقام الحسابات بين قاعدة وأخرى)
+RESTORE_SKIP_COLUMNS = ('id', 'created_at', 'updated_at', 'settled', 'search_text', 'acc_id', 'offset_acc_id')
+
+def _restore_batches(records):
+    """تقسيم الصفوف إلى دفعات بحسب الحجم، بشكل ثابت لنفس المصدر (شرط لصحة الاستئناف)"""
+    batch, size = [], 0
+    for row_no, r in enumerate(records, start=1):
+        item = {k: v for k, v in r.items() if k not in RESTORE_SKIP_COLUMNS}
+        item_bytes = len(json.dumps(item, default=str))
+        if batch and (size + item_bytes > RESTORE_BATCH_BYTES or len(batch) >= RESTORE_MAX_BATCH_ROWS):
+            yield batch
+            batch, size = [], 0
+        batch.append((row_no, item))
+        size += item_bytes
+    if batch:
+        yield batch
+
+def _load_restore_checkpoint(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_restore_checkpoint(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def _staging_available():
+    if "swap_journal_from_staging" in _MISSING_RPC:
+        return False
+    try:
+        supabase.table(RESTORE_STAGING_TABLE).select("id").limit(1).execute()
+        return True
+    except Exception:
+        return False
+
+def _pipeline_batches(restore_key, records, state, ckpt_path):
+    """إرسال الدفعات إلى الجدول الوسيط بالتوازي مع تسجيل كل دفعة مكتملة في ملف نقطة الحفظ، ويعيد عدد الصفوف"""
+    done = set(state['done'])
+    total = 0
+
+    def send(batch_no, batch):
+        # الرفع بمفتاح (restore_key, src_row) فإعادة الدفعة بعد انقطاع لا تكرر صفوفها
+        rows = [{"restore_key": restore_key, "src_row": n, "payload": item} for n, item in batch]
+        supabase.table(RESTORE_STAGING_TABLE).upsert(rows, on_conflict="restore_key,src_row").execute()
+        return batch_no
+
+    def collect(finished):
+        error = None
+        for f in finished:
+            if f.cancelled():
+                continue
+            try:
+                done.add(f.result())
+            except Exception as e:
+                error = error or e
+        state['done'] = sorted(done)
+        _save_restore_checkpoint(ckpt_path, state)
+        if error:
+            raise error
+
+    with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as pool:
+        pending = set()
+        try:
+            for batch_no, batch in enumerate(_restore_batches(records)):
+                total += len(batch)
+                if batch_no in done:
+                    continue
+                pending.add(pool.submit(send, batch_no, batch))
+                # لا نقرأ من المصدر أكثر من ضعف عدد العمال حتى لا تتضخم الذاكرة
+                if len(pending) >= RESTORE_WORKERS * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+        except Exception:
+            # تسجيل ما اكتمل من الدفعات الجارية حتى عند الفشل، لكي لا تُكرر عند الاستئناف
+            for f in pending:
+                f.cancel()
+            finished, pending = wait(pending)
+            collect(finished)
+            raise
+        collect(wait(pending)[0])
+    return total
+
+def _run_restore(restore_key, records, replace=True, acc_name=None):
+    """
+    تشغيل الاستعادة (أو استئنافها إن وُجدت نقطة حفظ لنفس المفتاح)، ويعيد عدد القيود المستعادة.
+    - replace=True: استبدال الدفتر بالكامل، False: إضافة القيود إلى الموجود
+    - acc_name: مع replace تُستبدل قيود هذا الحساب فقط
+    """
+    # نسخة فارغة (أو نقطة زمنية تسبق كل القيود) لا يجوز أن تحذف الدفتر أو قيود الحساب
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        if replace:
+            raise ValueError("لا توجد قيود في النسخة ضمن النطاق المطلوب، لم يتم حذف أي شيء")
+        return 0
+    records = chain([first], records)
+
+    # الاستئناف الآمن يعتمد على مفتاح (restore_key, src_row) في الجدول الوسيط؛ journal لا يحمل ما يربط
+    # الصف بدفعته، فلا نرفع إليه مباشرة (مطابقة المحتوى تخطئ مع القيود المتطابقة)
+    if not _staging_available():
+        raise RuntimeError(f"الاستعادة تحتاج الجدول الوسيط {RESTORE_STAGING_TABLE} ودالة swap_journal_from_staging (انظر supabase/migrations)، لم يتم حذف أي شيء")
+    # الدفتر سيتغير كلياً: لا يُعتمد على الأرصدة اليومية حتى يعاد بناؤها بعد الاستعادة
+    _daily_balances_state["stale"] = True
+
+    ckpt_path = f"restore_{restore_key}.ckpt.json"
+    state = _load_restore_checkpoint(ckpt_path) or {"key": restore_key, "done": []}
+    total = _pipeline_batches(restore_key, records, state, ckpt_path)
+
+    params = {"p_restore_key": restore_key, "p_replace": replace}
+    if acc_name:
+        params["p_acc_name"] = acc_name
+    ok, restored = _rpc("swap_journal_from_staging", params)
+    if not ok:
+        # الصفوف تبقى في الجدول الوسيط مع نقطة الحفظ، فإعادة التشغيل بعد تثبيت الدالة تكمل دون إعادة الرفع
+        raise RuntimeError("دالة swap_journal_from_staging غير مثبتة في القاعدة (انظر supabase/migrations)، لم يتم حذف أي شيء")
+    total = restored or 0
+
+    invalidate_cache("journal")
+    try:
+        os.remove(ckpt_path)
+    except OSError:
+        pass
+    return total
+
 def restore_backup_to_supabase(uploaded_file):
     """استرجاع القيود من ملف CSV إلى قاعدة بيانات السحاب"""
     try:
-        # قراءة البيانات
-        df = pd.read_csv(uploaded_file)
-        
-        # تحويل الأعمدة لتناسب القاعدة (حذف id ليتولد تلقائياً)
-        if 'id' in df.columns:
-            df = df.drop(columns=['id'])
-            
-        data_to_restore = df.to_dict(orient='records')
-        
-        # إرسال البيانات للسحاب
-        res = supabase.table("journal").insert(data_to_restore).execute()
-        
-        return True, f"✅ تم استرجاع {len(res.data)} قيد بنجاح"
+        # مفتاح الاستعادة من محتوى الملف، لكي تُستأنف نفس العملية إذا أُعيد رفع الملف بعد انقطاع
+        digest = hashlib.sha256()
+        for block in iter(lambda: uploaded_file.read(1 << 20), b""):
+            digest.update(block if isinstance(block, bytes) else block.encode('utf-8'))
+        uploaded_file.seek(0)
+
+        def records():
+            for df in pd.read_csv(uploaded_file, chunksize=RESTORE_MAX_BATCH_ROWS):
+                yield from df.astype(object).where(pd.notna(df), None).to_dict(orient='records')
+
+        count = _run_restore(f"csv-{digest.hexdigest()[:16]}", records(), replace=False)
+
+        recalculate_all_balances()
+        ok, msg = rebuild_daily_balances()
+        if not ok:
+            return True, f"✅ تم استرجاع {count} قيد، ⚠️ لكن تعذر بناء الأرصدة اليومية (أعد بناءها من الإعدادات): {msg}"
+        return True, f"✅ تم استرجاع {count} قيد بنجاح"
     except Exception as e:
         return False, f"❌ خطأ أثناء الاسترجاع: {str(e)}"
     
-def recalculate_all_balances():
+def _journal_net_by_account(chunks, key="acc_name"):
+    """
+    تجميع صافي الحركة (مدين - دائن) لكل حساب كطرف رئيسي من دفعات القيود، بنفس تعريف كشف الحساب
+    key: عمود التجميع (acc_name، أو acc_id)
+    """
+    totals = pd.Series(dtype=float)
+    for chunk in chunks:
+        net = pd.to_numeric(chunk['debit'], errors='coerce').fillna(0) - pd.to_numeric(chunk['credit'], errors='coerce').fillna(0)
+        totals = totals.add(net.groupby(chunk[key]).sum(), fill_value=0)
+    return totals
+
+def recalculate_all_balances(dry_run=False):
+    """
+    إعادة احتساب كل الأرصدة بمرور واحد على القيود (بدلاً من استعلام لكل حساب):
+    الرصيد = الافتتاحي + صافي حركاته كطرف رئيسي، ثم كتابة كل الأرصدة المتغيرة في طلب واحد.
+    dry_run=True: لا يكتب شيئاً ويعيد جدولاً بالحسابات التي ستتغير.
+    """
     try:
-        # جلب كل الحسابات
-        acc_res = supabase.table("accounts").select("acc_name").execute()
-        if not acc_res.data: return False, "لا توجد حسابات"
-        
-        for acc in acc_res.data:
-            name = acc['acc_name']
-            # جلب حركات هذا الحساب
-            j_res = supabase.table("journal").select("debit, credit").eq("acc_name", name).execute()
-            
-            total_debit = sum(float(row.get('debit', 0)) for row in j_res.data)
-            total_credit = sum(float(row.get('credit', 0)) for row in j_res.data)
-            new_bal = total_debit - total_credit
-            
-            # التحديث في جدول الحسابات (تأكد أن العمود اسمه current_balance)
-            supabase.table("accounts").update({"current_balance": new_bal}).eq("acc_name", name).execute()
-            
-        return True, "تم التحديث بنجاح"
+        # 1. جلب الحسابات
+        acc_chunks = list(iter_table("accounts", "id,acc_name,opening_balance,current_balance", as_frame=True))
+        if not acc_chunks: return False, "لا توجد حسابات"
+        accounts = pd.concat(acc_chunks, ignore_index=True)
+
+        # 2. مرور واحد على القيود مع تجميع المدين والدائن لكل حساب (بالمفتاح الرقمي إن اكتمل ترحيله)
+        if _use_account_ids():
+            net = _journal_net_by_account(iter_table("journal", "acc_id,debit,credit", as_frame=True), "acc_id")
+            movement = accounts['id'].astype(float).map(net)
+        else:
+            net = _journal_net_by_account(iter_table("journal", "acc_name,debit,credit", as_frame=True))
+            movement = accounts['acc_name'].map(net)
+
+        # 3. ربط الأرصدة الافتتاحية
+        opening = pd.to_numeric(accounts['opening_balance'], errors='coerce').fillna(0)
+        current = pd.to_numeric(accounts['current_balance'], errors='coerce').fillna(0)
+        accounts['new_balance'] = (opening + movement.fillna(0)).round(2)
+        changed = accounts[(accounts['new_balance'] - current).abs() >= 0.01]
+
+        if dry_run:
+            return True, changed[['id', 'acc_name', 'current_balance', 'new_balance']].reset_index(drop=True)
+
+        if changed.empty:
+            return True, "✅ جميع الأرصدة مطابقة، لا حاجة للتحديث"
+
+        # 4. الكتابة الجماعية في طلب واحد
+        rows = [{"id": int(i), "current_balance": float(b)} for i, b in zip(changed['id'], changed['new_balance'])]
+        ok, _ = _rpc("apply_account_balances", {"p_rows": rows})
+        if not ok:
+            rows = [dict(r, acc_name=n) for r, n in zip(rows, changed['acc_name'])]
+            supabase.table("accounts").upsert(rows).execute()
+
+        invalidate_cache("accounts")
+        _postings_since_reconcile.clear()
+        return True, f"تم التحديث بنجاح ({len(rows)} حساب)"
     except Exception as e:
         print(f"Error in recalculate: {e}")
         return False, str(e)
 
-def auto_smart_backup():
+# --- النسخ الاحتياطي التزايدي ---
+# كل BACKUP_BASE_EVERY_DAYS يوم تُؤخذ نسخة أساس كاملة، وبينها تُحفظ الفروقات فقط
+BACKUP_BASE_EVERY_DAYS = 7
+
+def _latest_tombstone_id():
+    """آخر رقم في شواهد الحذف (None إذا لم يكن الجدول مثبتاً)"""
+    try:
+        res = supabase.table("deleted_rows").select("id").order("id", desc=True).limit(1).execute()
+        return res.data[0]['id'] if res.data else 0
+    except Exception:
+        return None
+
+def _advance_watermark(watermark, rows):
+    """تحديث العلامة المائية بآخر id وآخر updated_at في الصفوف"""
+    for r in rows:
+        watermark['max_id'] = max(watermark.get('max_id') or 0, r['id'])
+        if r.get('updated_at'):
+            watermark['max_updated_at'] = max(watermark.get('max_updated_at') or "", str(r['updated_at']))
+    return watermark
+
+def _save_base_backup(csv_path=None, rows=None):
+    """حفظ نسخة أساس كاملة في السحاب مع نسخة محلية (ملف CSV إن حُدد مساره، وإلا لقطة Parquet مضغوطة)، وتعيد رقمها"""
+    watermark = {"max_id": None, "max_updated_at": None, "max_tombstone": _latest_tombstone_id()}
+    records = []
+    chunks = [rows] if rows is not None else iter_table("journal")
+    for i, chunk in enumerate(chunks):
+        records.extend(chunk)
+        _advance_watermark(watermark, chunk)
+        if csv_path:
+            pd.DataFrame(chunk).to_csv(csv_path, index=False, mode='w' if i == 0 else 'a', header=(i == 0), encoding='utf-8-sig' if i == 0 else 'utf-8')
+    if not csv_path:
+        create_snapshot(chunks=[records])
+
+    res = supabase.table("system_backups").insert({
+        "backup_date": datetime.now().strftime('%Y-%m-%d'),
+        "kind": "base",
+        "data_json": records,
+        "watermark": watermark,
+    }).execute()
+    return res.data[0]['id'] if res.data else None
+
+def _collect_journal_changes(watermark):
+    """الصفوف المضافة أو المعدلة والمعرفات المحذوفة منذ العلامة المائية"""
+    changed = {}
+    for rows in iter_table("journal", start_after=watermark.get('max_id')):
+        changed.update((r['id'], r) for r in rows)
+    if watermark.get('max_updated_at'):
+        for rows in iter_table("journal", filters=[("gt", "updated_at", watermark['max_updated_at'], False)]):
+            changed.update((r['id'], r) for r in rows)
+
+    deleted = []
+    if watermark.get('max_tombstone') is not None:
+        filters = [("eq", "table_name", "journal", False)]
+        for rows in iter_table("deleted_rows", "id,row_id", filters, start_after=watermark['max_tombstone']):
+            deleted.extend(r['row_id'] for r in rows)
+            watermark['max_tombstone'] = rows[-1]['id']
+
+    _advance_watermark(watermark, list(changed.values()))
+    return list(changed.values()), deleted
+
+def auto_smart_backup(force_base=False):
     """
-    النظام الذكي: 
-    1. يحفظ نسخة CSV محلياً.
-    2. يحفظ نسخة JSON في السحاب.
-    3. يحدّث نسخة اليوم إذا تكررت، ويحتفظ بنسخ الأيام السابقة.
+    النظام الذكي (تزايدي):
+    1. يحفظ فقط القيود المضافة أو المعدلة أو المحذوفة منذ آخر نسخة (فروقات).
+    2. يأخذ نسخة أساس كاملة (سحابية + CSV محلي) كل BACKUP_BASE_EVERY_DAYS يوم أو عند عدم وجود أساس.
+    3. لا يكتب شيئاً إذا لم يتغير أي قيد.
     """
     try:
-        # جلب البيانات الحالية
-        res = supabase.table("journal").select("*").execute()
-        current_data = res.data
         today_date = datetime.now().strftime('%Y-%m-%d')
-        
-        # --- الجزء الأول: النسخة السحابية (JSON) ---
-        # فحص هل توجد نسخة لليوم؟
-        existing = supabase.table("system_backups").select("id").eq("backup_date", today_date).execute()
-        
-        payload = {
+
+        latest = supabase.table("system_backups").select("id, kind, base_id, watermark")\
+            .in_("kind", ["base", "delta"]).order("id", desc=True).limit(1).execute().data
+        base = None
+        if latest and not force_base:
+            base_id = latest[0]['id'] if latest[0]['kind'] == "base" else latest[0]['base_id']
+            base = supabase.table("system_backups").select("id, backup_date").eq("id", base_id).execute().data
+
+        base_age = (datetime.now() - datetime.strptime(str(base[0]['backup_date'])[:10], '%Y-%m-%d')).days if base else None
+        if not base or base_age >= BACKUP_BASE_EVERY_DAYS:
+            return _save_base_backup() is not None
+
+        # نسخة فروقات فقط
+        watermark = dict(latest[0]['watermark'] or {})
+        upserts, deletes = _collect_journal_changes(watermark)
+        if not upserts and not deletes:
+            return True
+
+        supabase.table("system_backups").insert({
             "backup_date": today_date,
-            "data_json": current_data
-        }
-        
-        if existing.data:
-            # تحديث نسخة اليوم (لتبقى دائماً عند آخر دقيقة)
-            supabase.table("system_backups").update(payload).eq("id", existing.data[0]['id']).execute()
-        else:
-            # إنشاء نسخة جديدة ليوم جديد
-            supabase.table("system_backups").insert(payload).execute()
-            
-        # --- الجزء الثاني: النسخة المحلية (CSV) ---
-        df = pd.DataFrame(current_data)
-        filename = f"backup_{today_date}.csv"
-        df.to_csv(filename, index=False)
-        
+            "kind": "delta",
+            "base_id": base[0]['id'],
+            "data_json": {"upserts": upserts, "deletes": deletes},
+            "watermark": watermark,
+        }).execute()
         return True
     except Exception as e:
         print(f"Smart Backup Error: {e}")
@@ -707,13 +2496,42 @@ def auto_smart_backup():
 
 def get_cloud_backups():
     try:
-        # هذه الدالة تجلب قائمة النسخ الاحتياطية من الجدول الذي أصلحناه
-        response = supabase.table('system_backups').select('*').execute()
+        # قائمة النسخ بدون محتواها (data_json) لتبقى خفيفة مهما كثرت النسخ
+        try:
+            response = supabase.table('system_backups').select('id, backup_date, created_at, kind, base_id').order('id', desc=True).execute()
+        except Exception:
+            response = supabase.table('system_backups').select('id, backup_date, created_at').order('id', desc=True).execute()
         return response.data if response.data else []
     except Exception as e:
         print(f"خطأ في جلب البيانات: {e}")
         return []
 
+def _materialize_backup(backup_id):
+    """إعادة بناء محتوى نسخة: الأساس ثم تطبيق الفروقات حتى النسخة المطلوبة بالترتيب"""
+    try:
+        row = supabase.table("system_backups").select("id, kind, base_id, data_json").eq("id", int(backup_id)).execute().data
+    except Exception:
+        row = supabase.table("system_backups").select("id, data_json").eq("id", int(backup_id)).execute().data
+    if not row:
+        return None
+
+    def load(raw):
+        return json.loads(raw) if isinstance(raw, str) else raw
+
+    if row[0].get('kind') != "delta":
+        return load(row[0]['data_json']) or []
+
+    base = supabase.table("system_backups").select("data_json").eq("id", row[0]['base_id']).execute().data
+    records = {r['id']: r for r in (load(base[0]['data_json']) if base else None) or []}
+    filters = [("eq", "base_id", row[0]['base_id'], False), ("lte", "id", int(backup_id), False)]
+    for deltas in iter_table("system_backups", "id,data_json", filters, chunk_size=20):
+        for d in deltas:
+            change = load(d['data_json']) or {}
+            records.update((r['id'], r) for r in change.get('upserts', []))
+            for row_id in change.get('deletes', []):
+                records.pop(row_id, None)
+    return [records[k] for k in sorted(records)]
+
 def restore_from_smart_backup(backup_id):
     """النسخة المحصنة: استعادة البيانات مع ضمان تنظيف الجدول وإعادة الهيكلة"""
     try:
@@ -721,44 +2539,28 @@ def restore_from_smart_backup(backup_id):
         if not backup_id or str(backup_id) in ["0", "None"]:
             return False, "⚠️ يرجى اختيار نسخة احتياطية من القائمة أولاً"
 
-        # 2. جلب البيانات من السحاب
-        res = supabase.table("system_backups").select("data_json").eq("id", int(backup_id)).execute()
-        if not res.data: 
+        # 2. جلب البيانات من السحاب (الأساس + الفروقات حتى هذه النسخة)
+        records = _materialize_backup(backup_id)
+        if records is None: 
             return False, "❌ عذراً، لم يتم العثور على ملف النسخة في السحاب"
-        
-        raw_data = res.data[0]['data_json']
-        records = json.loads(raw_data) if isinstance(raw_data, str) else raw_data
 
         if not records:
             return False, "⚠️ هذه النسخة الاحتياطية لا تحتوي على أي سجلات"
 
-        # 3. تنظيف البيانات (إزالة الحقول التي تولدها القاعدة تلقائياً)
-        # هذا يمنع تعارض المعرفات (Primary Key Conflicts)
-        clean_records = []
-        for r in records:
-            # نحتفظ بكل شيء ما عدا المعرف التسلسلي والوقت التلقائي
-            item = {k: v for k, v in r.items() if k not in ['id', 'created_at']}
-            clean_records.append(item)
-
-        # 4. الحذف الآمن (Force Clear) 
-        # نستخدم gte(id, 0) لأنها أسرع وأضمن في الفلترة لجميع أنواع الجداول
-        try:
-            supabase.table("journal").delete().gte("id", 0).execute()
-        except:
-            # إذا كان المعرف ليس رقماً، نستخدم الفلتر النصي كبديل
-            supabase.table("journal").delete().neq("acc_name", "NULL_DATA_RESERVED").execute()
-        
-        # 5. الرفع الذكي على دفعات (Batching)
-        # تم تصغير الدفعة لـ 100 لضمان عدم تجاوز حجم الطلب (Request Size Limit)
-        chunk_size = 100
-        for i in range(0, len(clean_records), chunk_size):
-            batch = clean_records[i:i + chunk_size]
-            supabase.table("journal").insert(batch).execute()
+        # 3. الرفع عبر محرك الاستعادة: جدول وسيط ثم تبديل في معاملة واحدة
+        # (المعرف والأوقات التلقائية تُحذف من كل صف لتجنب تعارض المفاتيح)
+        count = _run_restore(f"smart-{backup_id}", records, replace=True)
             
-        # 6. تحديث الأرصدة فوراً بعد الاستعادة لضمان مطابقة الأرقام
+        # 4. تحديث الأرصدة فوراً بعد الاستعادة لضمان مطابقة الأرقام
         recalculate_all_balances() 
+        daily_ok, daily_msg = rebuild_daily_balances()
+
+        # 5. القيود المستعادة تحمل معرفات جديدة، فتبدأ منها سلسلة نسخ جديدة
+        _save_base_backup()
         
-        return True, f"✅ تم استعادة {len(clean_records)} قيد مالي وتحديث الأرصدة بنجاح"
+        if not daily_ok:
+            return True, f"✅ تم استعادة {count} قيد مالي، ⚠️ لكن تعذر بناء الأرصدة اليومية (أعد بناءها من الإعدادات): {daily_msg}"
+        return True, f"✅ تم استعادة {count} قيد مالي وتحديث الأرصدة بنجاح"
 
     except Exception as e:
         error_msg = str(e)
@@ -767,3 +2569,156 @@ def restore_from_smart_backup(backup_id):
 
         return False, f"❌ فشلت عملية الاستعادة: {error_msg}"
 
+# --- لقطات عمودية مضغوطة (Parquet) ---
+# كل لقطة مجلد فيه ملفات Parquet مضغوطة بـ zstd (ملف لكل SNAPSHOT_CHUNK_ROWS صف مرتبة حسب id)
+# و manifest.json يصف كل ملف: عدد الصفوف، مدى المعرفات والتواريخ، الحسابات، وبصمة sha256.
+# الاستعادة تستخدم الـ manifest لتخطي الملفات التي لا تخص الحساب أو الفترة المطلوبة.
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_CHUNK_ROWS = 50000
+SNAPSHOT_COMPRESSION = "zstd"
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _column_range(df, col):
+    if col not in df.columns or df[col].dropna().empty:
+        return None, None
+    values = df[col].dropna().astype(str)
+    return values.min(), values.max()
+
+def create_snapshot(table_name="journal", chunks=None):
+    """حفظ لقطة مضغوطة للجدول مع manifest، وتعيد مسار مجلدها (أو None عند الفشل)"""
+    try:
+        snap_dir = os.path.join(SNAPSHOT_DIR, f"{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+        os.makedirs(snap_dir, exist_ok=True)
+        manifest = {"table": table_name, "created_at": datetime.now().isoformat(timespec='seconds'), "rows": 0, "chunks": []}
+        buffer = []
+
+        def flush():
+            df = pd.DataFrame(buffer)
+            buffer.clear()
+            file_name = f"part-{len(manifest['chunks']):05d}.parquet"
+            path = os.path.join(snap_dir, file_name)
+            df.to_parquet(path, index=False, compression=SNAPSHOT_COMPRESSION)
+
+            accounts = pd.concat([df[c] for c in ('acc_name', 'offset_acc') if c in df.columns])
+            min_date, max_date = _column_range(df, 'date')
+            min_ts, max_ts = _column_range(df, 'created_at')
+            manifest['chunks'].append({
+                "file": file_name,
+                "rows": len(df),
+                "min_id": int(df['id'].min()),
+                "max_id": int(df['id'].max()),
+                "min_date": min_date, "max_date": max_date,
+                "min_created_at": min_ts, "max_created_at": max_ts,
+                "accounts": sorted(accounts.dropna().astype(str).unique().tolist()),
+                "sha256": _file_sha256(path),
+            })
+            manifest['rows'] += len(df)
+
+        for rows in (chunks if chunks is not None else iter_table(table_name)):
+            buffer.extend(rows)
+            if len(buffer) >= SNAPSHOT_CHUNK_ROWS:
+                flush()
+        if buffer:
+            flush()
+
+        with open(os.path.join(snap_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        return snap_dir
+    except Exception as e:
+        print(f"⚠️ Snapshot Error: {e}")
+        return None
+
+def list_snapshots():
+    """قائمة اللقطات المحلية (الأحدث أولاً) مع ملخص الـ manifest"""
+    import glob
+    snapshots = []
+    for manifest_path in glob.glob(os.path.join(SNAPSHOT_DIR, "*", "manifest.json")):
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        dates = [c[k] for c in manifest['chunks'] for k in ('min_date', 'max_date') if c.get(k)]
+        snapshots.append({
+            "path": os.path.dirname(manifest_path),
+            "created_at": manifest['created_at'],
+            "rows": manifest['rows'],
+            "from_date": min(dates) if dates else None,
+            "to_date": max(dates) if dates else None,
+            "size_bytes": sum(os.path.getsize(os.path.join(os.path.dirname(manifest_path), c['file'])) for c in manifest['chunks']),
+        })
+    return sorted(snapshots, key=lambda s: (s['created_at'], s['path']), reverse=True)
+
+def find_snapshot(as_of):
+    """
+    أحدث لقطة أُخذت في النقطة الزمنية as_of (YYYY-MM-DD أو أدق) أو قبلها، أو None.
+    اللقطة تحفظ حالة الدفتر لحظة أخذها، فهي أقرب حالة محفوظة إلى as_of
+    (القيود المضافة أو المعدلة بين اللقطة و as_of غير موجودة فيها).
+    """
+    earlier = [s for s in list_snapshots() if s['created_at'][:len(as_of)] <= as_of]
+    return earlier[0] if earlier else None
+
+def read_snapshot(snap_dir, as_of=None, acc_name=None):
+    """
+    قراءة صفوف لقطة تدفقياً بعد التحقق من بصمة كل ملف.
+    - as_of: النقطة الزمنية المطلوبة؛ يجب ألا تسبق وقت اللقطة، لأن اللقطة لا تحفظ حالة القيود
+      قبل أخذها (القيد المعدل لاحقاً يظهر بحالته الأخيرة، والمحذوف قبلها مفقود منها)
+    - acc_name: قيود هذا الحساب فقط (كطرف رئيسي أو مقابل)
+    """
+    with open(os.path.join(snap_dir, "manifest.json"), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if as_of and manifest['created_at'][:len(as_of)] > as_of:
+        raise ValueError(f"اللقطة أُخذت في {manifest['created_at']} بعد {as_of}، ولا يمكن إرجاعها إلى حالة سابقة لوقت أخذها")
+
+    for chunk in manifest['chunks']:
+        if acc_name and acc_name not in chunk['accounts']:
+            continue
+
+        path = os.path.join(snap_dir, chunk['file'])
+        if _file_sha256(path) != chunk['sha256']:
+            raise ValueError(f"بصمة الملف {chunk['file']} لا تطابق الـ manifest (الملف تالف أو معدل)")
+
+        df = pq.read_table(path).to_pandas()
+        if acc_name:
+            mask = df['acc_name'] == acc_name
+            if 'offset_acc' in df.columns:
+                mask |= df['offset_acc'] == acc_name
+            df = df[mask]
+        if not df.empty:
+            yield from df.astype(object).where(pd.notna(df), None).to_dict(orient='records')
+
+def restore_from_snapshot(snap_dir=None, as_of=None, acc_name=None):
+    """
+    استعادة الدفتر (أو حساب واحد) من لقطة مضغوطة.
+    مع as_of وبدون snap_dir تُستخدم أحدث لقطة أُخذت في as_of أو قبله (find_snapshot).
+    """
+    try:
+        if snap_dir is None and as_of:
+            latest = find_snapshot(as_of)
+            if latest is None:
+                return False, f"❌ لا توجد لقطة مأخوذة في {as_of} أو قبله"
+            snap_dir = latest['path']
+        if not snap_dir or not os.path.exists(os.path.join(snap_dir, "manifest.json")):
+            return False, "❌ لم يتم العثور على اللقطة المطلوبة"
+
+        scope = hashlib.md5(f"{as_of}|{acc_name}".encode('utf-8')).hexdigest()[:8]
+        restore_key = f"snap-{os.path.basename(snap_dir)}-{scope}"
+        count = _run_restore(restore_key, read_snapshot(snap_dir, as_of, acc_name), replace=True, acc_name=acc_name)
+
+        recalculate_all_balances()
+        daily_ok, daily_msg = rebuild_daily_balances()
+        # القيود المستعادة تحمل معرفات جديدة، فتبدأ منها سلسلة نسخ جديدة
+        _save_base_backup()
+
+        target = f"الحساب {acc_name}" if acc_name else "الدفتر"
+        if not daily_ok:
+            return True, f"✅ تم استعادة {count} قيد إلى {target}، ⚠️ لكن تعذر بناء الأرصدة اليومية (أعد بناءها من الإعدادات): {daily_msg}"
+        return True, f"✅ تم استعادة {count} قيد إلى {target} بنجاح"
+    except Exception as e:
+        return False, f"❌ فشلت الاستعادة من اللقطة: {str(e)}"
@@ -0,0 +1,137 @@
+"""
+طبقة الاتصال المشتركة بخادم Supabase (PostgREST) لكل استدعاءات database.py:
+- اتصالات مجمعة ومبقاة مفتوحة (keep-alive)، و HTTP/2 إذا كانت مكتبة h2 مثبتة.
+- مهلات واضحة للاتصال والقراءة بدلاً من الانتظار المفتوح: قصيرة للقراءة (GET) حتى لا تتعلق الواجهة،
+  وأطول للكتابة ودوال القاعدة (الاستيراد والاستعادة ترسل دفعات كبيرة).
+- إعادة المحاولة مع تأخير أسي عشوائي (jitter) عند أخطاء 5xx و 429 وانقطاع الاتصال،
+  والطلبات غير الآمنة للتكرار (POST / PATCH) لا تُعاد إلا إذا تأكدنا أن الخادم لم يستلمها.
+  انتهاء مهلة القراءة لا يُعاد أبداً: الخادم بطيء، والتكرار يضاعف الانتظار فقط.
+- قاطع دائرة: بعد عدة إخفاقات متتالية تفشل الطلبات فوراً لفترة قصيرة بدلاً من تعليق الواجهة.
+"""
+import importlib.util
+import random
+import threading
+import time
+
+import httpx
+
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 15.0       # القراءة (GET / HEAD)
+HTTP_WRITE_READ_TIMEOUT = 60.0 # الكتابة ودوال القاعدة: الاستعادة والاستيراد يرسلان دفعات كبيرة
+HTTP_POOL_TIMEOUT = 10.0
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE = 10
+HTTP_KEEPALIVE_SECONDS = 30.0
+
+RETRY_ATTEMPTS = 4             # المحاولات الإضافية بعد الأولى
+RETRY_BASE_DELAY = 0.25        # ثوانٍ، تتضاعف مع كل محاولة
+RETRY_MAX_DELAY = 5.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+BREAKER_FAILURES = 5           # إخفاقات متتالية تفتح الدائرة
+BREAKER_COOLDOWN = 30.0        # ثوانٍ قبل السماح بطلب تجريبي
+
+# أخطاء تعني أن الطلب لم يصل للخادم أصلاً (آمن تكراره لأي نوع طلب)
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class CircuitOpenError(httpx.TransportError):
+    """الخادم متعثر حالياً والطلبات موقوفة مؤقتاً"""
+
+class _CircuitBreaker:
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._count = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            # نصف مفتوحة: طلب تجريبي واحد فقط بعد انتهاء فترة التهدئة
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(f"⚠️ الخادم غير متاح مؤقتاً، ستُعاد المحاولة تلقائياً خلال {max(remaining, 1):.0f} ثانية")
+            self._probing = True
+
+    def record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._count, self._opened_at = 0, None
+                return
+            self._count += 1
+            if self._count >= self.failures:
+                self._opened_at = time.monotonic()
+
+class ResilientTransport(httpx.HTTPTransport):
+    """ناقل httpx يضيف إعادة المحاولة وقاطع الدائرة فوق تجميع الاتصالات"""
+
+    def __init__(self, *args, attempts=RETRY_ATTEMPTS, breaker=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attempts = attempts
+        self.breaker = breaker or _CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN)
+
+    @staticmethod
+    def _delay(attempt, response=None):
+        """تأخير أسي عشوائي كامل، مع احترام Retry-After إن أرسله الخادم"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+    @staticmethod
+    def _apply_timeout(request):
+        """المهلة الأطول للكتابة ودوال القاعدة فقط، والقراءة تبقى على مهلة العميل القصيرة"""
+        if request.method in READ_METHODS:
+            return
+        timeout = dict(request.extensions.get("timeout") or {})
+        for key in ("read", "write"):
+            timeout[key] = max(timeout.get(key) or 0, HTTP_WRITE_READ_TIMEOUT)
+        request.extensions["timeout"] = timeout
+
+    def handle_request(self, request):
+        self.breaker.before_request()
+        self._apply_timeout(request)
+        idempotent = request.method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = super().handle_request(request)
+            except httpx.TransportError as e:
+                retryable = (idempotent or isinstance(e, _NOT_SENT_ERRORS)) and not isinstance(e, httpx.ReadTimeout)
+                if not retryable or attempt >= self.attempts:
+                    self.breaker.record(False)
+                    raise
+            else:
+                # 429 يعني أن الخادم رفض الطلب دون تنفيذه، فيُعاد لأي نوع طلب
+                retryable = response.status_code in RETRY_STATUSES and (idempotent or response.status_code == 429)
+                if not retryable or attempt >= self.attempts:
+                    self.breaker.record(response.status_code < 500)
+                    return response
+                response.close()
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+
+def http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+def create_http_client(base_url, headers, client_class=httpx.Client):
+    """عميل httpx مشترك (آمن للاستخدام من عدة خيوط) بالإعدادات أعلاه"""
+    http2 = http2_available()
+    transport = ResilientTransport(
+        http2=http2,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                            keepalive_expiry=HTTP_KEEPALIVE_SECONDS),
+    )
+    return client_class(
+        base_url=base_url,
+        headers=headers,
+        transport=transport,
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+    )
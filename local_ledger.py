@@ -0,0 +1,88 @@
+"""
+بديل محلي (SQLite) لدالة post_journal_entry في Supabase.
+يطبق نفس خطوات الترحيل الذري في معاملة واحدة، ويُستخدم في الاختبارات دون اتصال
+(مباشرة، أو عبر database.use_local_ledger لتوجيه process_full_transaction إليه).
+"""
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    acc_name TEXT UNIQUE NOT NULL,
+    category TEXT,
+    opening_balance REAL DEFAULT 0,
+    current_balance REAL DEFAULT 0,
+    is_active INTEGER DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT, acc_name TEXT, offset_acc TEXT, op_type TEXT, description TEXT, ref_no TEXT,
+    base_amount REAL, tax_amount REAL, total_amount REAL, debit REAL, credit REAL,
+    posted_by TEXT, due_date TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS account_daily_balances (
+    acc_name TEXT NOT NULL, day TEXT NOT NULL,
+    day_debit REAL NOT NULL DEFAULT 0, day_credit REAL NOT NULL DEFAULT 0, cum_net REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (acc_name, day)
+);
+CREATE TABLE IF NOT EXISTS audit_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_name TEXT, action TEXT, details TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+JOURNAL_COLUMNS = ["date", "acc_name", "offset_acc", "op_type", "description", "ref_no", "base_amount",
+                   "tax_amount", "total_amount", "debit", "credit", "posted_by", "due_date"]
+
+
+def connect(path):
+    """فتح قاعدة البيانات المحلية وإنشاء الجداول إذا لم تكن موجودة"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _bump_daily_balance(conn, acc_name, day, debit, credit):
+    """نفس منطق bump_daily_balance في القاعدة"""
+    net = debit - credit
+    prev = conn.execute(
+        "SELECT cum_net FROM account_daily_balances WHERE acc_name = ? AND day < ? ORDER BY day DESC LIMIT 1",
+        (acc_name, day),
+    ).fetchone()
+    conn.execute(
+        """INSERT INTO account_daily_balances (acc_name, day, day_debit, day_credit, cum_net)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT (acc_name, day) DO UPDATE SET
+               day_debit = day_debit + excluded.day_debit,
+               day_credit = day_credit + excluded.day_credit,
+               cum_net = cum_net + ?""",
+        (acc_name, day, debit, credit, (prev[0] if prev else 0) + net, net),
+    )
+    conn.execute(
+        "UPDATE account_daily_balances SET cum_net = cum_net + ? WHERE acc_name = ? AND day > ?",
+        (net, acc_name, day),
+    )
+
+
+def post_journal_entry(conn, entry, audit_user=None, audit_action=None, audit_details=None):
+    """ترحيل القيد ذرياً: إما أن تنجح كل الخطوات أو لا يُحفظ شيء. تعيد رقم القيد الجديد"""
+    debit = float(entry.get("debit") or 0)
+    credit = float(entry.get("credit") or 0)
+    with conn:
+        cur = conn.execute(
+            f"INSERT INTO journal ({', '.join(JOURNAL_COLUMNS)}) VALUES ({', '.join('?' * len(JOURNAL_COLUMNS))})",
+            [entry.get(c) for c in JOURNAL_COLUMNS],
+        )
+        conn.execute(
+            "UPDATE accounts SET current_balance = COALESCE(current_balance, 0) + ? WHERE acc_name = ?",
+            (debit - credit, entry.get("acc_name")),
+        )
+        _bump_daily_balance(conn, entry.get("acc_name"), str(entry.get("date"))[:10], debit, credit)
+        if audit_action is not None:
+            conn.execute(
+                "INSERT INTO audit_log (user_name, action, details) VALUES (?, ?, ?)",
+                (audit_user, audit_action, audit_details),
+            )
+    return cur.lastrowid
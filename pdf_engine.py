@@ -0,0 +1,222 @@
+"""
+محرك كشوف الحساب PDF (بدون أي اعتماد على Streamlit ليعمل أيضاً داخل عمليات منفصلة).
+- الخط العربي يُسجل مرة واحدة لكل عملية.
+- تشكيل النص العربي (reshape + bidi) مخزن في ذاكرة مؤقتة لأن القيم تتكرر كثيراً.
+- الصفوف تُرسم مباشرة على الصفحات من مصفوفات الأعمدة، مع تكرار الترويسة في كل صفحة.
+"""
+import io
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+from arabic_reshaper import reshape
+from bidi.algorithm import get_display
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+FONT_NAME = "ArabicFont"
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arial.ttf")
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 30
+ROW_HEIGHT = 16
+FONT_SIZE = 8
+HEADER_COLOR = colors.HexColor("#0D47A1")
+
+# (العمود في البيانات، العنوان، العرض، رقمي؟) بالترتيب من اليمين إلى اليسار
+STATEMENT_COLUMNS = [
+    ("date", "التاريخ", 60, False),
+    ("ref_no", "المرجع", 70, False),
+    ("op_type", "العملية", 60, False),
+    ("description", "البيان", 150, False),
+    ("debit", "مدين", 60, True),
+    ("credit", "دائن", 60, True),
+    ("balance", "الرصيد", 75, True),
+]
+
+_font_lock = threading.Lock()
+
+def _ensure_font():
+    """تسجيل الخط مرة واحدة فقط في العملية"""
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return
+    with _font_lock:
+        if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+
+@lru_cache(maxsize=65536)
+def shape_ar(text):
+    """تشكيل النص العربي واتجاهه للعرض (النص اللاتيني والأرقام تعاد كما هي)"""
+    if text.isascii():
+        return text
+    return get_display(reshape(text))
+
+@lru_cache(maxsize=65536)
+def _text_width(text, size=FONT_SIZE):
+    return pdfmetrics.stringWidth(text, FONT_NAME, size)
+
+@lru_cache(maxsize=65536)
+def _fit(text, width, size=FONT_SIZE):
+    """تشكيل النص وقصه ليتسع في عرض الخلية"""
+    shaped = shape_ar(text)
+    if _text_width(shaped, size) <= width:
+        return shaped
+    while text and _text_width(shape_ar(text + "…"), size) > width:
+        text = text[:-1]
+    return shape_ar(text + "…")
+
+def _column_arrays(df):
+    """تحويل الأعمدة إلى قوائم نصوص جاهزة للرسم (بدلاً من المرور على الصفوف)"""
+    n = len(df)
+    arrays = []
+    for key, _, _, numeric in STATEMENT_COLUMNS:
+        # jv_date هو الاسم المعروض في الواجهة للتاريخ، ويُقدم إن وُجد
+        if key == "date" and 'jv_date' in df.columns:
+            key = 'jv_date'
+        col = df[key] if key in df.columns else None
+        if col is None:
+            arrays.append([""] * n)
+        elif numeric:
+            arrays.append([f"{v:,.2f}" for v in pd.to_numeric(col, errors='coerce').fillna(0).tolist()])
+        elif key == "date":
+            arrays.append(col.astype(str).str[:10].tolist())
+        else:
+            arrays.append(col.fillna("").astype(str).tolist())
+    return arrays
+
+def _draw_table_header(c, top):
+    c.setFillColor(HEADER_COLOR)
+    c.rect(MARGIN, top - ROW_HEIGHT, PAGE_WIDTH - 2 * MARGIN, ROW_HEIGHT, stroke=0, fill=1)
+    c.setFillColor(colors.whitesmoke)
+    c.setFont(FONT_NAME, FONT_SIZE + 1)
+    x = PAGE_WIDTH - MARGIN
+    for _, title, width, _ in STATEMENT_COLUMNS:
+        c.drawCentredString(x - width / 2, top - ROW_HEIGHT + 5, shape_ar(title))
+        x -= width
+    c.setFillColor(colors.black)
+    c.setFont(FONT_NAME, FONT_SIZE)
+    return top - ROW_HEIGHT
+
+def _draw_page_footer(c, page_no):
+    c.setFont(FONT_NAME, FONT_SIZE)
+    c.drawCentredString(PAGE_WIDTH / 2, MARGIN / 2, shape_ar(f"صفحة {page_no}"))
+
+def render_statement(df, account_name, start_date, end_date, output=None):
+    """
+    رسم كشف حساب في output (ملف أو BytesIO)، وتعيد output.
+    df: أعمدة date/jv_date, ref_no, op_type, description, debit, credit, balance (الناقص منها يُترك فارغاً)
+    """
+    _ensure_font()
+    output = output if output is not None else io.BytesIO()
+    c = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+    c.setTitle(f"Statement {account_name}")
+
+    # 1. ترويسة الصفحة الأولى
+    y = PAGE_HEIGHT - MARGIN
+    c.setFont(FONT_NAME, 16)
+    c.drawCentredString(PAGE_WIDTH / 2, y - 16, shape_ar("تقرير كشف حساب تفصيلي"))
+    c.setFont(FONT_NAME, 10)
+    c.drawRightString(PAGE_WIDTH - MARGIN, y - 36, shape_ar(f"اسم الحساب: {account_name}"))
+    c.drawString(MARGIN, y - 36, shape_ar(f"تاريخ الاستخراج: {datetime.now().strftime('%Y-%m-%d %H:%M')}"))
+    c.drawCentredString(PAGE_WIDTH / 2, y - 52, shape_ar(f"الفترة من {start_date} إلى {end_date}"))
+    y = _draw_table_header(c, y - 64)
+
+    # 2. الصفوف: كائن نص واحد لكل صفحة (بدلاً من أمر رسم لكل خلية)، وصفحة جديدة مع ترويسة الجدول كلما امتلأت
+    arrays = _column_arrays(df)
+    widths = [w for _, _, w, _ in STATEMENT_COLUMNS]
+    numeric = [n for _, _, _, n in STATEMENT_COLUMNS]
+    centers = []
+    x = PAGE_WIDTH - MARGIN
+    for width in widths:
+        centers.append(x - width / 2)
+        x -= width
+
+    page_no = 1
+    text_obj, rules = c.beginText(), []
+    text_obj.setFont(FONT_NAME, FONT_SIZE)
+
+    def flush_page():
+        c.drawText(text_obj)
+        c.setStrokeColor(colors.lightgrey)
+        c.lines(rules)
+
+    for i in range(len(df)):
+        if y - ROW_HEIGHT < MARGIN:
+            flush_page()
+            _draw_page_footer(c, page_no)
+            c.showPage()
+            page_no += 1
+            y = _draw_table_header(c, PAGE_HEIGHT - MARGIN)
+            text_obj, rules = c.beginText(), []
+            text_obj.setFont(FONT_NAME, FONT_SIZE)
+
+        baseline = y - ROW_HEIGHT + 5
+        for values, width, center, is_num in zip(arrays, widths, centers, numeric):
+            text = values[i] if is_num else _fit(values[i], width - 4)
+            text_obj.setTextOrigin(center - _text_width(text) / 2, baseline)
+            text_obj.textOut(text)
+        y -= ROW_HEIGHT
+        rules.append((MARGIN, y, PAGE_WIDTH - MARGIN, y))
+    flush_page()
+
+    # 3. التذييل (الرصيد النهائي)
+    final_bal = float(pd.to_numeric(df['balance'], errors='coerce').fillna(0).iloc[-1]) if 'balance' in df.columns and len(df) else 0.0
+    if y - 3 * ROW_HEIGHT < MARGIN:
+        _draw_page_footer(c, page_no)
+        c.showPage()
+        page_no += 1
+        y = PAGE_HEIGHT - MARGIN
+    status = "لنا مبلغ" if final_bal >= 0 else "علينا مبلغ"
+    c.setFont(FONT_NAME, 12)
+    c.drawCentredString(PAGE_WIDTH / 2, y - 2 * ROW_HEIGHT, shape_ar(f"الرصيد النهائي المستحق {status}: {abs(final_bal):,.2f} ريال"))
+    _draw_page_footer(c, page_no)
+    c.save()
+    return output
+
+def create_pdf_report(df, account_name, start_date, end_date):
+    """كشف حساب PDF كـ bytes (أو None عند الفشل)"""
+    try:
+        return render_statement(df, account_name, start_date, end_date).getvalue()
+    except Exception as e:
+        print(f"PDF Error: {str(e)}")
+        return None
+
+def _render_statement_job(job):
+    """وحدة العمل في عملية منفصلة: كشف حساب واحد"""
+    account_name, df, start_date, end_date = job
+    return account_name, create_pdf_report(df, account_name, start_date, end_date)
+
+def render_statements_zip(statements, start_date, end_date, progress=None, workers=None):
+    """
+    رسم عدة كشوف بالتوازي على أنوية المعالج وتجميعها في ملف ZIP واحد (bytes).
+    - statements: قاموس {اسم الحساب: DataFrame}
+    - progress: دالة اختيارية تُستدعى (المنجز، الإجمالي) بعد كل كشف
+    """
+    output = io.BytesIO()
+    total, done = len(statements), 0
+    # الكشوف الأطول أولاً لتتوزع الأحمال على العمليات بشكل متوازن
+    jobs = sorted(((acc, df, start_date, end_date) for acc, df in statements.items()), key=lambda j: len(j[1]), reverse=True)
+
+    # spawn بدلاً من fork لأن العملية الأم (Streamlit) متعددة الخيوط
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool, \
+            zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        futures = [pool.submit(_render_statement_job, job) for job in jobs]
+        for future in as_completed(futures):
+            account_name, pdf = future.result()
+            if pdf:
+                safe_name = re.sub(r'[\\/:*?"<>|]', '_', str(account_name))
+                archive.writestr(f"Statement_{safe_name}_{end_date}.pdf", pdf)
+            done += 1
+            if progress:
+                progress(done, total)
+    return output.getvalue()
@@ -4,9 +4,6 @@ import plotly.express as px
 import database
 import os
 from datetime import datetime
-from fpdf import FPDF, XPos, YPos
-from arabic_reshaper import reshape
-from bidi.algorithm import get_display
 
 # --- 1. إعدادات الصفحة (يجب أن تكون أول أمر بعد الـ Imports) ---
 st.set_page_config(
@@ -126,64 +123,6 @@ if not st.session_state.get('auth', False):
 # --- الآن هنا يبدأ كود لوحة التحكم والقائمة الجانبية ---
 st.sidebar.title("لوحة التحكم")
 
-def create_pdf_report(df, acc_name, start_date, end_date):
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # إعدادات الخط والوقت
-    from datetime import datetime
-    report_gen_date = datetime.now().strftime("%Y-%m-%d %H:%M")
-    
-    try:
-        pdf.add_font('ArabicFont', '', 'arial.ttf', uni=True)
-        pdf.set_font('ArabicFont', size=10)
-    except: return None
-
-    def fix_ar(text):
-        from bidi.algorithm import get_display
-        from arabic_reshaper import reshape
-        return get_display(reshape(str(text)))
-
-    # 1. ترويسة علوية تفصيلية
-    pdf.set_font('ArabicFont', size=16)
-    pdf.cell(190, 10, fix_ar(f"تقرير كشف حساب تفصيلي"), ln=True, align='C')
-    pdf.set_font('ArabicFont', size=10)
-    pdf.cell(95, 8, fix_ar(f"تاريخ الاستخراج: {report_gen_date}"), align='R')
-    pdf.cell(95, 8, fix_ar(f"اسم الحساب: {acc_name}"), ln=True, align='L')
-    pdf.cell(190, 8, fix_ar(f"الفترة الزمنية: من {start_date} إلى {end_date}"), ln=True, align='C')
-    pdf.line(10, 35, 200, 35) # خط جمالي
-    pdf.ln(5)
-
-    # 2. رسم الجدول بتنسيق احترافي
-    col_widths = [25, 25, 25, 55, 20, 20, 20]
-    headers = ["التاريخ", "المرجع", "البيان", "مدين", "دائن", "الرصيد", "الاستحقاق"]
-    
-    pdf.set_fill_color(52, 73, 94) # لون كحلي للهيدر
-    pdf.set_text_color(255, 255, 255)
-    for i, header in enumerate(headers):
-        pdf.cell(col_widths[i], 10, fix_ar(header), border=1, align='C', fill=True)
-    pdf.ln()
-
-    # بيانات الجدول
-    pdf.set_text_color(0, 0, 0)
-    for _, row in df.iterrows():
-        for i, item in enumerate(row):
-            val = f"{item:,.2f}" if isinstance(item, (int, float)) else str(item)
-            pdf.cell(col_widths[i], 8, fix_ar(val), border=1, align='C')
-        pdf.ln()
-
-    # 3. التذييل والتحليل المالي (لنا / علينا)
-    pdf.ln(5)
-    final_bal = float(df.iloc[-1, -1])
-    status = "لنا مبلغ" if final_bal > 0 else "علينا مبلغ"
-    summary = f"الرصيد النهائي المستحق {status}: {abs(final_bal):,.2f} ريال"
-    
-    pdf.set_font('ArabicFont', size=12)
-    pdf.set_fill_color(240, 240, 240)
-    pdf.cell(190, 12, fix_ar(summary), border=1, ln=True, align='C', fill=True)
-    
-    return bytes(pdf.output())
-
 # --- 3. إدارة حالة الجلسة (Session State) المحدثة ---
 # تم تحديث القيم الافتراضية لتتوافق مع نظام التحقق الجديد
 states = {
@@ -226,6 +165,7 @@ with st.sidebar:
     if current_role in ["admin", "administrator", "adminstrator"] or p_reports == 1:
         menu.append("📊 تحليل المبيعات")
         menu.append("🧾 التقارير الضريبية")
+        menu.append("📅 متابعة المستحقات")
 
     # 2. صلاحيات الإعدادات
     if current_role in ["admin", "administrator", "adminstrator"] or p_settings == 1:
@@ -260,15 +200,11 @@ if choice == "🏠 الرئيسية":
     st.title("📈 الملخص المالي اللحظي")
     
     try:
-        all_accounts = database.db_fetch("accounts") 
+        # ملخص جاهز (أرصدة التصنيفات + التداول اليومي + المتأخرات) في طلب واحد
+        dashboard = database.get_dashboard_summary()
+        summary = dashboard['categories']
         
-        if not all_accounts.empty:
-            # التأكد من تحويل القيم لأرقام
-            all_accounts['current_balance'] = pd.to_numeric(all_accounts['current_balance'], errors='coerce').fillna(0)
-            
-            # تجميع البيانات
-            summary = all_accounts.groupby('category')['current_balance'].sum()
-
+        if not summary.empty:
             def get_bal(cat_list):
                 return summary[summary.index.isin(cat_list)].sum()
 
@@ -280,12 +216,8 @@ if choice == "🏠 الرئيسية":
         
         st.divider()
 
-        df_journal = database.db_fetch("journal")
-        if not df_journal.empty:
-            df_journal['date'] = pd.to_datetime(df_journal['date']).dt.date
-            df_journal['total_amount'] = pd.to_numeric(df_journal['total_amount'], errors='coerce').fillna(0)
-            
-            df_chart = df_journal.groupby('date')['total_amount'].sum().reset_index().tail(10)
+        df_chart = dashboard['turnover']
+        if not df_chart.empty:
             fig = px.line(df_chart, x='date', y='total_amount', title="📊 حجم التداول اليومي", markers=True)
             st.plotly_chart(fig, width="stretch")
         else:
@@ -293,27 +225,25 @@ if choice == "🏠 الرئيسية":
 
         # --- الجزء الجديد: تنبيهات الموردين المستحقين ---
         st.markdown("### 🔔 تنبيهات إدارة الموردين")
-        urgent_debts, critical_debts = database.get_detailed_debts()
+        overdue = dashboard['overdue']
 
         col_msg1, col_msg2 = st.columns(2)
 
         with col_msg1:
             st.markdown("#### 🗓️ مستحقات حان موعدها")
-            if not urgent_debts.empty:
-                # تجميع المبالغ حسب المورد لتجنب التكرار
-                sum_urgent = urgent_debts.groupby('acc_name')['total_amount'].sum().reset_index()
-                for _, row in sum_urgent.iterrows():
+            if not overdue.empty:
+                for _, row in overdue.iterrows():
                     st.warning(f"⚠️ **{row['acc_name']}**: مبلغ **{row['total_amount']:,.2f}** ريال")
             else:
                 st.success("✅ جميع التزاماتك المجدولة تحت السيطرة.")
 
         with col_msg2:
             st.markdown("#### 🚨 ديون متأخرة (> 30 يوم)")
-            if not critical_debts.empty:
-                sum_crit = critical_debts.groupby('acc_name')['total_amount'].sum().reset_index()
-                for _, row in sum_crit.iterrows():
+            critical = overdue[overdue['critical_amount'] > 0]
+            if not critical.empty:
+                for _, row in critical.iterrows():
                     # تنسيق بارز للديون المتأخرة جداً
-                    st.error(f"🚩 **{row['acc_name']}**: متأخر بمبلغ **{row['total_amount']:,.2f}** ريال")
+                    st.error(f"🚩 **{row['acc_name']}**: متأخر بمبلغ **{row['critical_amount']:,.2f}** ريال")
             else:
                 st.info("👍 لا توجد مديونيات متأخرة لأكثر من شهر.")
             
@@ -370,9 +300,7 @@ elif choice == "📂 دليل الحسابات":
 
                 try:
                     if st.session_state.edit_id:
-                        # حل مشكلة التعديل: نستخدم مكتبة supabase مباشرة
-                        from database import supabase
-                        supabase.table("accounts").update(account_data).eq("id", st.session_state.edit_id).execute()
+                        database.update_account(st.session_state.edit_id, account_data)
                         st.success("✅ تم التعديل بنجاح")
                     else:
                         account_data["acc_code"] = database.generate_acc_code(cat)
@@ -388,44 +316,87 @@ elif choice == "📂 دليل الحسابات":
 
     st.divider()
     st.subheader("📋 قائمة الحسابات المسجلة")
-    acc_df = database.db_fetch("accounts")
-    
+
+    # التصفية والترتيب والصفحات تتم على الخادم (صفحة واحدة فقط في المتصفح)
+    f1, f2, f3, f4, f5 = st.columns([2, 1.2, 1.2, 0.8, 0.8])
+    acc_search = f1.text_input("🔍 بحث بالاسم أو الكود أو الجوال", key="acc_grid_search")
+    acc_cat = f2.selectbox("التصنيف", ["الكل"] + cat_list[1:], key="acc_grid_cat")
+    sort_labels = {"acc_code": "الكود", "acc_name": "الاسم", "category": "التصنيف", "current_balance": "الرصيد", "credit_limit": "الائتمان"}
+    sort_by = f3.selectbox("ترتيب حسب", list(sort_labels), format_func=sort_labels.get, key="acc_grid_sort")
+    descending = f4.toggle("تنازلي", key="acc_grid_desc")
+    active_only = f5.toggle("النشطة فقط", key="acc_grid_active")
+
+    # العودة للصفحة الأولى عند تغيير التصفية أو الترتيب
+    grid_filter = (acc_search, acc_cat, sort_by, descending, active_only)
+    if st.session_state.get("acc_grid_filter") != grid_filter:
+        st.session_state.acc_grid_filter, st.session_state.acc_grid_page = grid_filter, 0
+    page = st.session_state.get("acc_grid_page", 0)
+
+    acc_df, total = database.get_accounts_page(page, sort_by=sort_by, descending=descending, search=acc_search,
+                                               category=None if acc_cat == "الكل" else acc_cat, active_only=active_only)
+
     if not acc_df.empty:
-        h = st.columns([1, 1.8, 1, 0.9, 0.9, 0.9, 0.6, 1.2])
-        titles = ["الكود", "الاسم", "التصنيف", "الافتتاحي", "الائتمان", "الرصيد", "حالة", "إدارة"]
-        for col, title in zip(h, titles): col.markdown(f"**{title}**")
-
-        for _, row in acc_df.iterrows():
-            r = st.columns([1, 1.8, 1, 0.9, 0.9, 0.9, 0.6, 1.2])
-            r[0].write(f"`{row['acc_code']}`")
-            r[1].write(row['acc_name'])
-            r[2].info(row['category'])
-            r[3].write(f"{row['opening_balance']:,.0f}")
-            r[4].write(f"{row['credit_limit']:,.0f}")
-            cur = row['current_balance']
-            r[5].markdown(f":{'green' if cur >= 0 else 'red'}[{abs(cur):,.0f}]")
-            r[6].write("🟢" if row['is_active'] else "🔴")
-            
-            with r[7]:
-                c_edit, c_del = st.columns(2)
-                if c_edit.button("📝", key=f"e_{row['id']}"):
-                    st.session_state.edit_id = row['id']
-                    st.session_state.temp_name = row['acc_name']
-                    st.session_state.temp_cat = row['category']
-                    st.session_state.temp_open = row['opening_balance']
-                    st.session_state.temp_limit = row['credit_limit']
-                    st.session_state.temp_vat = row.get('tax_number', '')
-                    st.session_state.temp_phone = row.get('phone', '')
-                    st.session_state.temp_addr = row.get('address', '')
-                    st.rerun()
-                
-                if c_del.button("🗑️", key=f"d_{row['id']}"):
-                    # حل مشكلة الحذف: نستخدم مكتبة supabase مباشرة لتجنب نقص الوسائط (data)
-                    from database import supabase
-                    supabase.table("accounts").delete().eq("id", row['id']).execute()
-                    st.success("✅ تم الحذف")
-                    st.rerun()
-            st.divider()
+        grid = acc_df.set_index("id")
+        grid_key = f"acc_grid_{page}_{abs(hash(grid_filter))}"
+        st.data_editor(
+            grid, key=grid_key, width="stretch", hide_index=True,
+            disabled=[c for c in grid.columns if c not in database.ACCOUNT_EDITABLE_COLUMNS],
+            column_config={
+                "acc_code": st.column_config.TextColumn("الكود"),
+                "acc_name": st.column_config.TextColumn("الاسم", width="medium"),
+                "category": st.column_config.SelectboxColumn("التصنيف", options=cat_list[1:], required=True),
+                "opening_balance": st.column_config.NumberColumn("الافتتاحي", format="%.0f"),
+                "credit_limit": st.column_config.NumberColumn("الائتمان", format="%.0f", min_value=0.0, step=100.0),
+                "current_balance": st.column_config.NumberColumn("الرصيد", format="%.0f"),
+                "tax_number": st.column_config.TextColumn("الرقم الضريبي"),
+                "phone": st.column_config.TextColumn("الجوال"),
+                "address": st.column_config.TextColumn("العنوان"),
+                "is_active": st.column_config.CheckboxColumn("نشط"),
+            },
+        )
+
+        # التعديلات المعلقة في الجدول تُرسل معاً في طلب واحد عند الحفظ
+        edited_rows = st.session_state.get(grid_key, {}).get("edited_rows", {})
+        changes = {int(grid.index[int(i)]): patch for i, patch in edited_rows.items()}
+
+        p_prev, p_info, p_next, p_save = st.columns([1, 2, 1, 1.5])
+        pages = max(1, -(-total // database.ACCOUNTS_PAGE_SIZE))
+        if p_prev.button("⬅️ السابق", disabled=page == 0, width='stretch', key="acc_prev"):
+            st.session_state.acc_grid_page = page - 1
+            st.rerun()
+        p_info.caption(f"صفحة {page + 1} من {pages} ({total:,} حساب)")
+        if p_next.button("التالي ➡️", disabled=page + 1 >= pages, width='stretch', key="acc_next"):
+            st.session_state.acc_grid_page = page + 1
+            st.rerun()
+        if p_save.button(f"💾 حفظ التعديلات ({len(changes)})", disabled=not changes, type="primary", width='stretch'):
+            success, msg = database.save_account_changes(changes, st.session_state.get('user_name', 'System'))
+            if success:
+                del st.session_state[grid_key]
+                st.success(msg)
+                st.rerun()
+            else:
+                st.error(msg)
+
+        # تعديل كامل (الاسم والرصيد الافتتاحي) أو حذف حساب واحد من الصفحة الحالية
+        with st.expander("📝 تعديل حساب في النموذج أو حذفه"):
+            pick = st.selectbox("الحساب", grid.index.tolist(),
+                                format_func=lambda i: f"{grid.at[i, 'acc_code']} - {grid.at[i, 'acc_name']}")
+            c_edit, c_del = st.columns(2)
+            if c_edit.button("📝 تحميل في النموذج", width='stretch'):
+                row = grid.loc[pick]
+                st.session_state.edit_id = int(pick)
+                st.session_state.temp_name = row['acc_name']
+                st.session_state.temp_cat = row['category']
+                st.session_state.temp_open = row['opening_balance'] or 0
+                st.session_state.temp_limit = row['credit_limit'] or 0
+                st.session_state.temp_vat = row.get('tax_number') or ''
+                st.session_state.temp_phone = row.get('phone') or ''
+                st.session_state.temp_addr = row.get('address') or ''
+                st.rerun()
+            if c_del.button("🗑️ حذف الحساب", width='stretch'):
+                database.db_write("accounts", action="DELETE", row_id=int(pick))
+                st.success("✅ تم الحذف")
+                st.rerun()
     else:
         st.info("لا توجد حسابات مسجلة حالياً.")
 
@@ -458,6 +429,20 @@ elif choice == "📅 متابعة المستحقات":
         st.dataframe(display_df.style.applymap(highlight_due, subset=['الأيام المتبقية']), width="stretch")
     else:
         st.info("✅ لا توجد فواتير مشتريات آجلة مستحقة حالياً.")
+
+    # أعمار الديون المتأخرة (الموردين والعملاء)
+    st.markdown("---")
+    st.subheader("⏳ أعمار الديون المتأخرة (بالأيام من تاريخ الاستحقاق)")
+    aging_cols = {'acc_name': 'الحساب', 'total': 'الإجمالي'}
+    tab_pay, tab_rec = st.tabs(["📦 الموردين (ذمم دائنة)", "👥 العملاء (ذمم مدينة)"])
+    for tab, kind in ((tab_pay, "payable"), (tab_rec, "receivable")):
+        with tab:
+            aging = database.get_aging_report(kind)
+            if aging.empty:
+                st.success("✅ لا توجد مبالغ متأخرة.")
+            else:
+                aging = aging.rename(columns=aging_cols)
+                st.dataframe(aging.style.format('{:,.2f}', subset=database.AGING_LABELS + ['الإجمالي']), width="stretch", hide_index=True)
         
 # 3. تسجيل القيود اليومية المطور (نظام التوازن التلقائي والبحث والحذف)
 elif choice == "📝 القيود اليومية":
@@ -481,7 +466,7 @@ elif choice == "📝 القيود اليومية":
             c4, c5, c6 = st.columns(3)
             amount = c4.number_input("المبلغ (قبل الضريبة)", min_value=0.0, step=1.0)
             has_vat = c5.checkbox("إضافة ضريبة 15%", value=False)
-            ref_no = c6.text_input("رقم المرجع / الفاتورة", value=database.generate_jv_ref(op_type))
+            ref_no = c6.text_input("رقم المرجع / الفاتورة", placeholder="تلقائي عند الترحيل")
             
             # --- ميزة تاريخ الاستحقاق المدمجة ---
             due_date_val = None
@@ -509,6 +494,8 @@ elif choice == "📝 القيود اليومية":
                 elif not offset_acc:
                     st.error("⚠️ لا يمكن الترحيل بدون تحديد حساب (صندوق أو بنك)")
                 else:
+                    # المرجع الآلي يُحجز عند الترحيل فقط
+                    ref_no = ref_no.strip() or database.generate_jv_ref(op_type)
                     success, msg = database.process_full_transaction(
                         acc_name=acc_name, 
                         offset_acc=offset_acc, 
@@ -519,48 +506,111 @@ elif choice == "📝 القيود اليومية":
                         ref_no=ref_no, 
                         date_str=date_op.isoformat(),
                         posted_by=st.session_state.get('user_name', 'System'),
-                        due_date=due_date_val # التمرير السليم للسحاب
+                        due_date=due_date_val, # التمرير السليم للسحاب
+                        # تسجيل الحدث في سجل الرقابة ضمن نفس عملية الترحيل
+                        audit_action="إضافة قيد",
+                        audit_details=f"تم إضافة {op_type} برقم {ref_no}"
                     )
                     
                     if success:
-                        # تسجيل الحدث في سجل الرقابة
-                        database.log_event(st.session_state.get('user_name', 'System'), 
-                                        "إضافة قيد", f"تم إضافة {op_type} برقم {ref_no}")
                         st.success(msg)
                         st.rerun()
                     else:
                         st.error(msg)
 
+        # --- استيراد جماعي للقيود من ملفات نقاط البيع والفروع ---
+        with st.expander("📥 استيراد جماعي للقيود (CSV / Excel)"):
+            st.caption("الأعمدة المطلوبة: التاريخ، الحساب، الحساب المقابل، نوع العملية، المبلغ — واختيارياً: ضريبة، البيان، المرجع، الاستحقاق")
+            import_file = st.file_uploader("اختر الملف", type=["csv", "xlsx"], key="bulk_import_file")
+            if import_file and st.button("🚀 ترحيل الملف", width='stretch'):
+                with st.spinner("جاري التحقق والترحيل على دفعات..."):
+                    success, msg, rejected = database.bulk_import_transactions(import_file, st.session_state.get('user_name', 'System'))
+                (st.success if success else st.error)(msg)
+                if not rejected.empty:
+                    st.warning(f"⚠️ عدد الصفوف المرفوضة: {len(rejected)}")
+                    st.dataframe(rejected, width="stretch", hide_index=True)
+                    st.download_button("📄 تحميل تقرير الرفض", data=rejected.to_csv(index=False).encode('utf-8-sig'),
+                                       file_name="import_rejections.csv", mime="text/csv")
+
         # --- الجزء الثاني: سجل العمليات المطور (مصحح) ---
         st.write("##") 
         st.markdown("---")
         st.subheader("📑 سجل العمليات المطور")
 
-        search_query = st.text_input("🔍 ابحث برقم المرجع أو اسم الحساب:", placeholder="اكتب هنا...")
+        c_search, c_size = st.columns([4, 1])
+        search_query = c_search.text_input("🔍 ابحث برقم المرجع أو اسم الحساب:", placeholder="اكتب هنا...")
+        page_size = c_size.selectbox("عدد القيود بالصفحة", database.JOURNAL_LOG_PAGE_SIZES, key="log_page_size")
+
+        # العودة للصفحة الأولى عند تغيير البحث أو حجم الصفحة
+        if st.session_state.get('log_view') != (search_query, page_size):
+            st.session_state.log_view = (search_query, page_size)
+            st.session_state.log_cursors, st.session_state.search_page = [None], 0
 
         if search_query:
-            recent_data = database.advanced_search_journal(search_query)
+            # نتائج البحث مرتبة بالأقرب، فتُقسم بالصفحات (offset)
+            page = st.session_state.search_page
+            recent_data = database.advanced_search_journal(search_query, limit=page_size, offset=page * page_size)
         else:
-            recent_data = database.get_recent_transactions(30)
+            # السجل: مؤشر على id لكل صفحة (قائمة المؤشرات تسمح بالرجوع للصفحة السابقة)
+            page = len(st.session_state.log_cursors) - 1
+            recent_data = database.get_journal_page(st.session_state.log_cursors[-1], limit=page_size)
+
+        c_prev, c_page, c_next = st.columns([1, 2, 1])
+        if c_prev.button("⬅️ السابق", disabled=page == 0, width='stretch', key="log_prev"):
+            if search_query:
+                st.session_state.search_page -= 1
+            else:
+                st.session_state.log_cursors.pop()
+            st.rerun()
+        c_page.caption(f"صفحة {page + 1}")
+        if c_next.button("التالي ➡️", disabled=len(recent_data) < page_size, width='stretch', key="log_next"):
+            if search_query:
+                st.session_state.search_page += 1
+            else:
+                st.session_state.log_cursors.append(int(recent_data['id'].min()))
+            st.rerun()
+
+        # نموذج التعديل يُبنى لقيد واحد فقط (القيد المختار للتعديل)
+        editing = st.session_state.get('log_edit_row')
+        if editing:
+            account_names = accounts_db['name'].tolist()
+            account_index = {name: i for i, name in enumerate(account_names)}
+            with st.form("form_edit_entry"):
+                st.write(f"### 🛠️ تعديل القيد رقم: {editing['id']}")
+                new_acc = st.selectbox("تغيير الحساب", account_names, index=account_index.get(editing['acc_name'], 0))
+                new_amt = st.number_input("المبلغ الجديد", value=float(editing['total_amount']))
+                new_desc = st.text_input("البيان الجديد", value=editing['description'])
+
+                c_save, c_cancel = st.columns(2)
+                if c_save.form_submit_button("💾 حفظ التعديلات"):
+                    success, msg = database.update_journal_entry(editing['id'], new_acc, new_amt, new_desc, editing['op_type'])
+                    if success:
+                        st.success(msg)
+                        del st.session_state['log_edit_row']
+                        st.rerun()
+                    else: st.error(msg)
+
+                if c_cancel.form_submit_button("✖️ إلغاء"):
+                    del st.session_state['log_edit_row']
+                    st.rerun()
 
         if not recent_data.empty:
-            for index, row in recent_data.iterrows():
+            for row in recent_data.to_dict('records'):
                 # استخدام .get() لتجنب خطأ KeyError
                 ref = row.get('ref_no', 'N/A')
                 acc = row.get('acc_name', 'Unknown')
                 amt = row.get('total_amount', 0.0)
-                
+
                 with st.expander(f"📄 {row.get('op_type', 'عملية')} | {acc} | مبلغ: {amt:,.2f} | مرجع: {ref}"):
                     col_info, col_action = st.columns([4, 1])
-                    
+
                     with col_info:
                         st.write(f"**البيان:** {row.get('description', '-')}")
                         # معالجة حقل المستخدم والتاريخ بأمان
                         st.write(f"**التاريخ:** {row.get('date', '-')} | **بواسطة:** {row.get('posted_by', 'Admin')}")
-                                                    
+
                     with col_action:
-                        # تحديث خاصية العرض إلى width='stretch'
-                        if st.button("🗑️ حذف", key=f"del_{row['id']}_{index}", width='stretch'):
+                        if st.button("🗑️ حذف", key=f"del_{row['id']}", width='stretch'):
                             success, msg = database.delete_journal_entry(row['id'], st.session_state.role, st.session_state.user_name)
                             if success:
                                 st.success(msg)
@@ -568,39 +618,35 @@ elif choice == "📝 القيود اليومية":
                             else:
                                 st.error(msg)
 
-                        # زر التعديل الجديد
-                        if st.button("✏️ تعديل", key=f"edit_{row['id']}_{index}", width='stretch'):
-                            st.session_state[f"edit_mode_{row['id']}"] = True
-
-                    # --- منطق ظهور نافذة التعديل ---
-                    if st.session_state.get(f"edit_mode_{row['id']}", False):
-                        with st.form(f"form_edit_{row['id']}"):
-                            st.write(f"### 🛠️ تعديل القيد رقم: {row['id']}")
-                            new_acc = st.selectbox("تغيير الحساب", accounts_db['name'].tolist(), index=accounts_db['name'].tolist().index(row['acc_name']))
-                            new_amt = st.number_input("المبلغ الجديد", value=float(row['total_amount']))
-                            new_desc = st.text_input("البيان الجديد", value=row['description'])
-                            
-                            c_save, c_cancel = st.columns(2)
-                            if c_save.form_submit_button("💾 حفظ التعديلات"):
-                                success, msg = database.update_journal_entry(row['id'], new_acc, new_amt, new_desc, row['op_type'])
-                                if success:
-                                    st.success(msg)
-                                    del st.session_state[f"edit_mode_{row['id']}"]
-                                    st.rerun()
-                                else: st.error(msg)
-                            
-                            if c_cancel.form_submit_button("✖️ إلغاء"):
-                                del st.session_state[f"edit_mode_{row['id']}"]
-                                st.rerun()
-                    
-    
-
+                        if st.button("✏️ تعديل", key=f"edit_{row['id']}", width='stretch'):
+                            st.session_state.log_edit_row = {k: row.get(k) for k in ('id', 'acc_name', 'total_amount', 'description', 'op_type')}
+                            st.rerun()
         else:
             st.info("ℹ️ لا توجد عمليات مسجلة حالياً أو مطابقة للبحث.")
 
 # 4. مركز كشف الحساب الاحترافي (النسخة المتكاملة: فلاتر + رصيد منقول + طباعة مضمونة)
 elif choice == "🔍 كشف الحساب":
     st.title("🔍 مركز مراجعة كشوفات الحساب الذكية")
+
+    # كشوف نهاية الشهر لكل العملاء والموردين دفعة واحدة
+    with st.expander("🗂️ إصدار كشوف نهاية الشهر لكل العملاء والموردين (ZIP)"):
+        b1, b2 = st.columns(2)
+        today = datetime.now()
+        batch_start = b1.date_input("من تاريخ", value=today.replace(day=1), key="batch_start")
+        batch_end = b2.date_input("إلى تاريخ", value=today, key="batch_end")
+        if st.button("🖨️ إصدار جميع الكشوف", width='stretch'):
+            progress_bar = st.progress(0.0, text="جاري تجهيز الكشوف...")
+            success, result, count = database.generate_month_end_statements(
+                batch_start.isoformat(), batch_end.isoformat(),
+                progress=lambda done, total: progress_bar.progress(done / total, text=f"تم إصدار {done} من {total} كشف"),
+            )
+            if success:
+                st.download_button("⬇️ تحميل ملف الكشوف (ZIP)", data=result,
+                                   file_name=f"Statements_{batch_end.strftime('%Y%m%d')}.zip",
+                                   mime="application/zip", width='stretch')
+                st.success(f"✅ تم إصدار {count} كشف حساب")
+            else:
+                st.error(result)
     
     # صف أدوات التحكم العلوي
     with st.container():
@@ -617,28 +663,14 @@ elif choice == "🔍 كشف الحساب":
             end_date = c3.date_input("إلى تاريخ", value=datetime.now())
 
     if selected_acc:
-        # 1. جلب البيانات وحساب الرصيد المنقول
-        orig_opening_bal = acc_list_df[acc_list_df['name'] == selected_acc]['opening_balance'].values[0]
+        # 1. الرصيد المنقول من جدول الأرصدة اليومية (استعلام واحد بدلاً من جمع كل السجل)
+        carried_forward_bal = database.get_opening_balance_logic(selected_acc, start_date.isoformat())
         
-        all_j = database.db_fetch("journal")
-        
-        if not all_j.empty:
-            # تحويل التاريخ لصيغة صحيحة (Date Object) للمقارنة مع date_input
-            all_j['jv_date'] = pd.to_datetime(all_j['jv_date']).dt.date
-            
-            # حساب ما قبل الفترة
-            pre_df = all_j[(all_j['acc_name'] == selected_acc) & (all_j['jv_date'] < start_date)]
-            pre_deb = pd.to_numeric(pre_df['debit'], errors='coerce').sum()
-            pre_crd = pd.to_numeric(pre_df['credit'], errors='coerce').sum()
-            carried_forward_bal = orig_opening_bal + (pre_deb - pre_crd)
-            
-            # جلب حركات الفترة الحالية
-            data = all_j[(all_j['acc_name'] == selected_acc) & 
-                         (all_j['jv_date'] >= start_date) & 
-                         (all_j['jv_date'] <= end_date)].sort_values(by=['jv_date', 'id'])
-        else:
-            carried_forward_bal = orig_opening_bal
-            data = pd.DataFrame()
+        # 2. جلب حركات الفترة الحالية فقط (تُفلتر في الخادم)
+        data = database.get_account_entries(selected_acc, start_date.isoformat(), end_date.isoformat())
+        if not data.empty:
+            # تحويل التاريخ لصيغة صحيحة (Date Object) للعرض والمقارنة
+            data['jv_date'] = pd.to_datetime(data['jv_date']).dt.date
 
         # --- استكمال بقية كودك (الفلاتر، عرض الجدول، الرصيد التراكمي) من هنا ---
         # (بقية الكود الخاص بـ df_filtered و final_df الذي أرسلته سابقاً)
@@ -723,7 +755,7 @@ elif choice == "🔍 كشف الحساب":
         if st.button("🖨️ إصدار كشف حساب PDF", width='stretch'):
             try:
                 # 1. استدعاء الدالة وتمرير البيانات المعروضة حالياً
-                pdf_data = create_pdf_report(display_df, selected_acc, start_date, end_date)
+                pdf_data = database.create_pdf_report(final_df.rename(columns={'الرصيد التراكمي': 'balance'}), selected_acc, start_date, end_date)
                 
                 # 2. التأكد من نجاح عملية التوليد
                 if pdf_data:
@@ -954,6 +986,14 @@ elif choice == "⚙️ الإعدادات":
                 else:
                     st.error("❌ فشل إنشاء النسخة الاحتياطية (تأكد من اتصال الإنترنت)")
 
+        if st.button("🗜️ حفظ لقطة مضغوطة (Parquet)"):
+            with st.spinner("جاري ضغط سجل القيود..."):
+                snap_path = database.create_snapshot()
+                if snap_path:
+                    st.success(f"✅ تم حفظ اللقطة في {snap_path}")
+                else:
+                    st.error("❌ فشل إنشاء اللقطة")
+
     # --- العمود الثاني: الاستعادة والصيانة (محصور للمبرمج/الأدمين) ---
     with col_s2:
         st.subheader("⏪ استعادة ذكية من السحاب")
@@ -961,7 +1001,8 @@ elif choice == "⚙️ الإعدادات":
             cloud_list = database.get_cloud_backups()
             if cloud_list:
                 # تحويل القائمة لقاموس يسهل الاختيار منه
-                options = {f"نسخة يوم {b['backup_date']} - (توقيت: {b['created_at']})": b['id'] for b in cloud_list}
+                kinds = {"delta": "فروقات", "base": "أساس"}
+                options = {f"نسخة يوم {b['backup_date']} - {kinds.get(b.get('kind'), 'كاملة')} - (توقيت: {b['created_at']})": b['id'] for b in cloud_list}
                 selected = st.selectbox("اختر النسخة المراد العودة إليها:", list(options.keys()))
                 
                 if st.button("🚀 تأكيد الاستعادة السحابية"):
@@ -974,11 +1015,51 @@ elif choice == "⚙️ الإعدادات":
                             st.error(msg)
             else:
                 st.info("لا توجد نسخ سحابية محفوظة بعد.")
+
+            snapshots = database.list_snapshots()
+            if snapshots:
+                with st.expander("⏱️ استعادة من لقطة مضغوطة (نقطة زمنية / حساب واحد)"):
+                    snap_options = {f"{s['created_at']} - {s['rows']} قيد ({s['size_bytes'] / 1024:.0f} KB)": s['path'] for s in snapshots}
+                    use_as_of = st.checkbox("استعادة حالة الدفتر في تاريخ محدد")
+                    as_of = st.date_input("التاريخ:", disabled=not use_as_of)
+                    if use_as_of:
+                        # اللقطة تحفظ حالة الدفتر لحظة أخذها فقط، فتُستخدم أحدث لقطة في التاريخ أو قبله
+                        as_of_snap = database.find_snapshot(str(as_of))
+                        if as_of_snap:
+                            st.caption(f"ستُستخدم لقطة {as_of_snap['created_at']}: القيود المضافة أو المعدلة أو المحذوفة بعدها وحتى التاريخ المختار لا تظهر في الاستعادة")
+                        else:
+                            st.warning("لا توجد لقطة مأخوذة في هذا التاريخ أو قبله")
+                    else:
+                        snap_selected = st.selectbox("اختر اللقطة:", list(snap_options.keys()))
+                    snap_accounts = database.db_fetch("accounts")
+                    acc_choice = st.selectbox("نطاق الاستعادة:", ["كل الحسابات"] + (snap_accounts['name'].tolist() if not snap_accounts.empty else []))
+
+                    if st.button("🚀 تأكيد الاستعادة من اللقطة"):
+                        with st.spinner("جاري الاستعادة..."):
+                            success, msg = database.restore_from_snapshot(
+                                None if use_as_of else snap_options[snap_selected],
+                                as_of=str(as_of) if use_as_of else None,
+                                acc_name=None if acc_choice == "كل الحسابات" else acc_choice,
+                            )
+                            if success:
+                                st.success(msg)
+                            else:
+                                st.error(msg)
             
             # قسم صيانة البيانات
             st.markdown("---")
             st.subheader("🧹 صيانة البيانات")
             st.info("استخدم هذا الزر إذا لاحظت عدم دقة في الأرصدة الظاهرة")
+            if st.button("👁️ معاينة الحسابات التي ستتغير"):
+                with st.spinner("جاري مقارنة الأرصدة..."):
+                    success, changes = database.recalculate_all_balances(dry_run=True)
+                    if not success:
+                        st.error(changes)
+                    elif changes.empty:
+                        st.success("✅ جميع الأرصدة مطابقة")
+                    else:
+                        st.dataframe(changes.rename(columns={'acc_name': 'الحساب', 'current_balance': 'الرصيد الحالي', 'new_balance': 'الرصيد الصحيح'}),
+                                     width="stretch", hide_index=True)
             if st.button("🔄 إعادة حساب أرصدة الحسابات"):
                 with st.spinner("جاري تدقيق الحسابات..."):
                     success, msg = database.recalculate_all_balances()
@@ -986,6 +1067,29 @@ elif choice == "⚙️ الإعدادات":
                         st.success(msg)
                     else:
                         st.error(msg)
+            if st.button("📅 إعادة بناء الأرصدة اليومية (كشوف الحساب)"):
+                with st.spinner("جاري بناء الأرصدة اليومية..."):
+                    success, msg = database.rebuild_daily_balances()
+                    if success:
+                        st.success(msg)
+                    else:
+                        st.error(msg)
+            if st.button("🧾 إعادة بناء الفواتير المفتوحة وتخصيص السداد"):
+                with st.spinner("جاري مطابقة السندات مع الفواتير..."):
+                    success, msg = database.rebuild_open_items()
+                    if success:
+                        st.success(msg)
+                    else:
+                        st.error(msg)
+            if st.button("🔑 ترحيل القيود إلى المفاتيح الرقمية للحسابات"):
+                bar = st.progress(0.0, text="جاري ترحيل القيود على دفعات...")
+                success, msg = database.migrate_journal_account_ids(
+                    progress=lambda last_id, done: bar.progress(0.5, text=f"حتى القيد رقم {last_id:,} ({done:,} قيد محدث)"))
+                bar.progress(1.0)
+                if success:
+                    st.success(msg)
+                else:
+                    st.warning(msg)
         else:
             # هذه الرسالة لن تظهر لك بعد الآن إذا دخلت بحساب administrator
             st.error(f"🚫 عذراً {st.session_state.get('username')}، صلاحية الاستعادة محصورة للمبرمج فقط.")
@@ -1007,9 +1111,56 @@ elif choice == "⚙️ الإعدادات":
             else:
                 st.error(f"❌ فشل الفحص: {info}")
 
+    if database.REPLICA_PATH:
+        if st.button("🗄️ مزامنة النسخة المحلية للقراءة الآن"):
+            with st.spinner("جاري المزامنة التزايدية..."):
+                stats = database.sync_replica()
+            if stats:
+                st.success("✅ تمت المزامنة: " + "، ".join(f"{t}: {n} صف" for t, n in stats.items()))
+            else:
+                st.info("ℹ️ توجد مزامنة جارية حالياً، حاول بعد لحظات.")
+
  # ... باقي كود سجل المراقبة (Audit Log) كما هو
     st.divider()
     st.subheader("🕵️ سجل العمليات الأخير (Audit Log)")
-    audit_data = database.db_fetch("SELECT * FROM audit_log ORDER BY id DESC LIMIT 20")
 
-    st.table(audit_data)
+    # الفلاتر تُطبق على الخادم، والصفحات بمؤشر على id (كلفة ثابتة مهما كبر السجل)
+    a1, a2, a3 = st.columns([1, 1, 2])
+    audit_user = a1.text_input("المستخدم", key="audit_user")
+    audit_action = a2.text_input("الإجراء يحتوي على", key="audit_action")
+    audit_range = a3.date_input("الفترة", value=(datetime.now().date() - pd.Timedelta(days=30), datetime.now().date()), key="audit_range")
+    date_from, date_to = (audit_range + (None, None))[:2] if isinstance(audit_range, tuple) else (audit_range, None)
+
+    if st.session_state.get('audit_view') != (audit_user, audit_action, date_from, date_to):
+        st.session_state.audit_view = (audit_user, audit_action, date_from, date_to)
+        st.session_state.audit_cursors = [None]
+    audit_data = database.get_audit_page(st.session_state.audit_cursors[-1], user=audit_user.strip() or None,
+                                         action=audit_action.strip() or None, date_from=date_from, date_to=date_to)
+
+    if audit_data.empty:
+        st.info("ℹ️ لا توجد أحداث مطابقة.")
+    else:
+        st.dataframe(audit_data, width="stretch", hide_index=True)
+
+    b_prev, b_page, b_next = st.columns([1, 2, 1])
+    audit_page = len(st.session_state.audit_cursors) - 1
+    if b_prev.button("⬅️ الأحدث", disabled=audit_page == 0, width='stretch', key="audit_prev"):
+        st.session_state.audit_cursors.pop()
+        st.rerun()
+    b_page.caption(f"صفحة {audit_page + 1}")
+    if b_next.button("الأقدم ➡️", disabled=len(audit_data) < database.AUDIT_PAGE_SIZE, width='stretch', key="audit_next"):
+        st.session_state.audit_cursors.append(int(audit_data['id'].min()))
+        st.rerun()
+
+    with st.expander("🗃️ أرشفة سجل الرقابة القديم"):
+        stray = database.audit_default_partition_rows()
+        if stray:
+            st.warning(f"⚠️ يوجد {stray} حدث خارج الأقسام الشهرية (أشهر لم تُجهز أقسامها بعد)، وسيتم نقلها عند الأرشفة أو التجهيز اليومي")
+        keep_months = st.number_input("مدة الاحتفاظ في القاعدة (بالأشهر)", min_value=1, value=database.AUDIT_RETENTION_MONTHS, step=1)
+        if st.button("📦 أرشفة الأشهر الأقدم"):
+            with st.spinner("جاري الأرشفة..."):
+                success, msg = database.archive_audit_log(int(keep_months))
+            if success:
+                st.success(msg)
+            else:
+                st.warning(msg)
@@ -0,0 +1,16 @@
+-- تحديث الرصيد بفرق الحركة مباشرة بدلاً من إعادة جمع كل قيود الحساب
+-- عملية ذرية واحدة في القاعدة، تكلفتها ثابتة مهما كبر سجل الحساب
+
+create or replace function increment_account_balance(p_acc_name text, p_delta numeric)
+returns numeric
+language sql
+as $$
+    update accounts
+       set current_balance = coalesce(current_balance, 0) + p_delta
+     where acc_name = p_acc_name
+    returning current_balance;
+$$;
+
+-- فهارس طرفي القيد: المطابقة الدورية للأرصدة، واستعادة قيود حساب واحد (كطرف رئيسي أو مقابل)
+create index if not exists journal_acc_name_idx on journal (acc_name);
+create index if not exists journal_offset_acc_idx on journal (offset_acc);
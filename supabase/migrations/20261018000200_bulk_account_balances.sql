@@ -0,0 +1,18 @@
+-- كتابة أرصدة عدة حسابات في طلب واحد (تستخدمها إعادة احتساب الأرصدة)
+-- p_rows: [{"id": 1, "current_balance": 150.0}, ...]
+
+create or replace function apply_account_balances(p_rows jsonb)
+returns integer
+language sql
+as $$
+    with src as (
+        select * from jsonb_to_recordset(p_rows) as r(id bigint, current_balance numeric)
+    ), upd as (
+        update accounts a
+           set current_balance = src.current_balance
+          from src
+         where a.id = src.id
+        returning a.id
+    )
+    select count(*)::integer from upd;
+$$;
@@ -0,0 +1,71 @@
+-- أرصدة يومية تراكمية لكل حساب: الرصيد المنقول = الافتتاحي + آخر cum_net قبل تاريخ البداية
+-- (استعلام واحد على المفتاح الأساسي بدلاً من جمع كل القيود السابقة)
+
+create table if not exists account_daily_balances (
+    acc_name   text    not null,
+    day        date    not null,
+    day_debit  numeric not null default 0,
+    day_credit numeric not null default 0,
+    cum_net    numeric not null default 0,  -- مجموع (مدين - دائن) حتى نهاية اليوم بدون الرصيد الافتتاحي
+    primary key (acc_name, day)
+);
+
+-- إضافة حركة يوم معين (أو عكسها بقيم سالبة) مع ترحيل أثرها على الأيام اللاحقة
+create or replace function bump_daily_balance(p_acc_name text, p_day date, p_debit numeric, p_credit numeric)
+returns void
+language plpgsql
+as $$
+declare
+    v_prev numeric;
+begin
+    select cum_net into v_prev
+      from account_daily_balances
+     where acc_name = p_acc_name and day < p_day
+     order by day desc
+     limit 1;
+
+    insert into account_daily_balances (acc_name, day, day_debit, day_credit, cum_net)
+    values (p_acc_name, p_day, p_debit, p_credit, coalesce(v_prev, 0) + p_debit - p_credit)
+    on conflict (acc_name, day) do update
+       set day_debit  = account_daily_balances.day_debit + excluded.day_debit,
+           day_credit = account_daily_balances.day_credit + excluded.day_credit,
+           cum_net    = account_daily_balances.cum_net + p_debit - p_credit;
+
+    -- القيود بتاريخ سابق تغيّر الرصيد التراكمي لكل الأيام التي تليها
+    update account_daily_balances
+       set cum_net = cum_net + p_debit - p_credit
+     where acc_name = p_acc_name and day > p_day;
+end;
+$$;
+
+create index if not exists journal_acc_name_date_idx on journal (acc_name, date);
+
+-- إعادة بناء الجدول كاملاً من القيود في معاملة واحدة: القارئ يرى الجدول القديم حتى تكتمل،
+-- والقفل يؤخر أي ترحيل متزامن (bump_daily_balance) إلى ما بعدها فلا يضيع أثره
+create or replace function rebuild_daily_balances()
+returns bigint
+language plpgsql
+as $$
+declare
+    v_count bigint;
+begin
+    lock table account_daily_balances in exclusive mode;
+    delete from account_daily_balances where true;
+
+    insert into account_daily_balances (acc_name, day, day_debit, day_credit, cum_net)
+    select acc_name, day, day_debit, day_credit,
+           sum(day_debit - day_credit) over (partition by acc_name order by day)
+      from (select acc_name, date::date as day,
+                   sum(coalesce(debit, 0)) as day_debit,
+                   sum(coalesce(credit, 0)) as day_credit
+              from journal
+             where acc_name is not null and date is not null
+             group by acc_name, date::date) d;
+    get diagnostics v_count = row_count;
+    return v_count;
+end;
+$$;
+
+-- بناء الجدول من القيود الموجودة عند إنشائه: القيود السابقة لهذا الترحيل لم تمر عبر bump_daily_balance،
+-- وجدول ناقص يعطي رصيداً منقولاً خاطئاً دون أي تنبيه
+select rebuild_daily_balances();
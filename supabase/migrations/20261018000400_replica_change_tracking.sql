@@ -0,0 +1,57 @@
+-- تتبع التغييرات للنسخة المحلية للقراءة:
+-- updated_at لالتقاط التعديلات، وجدول deleted_rows (شواهد الحذف) لالتقاط الحذف
+
+alter table accounts add column if not exists updated_at timestamptz not null default now();
+alter table journal  add column if not exists updated_at timestamptz not null default now();
+
+create or replace function touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists accounts_touch_updated_at on accounts;
+create trigger accounts_touch_updated_at before update on accounts
+    for each row execute function touch_updated_at();
+
+drop trigger if exists journal_touch_updated_at on journal;
+create trigger journal_touch_updated_at before update on journal
+    for each row execute function touch_updated_at();
+
+create index if not exists accounts_updated_at_idx on accounts (updated_at);
+create index if not exists journal_updated_at_idx on journal (updated_at);
+
+create table if not exists deleted_rows (
+    id         bigserial primary key,
+    table_name text        not null,
+    row_id     bigint      not null,
+    deleted_at timestamptz not null default now()
+);
+
+create index if not exists deleted_rows_table_idx on deleted_rows (table_name, id);
+
+create or replace function record_deleted_row()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into deleted_rows (table_name, row_id) values (tg_table_name, old.id);
+    return old;
+end;
+$$;
+
+drop trigger if exists accounts_record_delete on accounts;
+create trigger accounts_record_delete after delete on accounts
+    for each row execute function record_deleted_row();
+
+drop trigger if exists journal_record_delete on journal;
+create trigger journal_record_delete after delete on journal
+    for each row execute function record_deleted_row();
+
+drop trigger if exists audit_log_record_delete on audit_log;
+create trigger audit_log_record_delete after delete on audit_log
+    for each row execute function record_deleted_row();
@@ -0,0 +1,40 @@
+-- ترحيل قيد كامل في طلب واحد ومعاملة واحدة:
+-- إدراج القيد + تحديث رصيد الحساب + الرصيد اليومي + سطر سجل الرقابة
+-- (المكافئ المحلي للاختبار دون اتصال: local_ledger.py)
+
+create or replace function post_journal_entry(
+    p_entry         jsonb,
+    p_audit_user    text default null,
+    p_audit_action  text default null,
+    p_audit_details text default null
+)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_id     bigint;
+    v_debit  numeric := coalesce((p_entry->>'debit')::numeric, 0);
+    v_credit numeric := coalesce((p_entry->>'credit')::numeric, 0);
+begin
+    insert into journal (date, acc_name, offset_acc, op_type, description, ref_no, base_amount,
+                         tax_amount, total_amount, debit, credit, posted_by, due_date)
+    select r.date, r.acc_name, r.offset_acc, r.op_type, r.description, r.ref_no, r.base_amount,
+           r.tax_amount, r.total_amount, r.debit, r.credit, r.posted_by, r.due_date
+      from jsonb_populate_record(null::journal, p_entry) r
+    returning id into v_id;
+
+    -- الطرف الرئيسي فقط، بنفس تعريف كشف الحساب والأرصدة اليومية (الحساب المقابل للعرض)
+    update accounts
+       set current_balance = coalesce(current_balance, 0) + v_debit - v_credit
+     where acc_name = p_entry->>'acc_name';
+
+    perform bump_daily_balance(p_entry->>'acc_name', (p_entry->>'date')::date, v_debit, v_credit);
+
+    if p_audit_action is not null then
+        insert into audit_log (user_name, action, details)
+        values (p_audit_user, p_audit_action, p_audit_details);
+    end if;
+
+    return v_id;
+end;
+$$;
@@ -0,0 +1,10 @@
+-- النسخ الاحتياطي التزايدي: نسخة أساس كاملة دورية + نسخ فروقات بعدها
+-- kind:      full (الصيغة القديمة) | base | delta
+-- base_id:   نسخة الأساس التي تُبنى عليها الفروقات
+-- watermark: {"max_id": ..., "max_updated_at": ..., "max_tombstone": ...}
+
+alter table system_backups add column if not exists kind text not null default 'full';
+alter table system_backups add column if not exists base_id bigint references system_backups (id) on delete cascade;
+alter table system_backups add column if not exists watermark jsonb;
+
+create index if not exists system_backups_base_idx on system_backups (base_id, id);
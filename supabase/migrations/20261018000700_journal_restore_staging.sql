@@ -0,0 +1,53 @@
+-- الاستعادة عبر جدول وسيط: تُرفع القيود إلى journal_restore_staging على دفعات متوازية
+-- ثم تُبدَّل مع journal في معاملة واحدة، فلا يبقى الدفتر فارغاً إذا انقطعت الاستعادة
+
+create table if not exists journal_restore_staging (
+    id          bigserial primary key,
+    restore_key text   not null,
+    src_row     bigint not null,
+    payload     jsonb  not null,
+    unique (restore_key, src_row)
+);
+
+-- p_replace = true: استبدال الدفتر بالكامل، false: إضافة القيود إلى الموجود
+create or replace function swap_journal_from_staging(p_restore_key text, p_replace boolean default true)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_cols  text;
+    v_count bigint;
+begin
+    -- أعمدة journal الموجودة في النسخة فقط (ليحتفظ الباقي بقيمه الافتراضية)
+    select string_agg(quote_ident(c.column_name), ', ' order by c.ordinal_position) into v_cols
+      from information_schema.columns c
+     where c.table_schema = 'public'
+       and c.table_name = 'journal'
+       and c.column_name not in ('id', 'created_at', 'updated_at')
+       and c.column_name in (
+            select jsonb_object_keys(s.payload)
+              from (select payload from journal_restore_staging
+                     where restore_key = p_restore_key order by src_row limit 1) s);
+
+    if v_cols is null then
+        return 0;
+    end if;
+
+    if p_replace then
+        delete from journal where true;
+    end if;
+
+    execute format(
+        'insert into journal (%s) select %s
+           from journal_restore_staging s
+          cross join lateral jsonb_populate_record(null::journal, s.payload) r
+          where s.restore_key = $1
+          order by s.src_row',
+        v_cols, 'r.' || replace(v_cols, ', ', ', r.'))
+    using p_restore_key;
+    get diagnostics v_count = row_count;
+
+    delete from journal_restore_staging where restore_key = p_restore_key;
+    return v_count;
+end;
+$$;
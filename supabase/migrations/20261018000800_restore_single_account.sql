@@ -0,0 +1,52 @@
+-- استعادة حساب واحد من لقطة: عند تمرير p_acc_name تُستبدل قيود هذا الحساب فقط
+-- (كطرف رئيسي أو مقابل) بدلاً من الدفتر بالكامل
+
+drop function if exists swap_journal_from_staging(text, boolean);
+
+create or replace function swap_journal_from_staging(
+    p_restore_key text,
+    p_replace     boolean default true,
+    p_acc_name    text    default null)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_cols  text;
+    v_count bigint;
+begin
+    -- أعمدة journal الموجودة في النسخة فقط (ليحتفظ الباقي بقيمه الافتراضية)
+    select string_agg(quote_ident(c.column_name), ', ' order by c.ordinal_position) into v_cols
+      from information_schema.columns c
+     where c.table_schema = 'public'
+       and c.table_name = 'journal'
+       and c.column_name not in ('id', 'created_at', 'updated_at')
+       and c.column_name in (
+            select jsonb_object_keys(s.payload)
+              from (select payload from journal_restore_staging
+                     where restore_key = p_restore_key order by src_row limit 1) s);
+
+    -- لا شيء في الجدول الوسيط (مثلاً نقطة زمنية تسبق كل القيود): لا نحذف شيئاً
+    if v_cols is null then
+        return 0;
+    end if;
+
+    if p_replace and p_acc_name is not null then
+        delete from journal where acc_name = p_acc_name or offset_acc = p_acc_name;
+    elsif p_replace then
+        delete from journal where true;
+    end if;
+
+    execute format(
+        'insert into journal (%s) select %s
+           from journal_restore_staging s
+          cross join lateral jsonb_populate_record(null::journal, s.payload) r
+          where s.restore_key = $1
+          order by s.src_row',
+        v_cols, 'r.' || replace(v_cols, ', ', ', r.'))
+    using p_restore_key;
+    get diagnostics v_count = row_count;
+
+    delete from journal_restore_staging where restore_key = p_restore_key;
+    return v_count;
+end;
+$$;
@@ -0,0 +1,104 @@
+-- ملخص لوحة التحكم (الصفحة الرئيسية): جداول صغيرة تُحدّث تزايدياً بالمشغلات مع كل ترحيل
+-- أو تعديل أو حذف، فتقرأها الصفحة باستعلام واحد مهما كبر السجل
+
+create table if not exists dashboard_daily_turnover (
+    day          date    primary key,
+    total_amount numeric not null default 0,
+    entries      integer not null default 0
+);
+
+create table if not exists dashboard_category_balances (
+    category text    primary key,
+    balance  numeric not null default 0
+);
+
+-- التداول اليومي من القيود
+create or replace function dashboard_track_journal()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        insert into dashboard_daily_turnover as t (day, total_amount, entries)
+        values (old.date::date, -coalesce(old.total_amount, 0), -1)
+        on conflict (day) do update
+            set total_amount = t.total_amount + excluded.total_amount,
+                entries      = t.entries + excluded.entries;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        insert into dashboard_daily_turnover as t (day, total_amount, entries)
+        values (new.date::date, coalesce(new.total_amount, 0), 1)
+        on conflict (day) do update
+            set total_amount = t.total_amount + excluded.total_amount,
+                entries      = t.entries + excluded.entries;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists journal_dashboard_turnover on journal;
+create trigger journal_dashboard_turnover after insert or update of date, total_amount or delete on journal
+    for each row execute function dashboard_track_journal();
+
+-- أرصدة التصنيفات من الحسابات (تتبع تغير current_balance الذي يحدثه الترحيل)
+create or replace function dashboard_track_account()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        insert into dashboard_category_balances as c (category, balance)
+        values (coalesce(old.category, ''), -coalesce(old.current_balance, 0))
+        on conflict (category) do update set balance = c.balance + excluded.balance;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        insert into dashboard_category_balances as c (category, balance)
+        values (coalesce(new.category, ''), coalesce(new.current_balance, 0))
+        on conflict (category) do update set balance = c.balance + excluded.balance;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists accounts_dashboard_balances on accounts;
+create trigger accounts_dashboard_balances after insert or update of category, current_balance or delete on accounts
+    for each row execute function dashboard_track_account();
+
+-- تعبئة أولية من البيانات الحالية
+insert into dashboard_daily_turnover (day, total_amount, entries)
+select date::date, sum(coalesce(total_amount, 0)), count(*) from journal group by 1
+on conflict (day) do update set total_amount = excluded.total_amount, entries = excluded.entries;
+
+insert into dashboard_category_balances (category, balance)
+select coalesce(category, ''), sum(coalesce(current_balance, 0)) from accounts group by 1
+on conflict (category) do update set balance = excluded.balance;
+
+-- المشتريات الآجلة فقط (جزء صغير من السجل) لتنبيهات الموردين
+create index if not exists journal_credit_purchases_due_idx on journal (due_date)
+    where op_type like '%شراء آجل%';
+
+-- الملخص كاملاً في طلب واحد
+create or replace function get_dashboard_summary(p_days integer default 10, p_today date default current_date)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'categories', coalesce((
+            select jsonb_agg(jsonb_build_object('category', category, 'balance', balance))
+              from dashboard_category_balances), '[]'::jsonb),
+        'turnover', coalesce((
+            select jsonb_agg(jsonb_build_object('day', day, 'total_amount', total_amount) order by day)
+              from (select day, total_amount from dashboard_daily_turnover
+                     where entries > 0 order by day desc limit p_days) t), '[]'::jsonb),
+        'overdue', coalesce((
+            select jsonb_agg(jsonb_build_object('acc_name', acc_name, 'total_amount', total_amount, 'critical_amount', critical_amount))
+              from (select acc_name,
+                           sum(total_amount) as total_amount,
+                           sum(total_amount) filter (where p_today - coalesce(due_date::date, date::date + 30) > 30) as critical_amount
+                      from journal
+                     where op_type like '%شراء آجل%'
+                       and coalesce(due_date::date, date::date + 30) <= p_today
+                     group by acc_name) o), '[]'::jsonb)
+    );
+$$;
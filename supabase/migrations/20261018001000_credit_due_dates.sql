@@ -0,0 +1,43 @@
+-- محرك الاستحقاقات: فلترة فواتير الآجل غير المسددة في الخادم بدلاً من تحميل السجل كاملاً
+
+alter table journal add column if not exists settled boolean not null default false;
+
+-- فواتير قديمة بدون تاريخ استحقاق: الافتراضي 30 يوماً من تاريخ القيد (كما يفعل التطبيق)
+update journal
+   set due_date = date::date + 30
+ where due_date is null
+   and op_type in ('شراء آجل', 'بيع آجل');
+
+-- الفواتير المفتوحة فقط (جزء صغير من السجل) مرتبة بتاريخ الاستحقاق
+create index if not exists journal_open_credit_due_idx on journal (op_type, due_date)
+    where not settled and op_type in ('شراء آجل', 'بيع آجل');
+
+-- يغني عنه الفهرس السابق
+drop index if exists journal_credit_purchases_due_idx;
+
+-- تنبيهات الصفحة الرئيسية من الفواتير غير المسددة فقط
+create or replace function get_dashboard_summary(p_days integer default 10, p_today date default current_date)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'categories', coalesce((
+            select jsonb_agg(jsonb_build_object('category', category, 'balance', balance))
+              from dashboard_category_balances), '[]'::jsonb),
+        'turnover', coalesce((
+            select jsonb_agg(jsonb_build_object('day', day, 'total_amount', total_amount) order by day)
+              from (select day, total_amount from dashboard_daily_turnover
+                     where entries > 0 order by day desc limit p_days) t), '[]'::jsonb),
+        'overdue', coalesce((
+            select jsonb_agg(jsonb_build_object('acc_name', acc_name, 'total_amount', total_amount, 'critical_amount', critical_amount))
+              from (select acc_name,
+                           sum(total_amount) as total_amount,
+                           sum(total_amount) filter (where p_today - due_date::date > 30) as critical_amount
+                      from journal
+                     where not settled
+                       and op_type = 'شراء آجل'
+                       and due_date <= p_today
+                     group by acc_name) o), '[]'::jsonb)
+    );
+$$;
@@ -0,0 +1,255 @@
+-- دفتر الفواتير المفتوحة (Open Items): كل فاتورة آجلة وكل سند/مرتجع يقابلها عنصر،
+-- وتُخصص الدفعات على أقدم الفواتير المفتوحة للحساب أولاً (FIFO) عند كل ترحيل.
+-- التخصيص يلمس العناصر المفتوحة للحساب فقط، والتقارير تقرأ المتبقي (remaining) مباشرة.
+
+create table if not exists open_items (
+    id        bigserial primary key,
+    entry_id  bigint  not null unique,          -- journal.id
+    acc_name  text    not null,
+    kind      text    not null,                 -- payable (موردين) | receivable (عملاء)
+    side      text    not null,                 -- invoice (فاتورة) | payment (سند أو مرتجع)
+    doc_date  date    not null,
+    due_date  date,
+    amount    numeric not null,
+    remaining numeric not null
+);
+
+create index if not exists open_items_fifo_idx on open_items (acc_name, kind, side, doc_date, entry_id)
+    where remaining > 0;
+create index if not exists open_items_due_idx on open_items (kind, due_date)
+    where side = 'invoice' and remaining > 0;
+
+create table if not exists open_item_allocations (
+    id               bigserial primary key,
+    invoice_entry_id bigint  not null,
+    payment_entry_id bigint  not null,
+    amount           numeric not null
+);
+
+create index if not exists open_item_allocations_invoice_idx on open_item_allocations (invoice_entry_id);
+create index if not exists open_item_allocations_payment_idx on open_item_allocations (payment_entry_id);
+
+-- تصنيف نوع العملية: الطرف (موردين/عملاء) والجهة (فاتورة/دفعة)، أو null إذا لم تخص الذمم
+create or replace function open_items_kind(p_op_type text, out kind text, out side text)
+language sql
+immutable
+as $$
+    select case when p_op_type in ('شراء آجل', 'سند صرف', 'مرتجع مشتريات') then 'payable'
+                when p_op_type in ('بيع آجل', 'سند قبض', 'مرتجع مبيعات') then 'receivable' end,
+           case when p_op_type in ('شراء آجل', 'بيع آجل') then 'invoice'
+                when p_op_type in ('سند صرف', 'مرتجع مشتريات', 'سند قبض', 'مرتجع مبيعات') then 'payment' end;
+$$;
+
+-- مطابقة الدفعات غير المخصصة مع أقدم الفواتير المفتوحة لحساب واحد
+create or replace function open_items_match(p_acc_name text, p_kind text)
+returns void
+language plpgsql
+as $$
+declare
+    v_inv open_items%rowtype;
+    v_pay open_items%rowtype;
+    v_amt numeric;
+begin
+    loop
+        select * into v_inv from open_items
+         where acc_name = p_acc_name and kind = p_kind and side = 'invoice' and remaining > 0
+         order by doc_date, entry_id limit 1 for update;
+        exit when not found;
+
+        select * into v_pay from open_items
+         where acc_name = p_acc_name and kind = p_kind and side = 'payment' and remaining > 0
+         order by doc_date, entry_id limit 1 for update;
+        exit when not found;
+
+        v_amt := least(v_inv.remaining, v_pay.remaining);
+        update open_items set remaining = remaining - v_amt where id in (v_inv.id, v_pay.id);
+        insert into open_item_allocations (invoice_entry_id, payment_entry_id, amount)
+        values (v_inv.entry_id, v_pay.entry_id, v_amt);
+
+        if v_inv.remaining = v_amt then
+            update journal set settled = true where id = v_inv.entry_id;
+        end if;
+    end loop;
+end;
+$$;
+
+-- فك تخصيصات قيد (عند حذفه أو تعديله) وإعادة المبالغ للطرف المقابل
+create or replace function open_items_release(p_entry_id bigint)
+returns void
+language plpgsql
+as $$
+declare
+    r record;
+begin
+    for r in delete from open_item_allocations
+              where invoice_entry_id = p_entry_id or payment_entry_id = p_entry_id
+          returning * loop
+        if r.payment_entry_id = p_entry_id then
+            update open_items set remaining = remaining + r.amount where entry_id = r.invoice_entry_id;
+            update journal set settled = false where id = r.invoice_entry_id and settled;
+        else
+            update open_items set remaining = remaining + r.amount where entry_id = r.payment_entry_id;
+        end if;
+    end loop;
+    -- الفاتورة نفسها (عند تعديلها) تعود مفتوحة، وتُعلَّم مسددة مجدداً إذا غطتها المطابقة التالية
+    update journal set settled = false where id = p_entry_id and settled;
+    delete from open_items where entry_id = p_entry_id;
+end;
+$$;
+
+create or replace function open_items_track_journal()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_old record;
+    v_new record;
+begin
+    -- الاستعادة الجماعية تعطل المتابعة صفاً بصف ثم تعيد البناء مرة واحدة
+    if current_setting('app.skip_open_items', true) = 'on' then
+        return null;
+    end if;
+
+    if tg_op in ('UPDATE', 'DELETE') then
+        select * into v_old from open_items_kind(old.op_type);
+        if v_old.kind is not null then
+            perform open_items_release(old.id);
+            perform open_items_match(old.acc_name, v_old.kind);
+        end if;
+    end if;
+
+    if tg_op in ('INSERT', 'UPDATE') then
+        select * into v_new from open_items_kind(new.op_type);
+        if v_new.kind is not null and coalesce(new.total_amount, 0) > 0 then
+            insert into open_items (entry_id, acc_name, kind, side, doc_date, due_date, amount, remaining)
+            values (new.id, new.acc_name, v_new.kind, v_new.side, new.date::date,
+                    case when v_new.side = 'invoice' then coalesce(new.due_date::date, new.date::date + 30) end,
+                    new.total_amount, new.total_amount);
+            perform open_items_match(new.acc_name, v_new.kind);
+        end if;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists journal_open_items on journal;
+create trigger journal_open_items after insert or update of acc_name, op_type, date, due_date, total_amount or delete on journal
+    for each row execute function open_items_track_journal();
+
+-- إعادة البناء الكاملة (لحساب واحد أو للكل) من القيود
+create or replace function rebuild_open_items(p_acc_name text default null)
+returns bigint
+language plpgsql
+as $$
+declare
+    r       record;
+    v_count bigint;
+begin
+    delete from open_item_allocations a
+     using open_items i
+     where a.invoice_entry_id = i.entry_id
+       and (p_acc_name is null or i.acc_name = p_acc_name);
+    delete from open_items where p_acc_name is null or acc_name = p_acc_name;
+    update journal set settled = false where settled and (p_acc_name is null or acc_name = p_acc_name);
+
+    insert into open_items (entry_id, acc_name, kind, side, doc_date, due_date, amount, remaining)
+    select j.id, j.acc_name, k.kind, k.side, j.date::date,
+           case when k.side = 'invoice' then coalesce(j.due_date::date, j.date::date + 30) end,
+           j.total_amount, j.total_amount
+      from journal j
+     cross join lateral open_items_kind(j.op_type) k
+     where k.kind is not null
+       and coalesce(j.total_amount, 0) > 0
+       and (p_acc_name is null or j.acc_name = p_acc_name);
+    get diagnostics v_count = row_count;
+
+    for r in select distinct acc_name, kind from open_items where p_acc_name is null or acc_name = p_acc_name loop
+        perform open_items_match(r.acc_name, r.kind);
+    end loop;
+    return v_count;
+end;
+$$;
+
+select rebuild_open_items();
+
+-- الاستعادة عبر الجدول الوسيط: إيقاف المتابعة صفاً بصف ثم إعادة البناء مرة واحدة
+create or replace function swap_journal_from_staging(
+    p_restore_key text,
+    p_replace     boolean default true,
+    p_acc_name    text    default null)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_cols  text;
+    v_count bigint;
+begin
+    -- أعمدة journal الموجودة في النسخة فقط (ليحتفظ الباقي بقيمه الافتراضية)
+    select string_agg(quote_ident(c.column_name), ', ' order by c.ordinal_position) into v_cols
+      from information_schema.columns c
+     where c.table_schema = 'public'
+       and c.table_name = 'journal'
+       and c.column_name not in ('id', 'created_at', 'updated_at', 'settled')
+       and c.column_name in (
+            select jsonb_object_keys(s.payload)
+              from (select payload from journal_restore_staging
+                     where restore_key = p_restore_key order by src_row limit 1) s);
+
+    -- لا شيء في الجدول الوسيط (مثلاً نقطة زمنية تسبق كل القيود): لا نحذف شيئاً
+    if v_cols is null then
+        return 0;
+    end if;
+
+    perform set_config('app.skip_open_items', 'on', true);
+
+    if p_replace and p_acc_name is not null then
+        delete from journal where acc_name = p_acc_name or offset_acc = p_acc_name;
+    elsif p_replace then
+        delete from journal where true;
+    end if;
+
+    execute format(
+        'insert into journal (%s) select %s
+           from journal_restore_staging s
+          cross join lateral jsonb_populate_record(null::journal, s.payload) r
+          where s.restore_key = $1
+          order by s.src_row',
+        v_cols, 'r.' || replace(v_cols, ', ', ', r.'))
+    using p_restore_key;
+    get diagnostics v_count = row_count;
+
+    perform set_config('app.skip_open_items', 'off', true);
+    perform rebuild_open_items();
+
+    delete from journal_restore_staging where restore_key = p_restore_key;
+    return v_count;
+end;
+$$;
+
+-- تنبيهات الصفحة الرئيسية من المتبقي الفعلي للفواتير المفتوحة
+create or replace function get_dashboard_summary(p_days integer default 10, p_today date default current_date)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'categories', coalesce((
+            select jsonb_agg(jsonb_build_object('category', category, 'balance', balance))
+              from dashboard_category_balances), '[]'::jsonb),
+        'turnover', coalesce((
+            select jsonb_agg(jsonb_build_object('day', day, 'total_amount', total_amount) order by day)
+              from (select day, total_amount from dashboard_daily_turnover
+                     where entries > 0 order by day desc limit p_days) t), '[]'::jsonb),
+        'overdue', coalesce((
+            select jsonb_agg(jsonb_build_object('acc_name', acc_name, 'total_amount', total_amount, 'critical_amount', critical_amount))
+              from (select acc_name,
+                           sum(remaining) as total_amount,
+                           sum(remaining) filter (where p_today - due_date > 30) as critical_amount
+                      from open_items
+                     where kind = 'payable'
+                       and side = 'invoice'
+                       and remaining > 0
+                       and due_date <= p_today
+                     group by acc_name) o), '[]'::jsonb)
+    );
+$$;
@@ -0,0 +1,65 @@
+-- بحث مفهرس في القيود: تطبيع عربي + فهرس trigram + ترتيب بالتشابه + صفحات،
+-- مع طريق سريع للمطابقة التامة لرقم المرجع
+
+create extension if not exists pg_trgm;
+
+-- تطبيع النص العربي: حذف التشكيل والتطويل، توحيد الألف والياء والتاء المربوطة والهمزات
+-- (نفس منطق normalize_ar في database.py)
+create or replace function normalize_ar(p_text text)
+returns text
+language sql
+immutable
+parallel safe
+as $$
+    select lower(translate(
+        regexp_replace(coalesce(p_text, ''), '[ً-ْٰـ]', '', 'g'),
+        'أإآٱىةؤئ',
+        'اااايهوي'));
+$$;
+
+alter table journal add column if not exists search_text text
+    generated always as (normalize_ar(coalesce(acc_name, '') || ' ' || coalesce(ref_no, '') || ' ' || coalesce(description, ''))) stored;
+
+create index if not exists journal_search_trgm_idx on journal using gin (search_text gin_trgm_ops);
+create index if not exists journal_ref_no_idx on journal (ref_no);
+
+-- p_offset للصفحات التالية من نفس البحث
+create or replace function search_journal(p_query text, p_limit integer default 50, p_offset integer default 0)
+returns setof journal
+language plpgsql
+stable
+as $$
+declare
+    v_query text := normalize_ar(trim(p_query));
+    -- % و _ في نص المستخدم تُطابق حرفياً
+    v_pattern text := '%' || replace(replace(replace(v_query, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+begin
+    if v_query = '' then
+        return;
+    end if;
+
+    -- 1. المطابقة التامة لرقم المرجع (فهرس btree): إن وُجدت فهي نتيجة البحث كاملة بكل صفحاتها،
+    -- فلا تنتقل الصفحات التالية إلى البحث النصي
+    if exists (select 1 from journal where ref_no = trim(p_query)) then
+        return query
+            select * from journal where ref_no = trim(p_query)
+             order by id desc limit p_limit offset p_offset;
+        return;
+    end if;
+
+    -- 2. النص القصير جداً لا يستفيد من trigram: الأحدث أولاً
+    if length(v_query) < 3 then
+        return query
+            select * from journal where search_text like v_pattern
+             order by id desc limit p_limit offset p_offset;
+        return;
+    end if;
+
+    -- 3. البحث بالفهرس مرتباً بدرجة التشابه ثم الأحدث
+    return query
+        select * from journal
+         where search_text like v_pattern
+         order by word_similarity(v_query, search_text) desc, id desc
+         limit p_limit offset p_offset;
+end;
+$$;
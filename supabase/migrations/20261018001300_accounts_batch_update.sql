@@ -0,0 +1,30 @@
+-- تعديل عدة حسابات في طلب واحد (جدول دليل الحسابات)
+-- p_rows: [{"id": 1, "credit_limit": 5000, "is_active": false}, ...]
+-- يُحدث فقط الأعمدة الموجودة في كل عنصر، والأعمدة المسموح بها فقط (الاسم والأرصدة لها مسارات خاصة)
+
+create or replace function update_accounts_batch(p_rows jsonb)
+returns integer
+language sql
+as $$
+    with src as (
+        -- jsonb_populate_record يحول القيم إلى أنواع أعمدة الجدول
+        select x as patch, jsonb_populate_record(null::accounts, x) as r
+          from jsonb_array_elements(p_rows) x
+    ), upd as (
+        update accounts a
+           set category     = case when src.patch ? 'category'     then (src.r).category     else a.category end,
+               tax_number   = case when src.patch ? 'tax_number'   then (src.r).tax_number   else a.tax_number end,
+               phone        = case when src.patch ? 'phone'        then (src.r).phone        else a.phone end,
+               address      = case when src.patch ? 'address'      then (src.r).address      else a.address end,
+               credit_limit = case when src.patch ? 'credit_limit' then (src.r).credit_limit else a.credit_limit end,
+               is_active    = case when src.patch ? 'is_active'    then (src.r).is_active    else a.is_active end
+          from src
+         where a.id = (src.r).id
+        returning a.id
+    )
+    select count(*)::integer from upd;
+$$;
+
+-- فهارس الترتيب والتصفية في جدول الحسابات
+create index if not exists accounts_category_code_idx on accounts (category, acc_code);
+create index if not exists accounts_acc_code_idx on accounts (acc_code);
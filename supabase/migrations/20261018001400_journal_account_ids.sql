@@ -0,0 +1,177 @@
+-- مفاتيح رقمية للحسابات في القيود (acc_id / offset_acc_id) بدلاً من البحث بالاسم النصي
+-- الأسماء تبقى في القيد كنسخة للعرض، والمفتاح الرقمي هو المعتمد في الاستعلامات والربط
+
+alter table journal add column if not exists acc_id bigint references accounts (id) on delete set null;
+alter table journal add column if not exists offset_acc_id bigint references accounts (id) on delete set null;
+
+create index if not exists journal_acc_id_date_idx on journal (acc_id, date);
+create index if not exists journal_offset_acc_id_idx on journal (offset_acc_id);
+
+-- القيود التي لم تأخذ مفاتيحها بعد (يفرغ بعد اكتمال الترحيل)
+create index if not exists journal_account_ids_pending_idx on journal (id)
+    where (acc_id is null and acc_name is not null) or (offset_acc_id is null and offset_acc is not null);
+
+-- ملء المفتاح من الاسم (أو الاسم من المفتاح) عند الإدراج والتعديل، فتبقى كل طرق الكتابة الحالية كما هي
+create or replace function journal_fill_account_ids()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'INSERT' or new.acc_name is distinct from old.acc_name then
+        if new.acc_name is not null then
+            select id into new.acc_id from accounts where acc_name = new.acc_name;
+        elsif new.acc_id is not null then
+            select acc_name into new.acc_name from accounts where id = new.acc_id;
+        end if;
+    elsif new.acc_id is distinct from old.acc_id then
+        select acc_name into new.acc_name from accounts where id = new.acc_id;
+    end if;
+
+    if tg_op = 'INSERT' or new.offset_acc is distinct from old.offset_acc then
+        if new.offset_acc is not null then
+            select id into new.offset_acc_id from accounts where acc_name = new.offset_acc;
+        elsif new.offset_acc_id is not null then
+            select acc_name into new.offset_acc from accounts where id = new.offset_acc_id;
+        end if;
+    elsif new.offset_acc_id is distinct from old.offset_acc_id then
+        select acc_name into new.offset_acc from accounts where id = new.offset_acc_id;
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists journal_fill_account_ids on journal;
+create trigger journal_fill_account_ids before insert or update of acc_name, offset_acc, acc_id, offset_acc_id on journal
+    for each row execute function journal_fill_account_ids();
+
+-- ترحيل القيود القديمة على دفعات (Keyset على id): تعيد آخر id تمت معالجته وعدد القيود المحدثة
+-- p_after: آخر id من الدفعة السابقة (null للبداية)، والنتيجة last_id = null تعني انتهاء الترحيل
+create or replace function backfill_journal_account_ids(p_after bigint default null, p_batch integer default 5000)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_last bigint;
+    v_updated integer;
+begin
+    select max(id) into v_last
+      from (select id from journal
+             where id > coalesce(p_after, 0)
+               and ((acc_id is null and acc_name is not null) or (offset_acc_id is null and offset_acc is not null))
+             order by id
+             limit p_batch) batch;
+
+    if v_last is null then
+        return jsonb_build_object('last_id', null, 'updated', 0);
+    end if;
+
+    update journal j
+       set acc_id = coalesce(j.acc_id, a.id),
+           offset_acc_id = coalesce(j.offset_acc_id, o.id)
+      from journal src
+      left join accounts a on a.acc_name = src.acc_name
+      left join accounts o on o.acc_name = src.offset_acc
+     where j.id = src.id
+       and src.id > coalesce(p_after, 0) and src.id <= v_last
+       and ((src.acc_id is null and a.id is not null) or (src.offset_acc_id is null and o.id is not null));
+    get diagnostics v_updated = row_count;
+
+    return jsonb_build_object('last_id', v_last, 'updated', v_updated);
+end;
+$$;
+
+-- عدد القيود التي ما زالت تنتظر مفاتيحها (الأسماء غير الموجودة في دليل الحسابات لا تُحسب)
+create or replace function journal_account_ids_pending()
+returns bigint
+language sql
+stable
+as $$
+    select count(*)
+      from journal j
+     where (j.acc_id is null and j.acc_name is not null and exists (select 1 from accounts a where a.acc_name = j.acc_name))
+        or (j.offset_acc_id is null and j.offset_acc is not null and exists (select 1 from accounts a where a.acc_name = j.offset_acc));
+$$;
+
+-- تحديث الرصيد بالفرق عبر المفتاح الرقمي
+create or replace function increment_account_balance_by_id(p_acc_id bigint, p_delta numeric)
+returns numeric
+language sql
+as $$
+    update accounts
+       set current_balance = coalesce(current_balance, 0) + p_delta
+     where id = p_acc_id
+    returning current_balance;
+$$;
+
+-- إعادة تسمية حساب: القيود مرتبطة بالمفتاح، فيُحدث فقط نسخة الاسم في قيود هذا الحساب (عبر الفهرس)
+-- مع نقل الفواتير المفتوحة والأرصدة اليومية للاسم الجديد
+create or replace function rename_account(p_acc_id bigint, p_new_name text)
+returns integer
+language plpgsql
+as $$
+declare
+    v_old text;
+    v_rows integer;
+begin
+    select acc_name into v_old from accounts where id = p_acc_id for update;
+    if not found or v_old is not distinct from p_new_name then
+        return 0;
+    end if;
+
+    update accounts set acc_name = p_new_name where id = p_acc_id;
+
+    -- الفواتير المفتوحة تُنقل مباشرة بدلاً من إعادة مطابقتها لكل قيد
+    perform set_config('app.skip_open_items', 'on', true);
+    -- القيود التي لم يصلها الترحيل بعد (المفتاح فارغ) تُنقل بالاسم القديم، والـ trigger يملأ مفتاحها من الاسم الجديد
+    update journal set acc_name = p_new_name
+     where acc_id = p_acc_id or (acc_id is null and acc_name = v_old);
+    get diagnostics v_rows = row_count;
+    update journal set offset_acc = p_new_name
+     where offset_acc_id = p_acc_id or (offset_acc_id is null and offset_acc = v_old);
+    perform set_config('app.skip_open_items', 'off', true);
+
+    update open_items set acc_name = p_new_name where acc_name = v_old;
+    update account_daily_balances set acc_name = p_new_name where acc_name = v_old;
+    return v_rows;
+end;
+$$;
+
+-- الترحيل الذري بالمفتاح الرقمي: الـ trigger يملأ acc_id من الاسم عند الإدراج، فيُحدَّث الرصيد
+-- بالمفتاح الأساسي بدلاً من البحث بالاسم (الأرصدة اليومية تبقى بالاسم، وrename_account ينقلها)
+create or replace function post_journal_entry(
+    p_entry         jsonb,
+    p_audit_user    text default null,
+    p_audit_action  text default null,
+    p_audit_details text default null
+)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_id     bigint;
+    v_acc_id bigint;
+    v_debit  numeric := coalesce((p_entry->>'debit')::numeric, 0);
+    v_credit numeric := coalesce((p_entry->>'credit')::numeric, 0);
+begin
+    insert into journal (date, acc_name, offset_acc, op_type, description, ref_no, base_amount,
+                         tax_amount, total_amount, debit, credit, posted_by, due_date)
+    select r.date, r.acc_name, r.offset_acc, r.op_type, r.description, r.ref_no, r.base_amount,
+           r.tax_amount, r.total_amount, r.debit, r.credit, r.posted_by, r.due_date
+      from jsonb_populate_record(null::journal, p_entry) r
+    returning id, acc_id into v_id, v_acc_id;
+
+    -- الطرف الرئيسي فقط، بنفس تعريف كشف الحساب والأرصدة اليومية (الحساب المقابل للعرض)
+    update accounts
+       set current_balance = coalesce(current_balance, 0) + v_debit - v_credit
+     where id = v_acc_id;
+
+    perform bump_daily_balance(p_entry->>'acc_name', (p_entry->>'date')::date, v_debit, v_credit);
+
+    if p_audit_action is not null then
+        insert into audit_log (user_name, action, details)
+        values (p_audit_user, p_audit_action, p_audit_details);
+    end if;
+
+    return v_id;
+end;
+$$;
@@ -0,0 +1,31 @@
+-- عدادات الترقيم المتسلسل (أكواد الحسابات ومراجع القيود)
+-- كل عملية تحجز كتلة أرقام في طلب واحد ذري وتوزعها محلياً، بدلاً من البحث عن آخر رقم في كل مرة
+
+create table if not exists counters (
+    name       text        primary key,   -- بادئة الترقيم مع السنة، مثل SUP2026 أو INV2026
+    last_value bigint      not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+-- حجز p_count رقماً متتالياً من العداد p_name (يُنشأ عند أول استخدام)، وتعيد أول رقم في الكتلة
+create or replace function reserve_sequence_block(p_name text, p_count integer default 1)
+returns bigint
+language sql
+as $$
+    insert into counters as c (name, last_value)
+    values (p_name, p_count)
+    on conflict (name) do update
+        set last_value = c.last_value + p_count,
+            updated_at = now()
+    returning last_value - p_count + 1;
+$$;
+
+-- بدء العدادات بعد آخر رقم مستخدم فعلاً: أكواد الحسابات PREFIX2026-0001 ومراجع القيود PREFIX2026-000001
+-- (بعدد الخانات المستخدم فقط، فلا تؤثر القيم الحرة أو الأكواد بصيغة أخرى على العداد)
+insert into counters (name, last_value)
+select split_part(code, '-', 1), max(split_part(code, '-', 2)::bigint)
+  from (select acc_code as code from accounts where acc_code ~ '^[A-Z]+[0-9]{4}-[0-9]{4}$'
+        union all
+        select ref_no from journal where ref_no ~ '^[A-Z]+[0-9]{4}-[0-9]{6}$') used
+ group by 1
+on conflict (name) do update set last_value = greatest(counters.last_value, excluded.last_value);
@@ -0,0 +1,161 @@
+-- تقسيم سجل الرقابة إلى أقسام شهرية حسب created_at
+-- الأقسام القديمة تُؤرشف محلياً (ملفات مضغوطة) ثم تُحذف كاملة بدلاً من حذف الصفوف واحداً واحداً،
+-- والقراءة بفلتر التاريخ لا تلمس إلا أقسام الفترة المطلوبة
+
+-- شواهد الحذف للنسخة المحلية باسم الجدول الأصلي (tg_table_name في الأقسام هو اسم القسم)،
+-- مع تجاهل النقل الداخلي بين القسم الافتراضي والأقسام الشهرية
+create or replace function record_deleted_audit_row()
+returns trigger
+language plpgsql
+as $$
+begin
+    if coalesce(current_setting('app.audit_moving', true), '') <> 'on' then
+        insert into deleted_rows (table_name, row_id) values ('audit_log', old.id);
+    end if;
+    return old;
+end;
+$$;
+
+-- 1. تحويل الجدول الحالي إلى جدول مقسم (مرة واحدة)
+do $$
+begin
+    if exists (select 1 from pg_class where relname = 'audit_log' and relnamespace = 'public'::regnamespace and relkind = 'r') then
+        alter table audit_log rename to audit_log_legacy;
+
+        create table audit_log (like audit_log_legacy including defaults including comments) partition by range (created_at);
+        create sequence if not exists audit_log_seq;
+        perform setval('audit_log_seq', coalesce((select max(id) from audit_log_legacy), 0) + 1, false);
+        alter table audit_log alter column id set default nextval('audit_log_seq');
+        alter sequence audit_log_seq owned by audit_log.id;
+        alter table audit_log alter column created_at set default now();
+        alter table audit_log alter column created_at set not null;
+        alter table audit_log add primary key (id, created_at);
+
+        create table audit_log_default partition of audit_log default;
+    end if;
+end;
+$$;
+
+create index if not exists audit_log_user_id_idx on audit_log (user_name, id);
+create index if not exists audit_log_action_id_idx on audit_log (action, id);
+
+drop trigger if exists audit_log_record_delete on audit_log;
+create trigger audit_log_record_delete after delete on audit_log
+    for each row execute function record_deleted_audit_row();
+
+-- 2. إنشاء الأقسام الشهرية من شهر p_from ولعدد p_months شهر، وأقسام أي أشهر وصلت أحداثها للقسم الافتراضي
+-- (ما وصل منها للقسم الافتراضي يُنقل إليها). تعمل بصلاحيات مالك الجدول (security definer):
+-- إنشاء الأقسام وربطها يحتاج ملكية audit_log، والتطبيق يستدعيها بصلاحيات دور الـ API
+create or replace function ensure_audit_partitions(p_from date default current_date, p_months integer default 3)
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_start date;
+    v_end date;
+    v_name text;
+    v_created integer := 0;
+begin
+    for v_start in
+        select (date_trunc('month', p_from) + make_interval(months => i))::date
+          from generate_series(0, greatest(p_months, 1) - 1) i
+        union
+        select distinct date_trunc('month', created_at)::date from audit_log_default
+        order by 1
+    loop
+        v_end := (v_start + interval '1 month')::date;
+        v_name := format('audit_log_%s', to_char(v_start, 'YYYY_MM'));
+        continue when to_regclass(v_name) is not null;
+
+        execute format('create table %I (like audit_log including defaults)', v_name);
+        perform set_config('app.audit_moving', 'on', true);
+        execute format(
+            'with moved as (delete from audit_log_default where created_at >= %L and created_at < %L returning *) insert into %I select * from moved',
+            v_start, v_end, v_name);
+        perform set_config('app.audit_moving', 'off', true);
+        execute format('alter table audit_log attach partition %I for values from (%L) to (%L)', v_name, v_start, v_end);
+        v_created := v_created + 1;
+    end loop;
+    return v_created;
+end;
+$$;
+
+-- 3. الأقسام الشهرية الحالية (للأرشفة): الاسم، بداية الشهر، نهايته، وعدد الصفوف التقريبي
+create or replace function audit_log_partitions()
+returns table (name text, range_start date, range_end date, approx_rows bigint)
+language sql
+stable
+as $$
+    select c.relname::text,
+           to_date(substring(c.relname from '^audit_log_(\d{4}_\d{2})$'), 'YYYY_MM'),
+           (to_date(substring(c.relname from '^audit_log_(\d{4}_\d{2})$'), 'YYYY_MM') + interval '1 month')::date,
+           greatest(c.reltuples, 0)::bigint
+      from pg_inherits i
+      join pg_class c on c.oid = i.inhrelid
+     where i.inhparent = 'audit_log'::regclass
+       and c.relname ~ '^audit_log_\d{4}_\d{2}$'
+     order by 2;
+$$;
+
+-- عدد الصفوف في القسم الافتراضي: يجب أن يبقى صفراً، وإلا فالأقسام الشهرية لم تُجهز في وقتها
+create or replace function audit_log_default_rows()
+returns bigint
+language sql
+stable
+as $$
+    select count(*) from audit_log_default;
+$$;
+
+-- 4. حذف قسم شهري كامل بعد أرشفته (فصل ثم حذف، بدون المرور على الصفوف)
+-- بصلاحيات مالك الجدول مثل ensure_audit_partitions، ولا تقبل إلا أسماء الأقسام الشهرية لـ audit_log
+create or replace function drop_audit_partition(p_name text)
+returns boolean
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    if p_name !~ '^audit_log_\d{4}_\d{2}$' or not exists (
+        select 1 from pg_inherits where inhparent = 'audit_log'::regclass and inhrelid = to_regclass(p_name)
+    ) then
+        return false;
+    end if;
+    execute format('alter table audit_log detach partition %I', p_name);
+    execute format('drop table %I', p_name);
+    return true;
+end;
+$$;
+
+-- 5. أقسام البيانات الموجودة والأشهر القادمة، ثم نقل البيانات القديمة وحذف الجدول السابق
+do $$
+declare
+    v_first date;
+begin
+    if to_regclass('audit_log_legacy') is not null then
+        update audit_log_legacy set created_at = now() where created_at is null;
+        select coalesce(min(created_at)::date, current_date) into v_first from audit_log_legacy;
+        perform ensure_audit_partitions(v_first,
+            ((extract(year from current_date) - extract(year from v_first)) * 12
+             + extract(month from current_date) - extract(month from v_first))::integer + 3);
+        insert into audit_log select * from audit_log_legacy;
+        drop table audit_log_legacy;
+    else
+        perform ensure_audit_partitions(current_date, 3);
+    end if;
+end;
+$$;
+
+-- 6. تجهيز أقسام الأشهر القادمة يومياً داخل القاعدة إن كانت pg_cron متاحة
+-- (التطبيق يستدعي ensure_audit_partitions أيضاً عند بدء كاتب السجل ومرة كل يوم)
+do $$
+begin
+    if exists (select 1 from pg_available_extensions where name = 'pg_cron') then
+        create extension if not exists pg_cron;
+        perform cron.schedule('ensure-audit-partitions', '15 0 * * *', 'select ensure_audit_partitions()');
+    end if;
+exception when others then
+    raise notice 'pg_cron غير متاح (%): الأقسام تُجهز من التطبيق فقط', sqlerrm;
+end;
+$$;
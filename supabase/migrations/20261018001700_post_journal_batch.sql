@@ -0,0 +1,44 @@
+-- ترحيل دفعة قيود كاملة (الاستيراد الجماعي) في طلب واحد ومعاملة واحدة:
+-- إدراج القيود + تحديث رصيد كل حساب مرة واحدة + الأرصدة اليومية، فإما أن تُحفظ الدفعة بآثارها أو لا شيء
+-- p_entries: [{"date": "2026-01-10", "acc_name": "...", "debit": 115.0, ...}, ...]
+
+create or replace function post_journal_batch(p_entries jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    v_count integer;
+    v_daily jsonb;
+    v_day   record;
+begin
+    with ins as (
+        insert into journal (date, acc_name, offset_acc, op_type, description, ref_no, base_amount,
+                             tax_amount, total_amount, debit, credit, posted_by, due_date)
+        select r.date, r.acc_name, r.offset_acc, r.op_type, r.description, r.ref_no, r.base_amount,
+               r.tax_amount, r.total_amount, r.debit, r.credit, r.posted_by, r.due_date
+          from jsonb_populate_recordset(null::journal, p_entries) r
+        returning acc_id, acc_name, date, coalesce(debit, 0) as debit, coalesce(credit, 0) as credit
+    ), balances as (
+        -- الطرف الرئيسي فقط، بنفس تعريف post_journal_entry وكشف الحساب
+        update accounts a
+           set current_balance = coalesce(a.current_balance, 0) + s.net
+          from (select acc_id, sum(debit - credit) as net from ins where acc_id is not null group by acc_id) s
+         where a.id = s.acc_id
+    )
+    select count(*)::integer,
+           coalesce((select jsonb_agg(jsonb_build_object('acc_name', acc_name, 'day', day, 'debit', debit, 'credit', credit))
+                       from (select acc_name, date::date as day, sum(debit) as debit, sum(credit) as credit
+                               from ins
+                              where acc_name is not null and date is not null
+                              group by 1, 2) d), '[]'::jsonb)
+      into v_count, v_daily
+      from ins;
+
+    -- حركة كل (حساب، يوم) مرة واحدة للدفعة
+    for v_day in select * from jsonb_to_recordset(v_daily) as d(acc_name text, day date, debit numeric, credit numeric) loop
+        perform bump_daily_balance(v_day.acc_name, v_day.day, v_day.debit, v_day.credit);
+    end loop;
+
+    return v_count;
+end;
+$$;
@@ -0,0 +1,87 @@
+"""
+اختبارات الترحيل الذري على البديل المحلي (local_ledger) دون اتصال:
+    python -m unittest discover tests
+"""
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import local_ledger
+
+
+def _entry(**overrides):
+    entry = {
+        "date": "2026-01-10", "acc_name": "عميل أ", "offset_acc": "الصندوق", "op_type": "بيع آجل",
+        "description": "فاتورة", "ref_no": "INV2026-000001", "base_amount": 100.0, "tax_amount": 15.0,
+        "total_amount": 115.0, "debit": 115.0, "credit": 0.0, "posted_by": "tester", "due_date": "2026-02-09",
+    }
+    entry.update(overrides)
+    return entry
+
+
+class PostJournalEntryTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = local_ledger.connect(":memory:")
+        self.conn.executemany(
+            "INSERT INTO accounts (acc_name, category, current_balance) VALUES (?, ?, ?)",
+            [("عميل أ", "عميل", 0), ("الصندوق", "صندوق/كاش", 500)],
+        )
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def balance(self, acc_name):
+        return self.conn.execute("SELECT current_balance FROM accounts WHERE acc_name = ?", (acc_name,)).fetchone()[0]
+
+    def daily(self, acc_name):
+        return self.conn.execute(
+            "SELECT day, day_debit, day_credit, cum_net FROM account_daily_balances WHERE acc_name = ? ORDER BY day",
+            (acc_name,),
+        ).fetchall()
+
+    def test_posts_entry_balances_daily_and_audit_together(self):
+        entry_id = local_ledger.post_journal_entry(self.conn, _entry(), "tester", "ترحيل قيد", "INV2026-000001")
+
+        row = self.conn.execute("SELECT acc_name, offset_acc, debit, credit FROM journal WHERE id = ?", (entry_id,)).fetchone()
+        self.assertEqual(row, ("عميل أ", "الصندوق", 115.0, 0.0))
+        self.assertEqual(self.balance("عميل أ"), 115.0)
+        self.assertEqual(self.balance("الصندوق"), 500.0)
+        self.assertEqual(self.daily("عميل أ"), [("2026-01-10", 115.0, 0.0, 115.0)])
+        audit = self.conn.execute("SELECT user_name, action, details FROM audit_log").fetchall()
+        self.assertEqual(audit, [("tester", "ترحيل قيد", "INV2026-000001")])
+
+    def test_no_audit_row_without_action(self):
+        local_ledger.post_journal_entry(self.conn, _entry())
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0], 0)
+
+    def test_backdated_entry_carries_into_later_days(self):
+        local_ledger.post_journal_entry(self.conn, _entry(date="2026-01-10", debit=100.0, credit=0.0))
+        local_ledger.post_journal_entry(self.conn, _entry(date="2026-01-20", debit=0.0, credit=30.0))
+        local_ledger.post_journal_entry(self.conn, _entry(date="2026-01-05", debit=10.0, credit=0.0))
+
+        self.assertEqual(self.daily("عميل أ"), [
+            ("2026-01-05", 10.0, 0.0, 10.0),
+            ("2026-01-10", 100.0, 0.0, 110.0),
+            ("2026-01-20", 0.0, 30.0, 80.0),
+        ])
+        self.assertEqual(self.balance("عميل أ"), 80.0)
+
+    def test_failure_rolls_back_every_step(self):
+        self.conn.execute("DROP TABLE audit_log")
+        self.conn.commit()
+
+        with self.assertRaises(sqlite3.OperationalError):
+            local_ledger.post_journal_entry(self.conn, _entry(), "tester", "ترحيل قيد", "INV2026-000001")
+
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0], 0)
+        self.assertEqual(self.balance("عميل أ"), 0.0)
+        self.assertEqual(self.balance("الصندوق"), 500.0)
+        self.assertEqual(self.daily("عميل أ"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()